@@ -46,19 +46,31 @@ def process_queue():
             continue
 
         saved_as = data.get("saved_as") or data.get("file_name")
-        file_path = Path(data.get("file_path", ""))
+        # blob_name があるリクエストはクライアントが Blob に直接アップロードしたもの
+        blob_name = data.get("blob_name")
+        file_path = Path(data.get("file_path") or "")
         _update_status(data, "processing")
         _write_json(queue_file, data)
 
-        if not file_path.exists():
-            _update_status(data, "failed", "file missing")
+        missing_error = ""
+        if blob_name and not uploader.use_blob_storage:
+            missing_error = "blob storage not configured"
+        elif not blob_name and not file_path.is_file():
+            missing_error = "file missing"
+        if missing_error:
+            _update_status(data, "failed", missing_error)
             _write_json(PROCESSED_DIR / queue_file.name, data)
             queue_file.unlink(missing_ok=True)
             failed += 1
             continue
 
         try:
-            success, _, status = uploader.upload_single_file(file_path)
+            # 取り込み時に計算済みの MD5 を使い、ファイルの再読み込みを避ける
+            known_md5 = data.get("md5")
+            if blob_name:
+                success, _, status = uploader.upload_single_file_from_blob(blob_name, known_md5)
+            else:
+                success, _, status = uploader.upload_single_file(file_path, known_md5)
             if success:
                 _update_status(data, "completed")
                 processed += 1
@@ -72,7 +84,7 @@ def process_queue():
         # move request file to processed and cleanup file
         _write_json(PROCESSED_DIR / queue_file.name, data)
         queue_file.unlink(missing_ok=True)
-        if file_path.exists():
+        if not blob_name and file_path.exists():
             try:
                 file_path.unlink()
             except Exception:
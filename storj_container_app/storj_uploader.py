@@ -67,8 +67,11 @@ class StorjUploader:
 
             if account_name and account_key:
                 try:
+                    # Azurite 等のエミュレーター利用時は AZURE_STORAGE_BLOB_ENDPOINT で上書き
+                    account_url = os.getenv('AZURE_STORAGE_BLOB_ENDPOINT', '').rstrip('/') or \
+                        f"https://{account_name}.blob.core.windows.net"
                     self.blob_service_client = BlobServiceClient(
-                        account_url=f"https://{account_name}.blob.core.windows.net",
+                        account_url=account_url,
                         credential=account_key
                     )
                     self.use_blob_storage = True
@@ -157,12 +160,13 @@ class StorjUploader:
         else:
             return name_without_ext, None, None, extension
 
-    def check_duplicate_by_hash_and_name(self, file_path, existing_files):
+    def check_duplicate_by_hash_and_name(self, file_path, existing_files, file_hash=None):
         """
         Check if file with same name and hash already exists.
         Returns: (should_skip, reason)
         """
-        file_hash = self.calculate_file_hash(file_path)
+        if file_hash is None:
+            file_hash = self.calculate_file_hash(file_path)
         original_name = file_path.name
 
         # Parse original filename
@@ -179,17 +183,20 @@ class StorjUploader:
 
         return False, ""
 
-    def get_unique_filename(self, file_path, remote_path):
+    def get_unique_filename(self, file_path, remote_path, file_hash=None):
         """
         Check if file exists in remote and generate unique filename with hash+suffix if needed.
+        file_hash: hash prefix computed at ingest time (the file is hashed here only if omitted)
         Returns: (unique_filename, needs_suffix, should_skip, skip_reason)
         """
+        if file_hash is None:
+            file_hash = self.calculate_file_hash(file_path)
+
         command = f"rclone ls {remote_path}"
         success, output = self.run_rclone_command(command)
 
         if not success:
             # If we can't list files, assume no conflict
-            file_hash = self.calculate_file_hash(file_path)
             name_parts = file_path.name.rsplit('.', 1)
             if len(name_parts) == 2:
                 base_name, extension = name_parts
@@ -208,13 +215,10 @@ class StorjUploader:
                         existing_files.append(parts[1])
 
         # Check for duplicate by hash and name
-        should_skip, skip_reason = self.check_duplicate_by_hash_and_name(file_path, existing_files)
+        should_skip, skip_reason = self.check_duplicate_by_hash_and_name(file_path, existing_files, file_hash)
         if should_skip:
             return "", False, True, skip_reason
 
-        # Calculate file hash
-        file_hash = self.calculate_file_hash(file_path)
-
         # Parse original filename
         name_parts = file_path.name.rsplit('.', 1)
         if len(name_parts) == 2:
@@ -324,8 +328,11 @@ class StorjUploader:
         except Exception as e:
             return False, b"", str(e)
 
-    def upload_single_file(self, file_path):
-        """Upload a single file and return result"""
+    def upload_single_file(self, file_path, known_md5=None):
+        """
+        Upload a single file and return result
+        known_md5: MD5 the API computed at ingest time (queue record); avoids re-reading the file
+        """
         thread_id = threading.current_thread().name
         try:
             # Get file date (from filename or file system) and format as YYYYMM
@@ -342,7 +349,10 @@ class StorjUploader:
                 print(f"[{thread_id}] Uploading {file_path.name} to {remote_path}... (date: {file_date.strftime('%Y-%m-%d')})")
 
             # Get unique filename and check for duplicates
-            unique_filename, has_suffix, should_skip, skip_reason = self.get_unique_filename(file_path, remote_path)
+            file_hash = known_md5[:self.hash_length].lower() if known_md5 else None
+            unique_filename, has_suffix, should_skip, skip_reason = self.get_unique_filename(
+                file_path, remote_path, file_hash
+            )
 
             if should_skip:
                 with self.lock:
@@ -449,8 +459,12 @@ class StorjUploader:
                 print(f"[{thread_id}] Exception uploading {file_path.name}: {e}")
             return False, file_path, f"exception: {e}"
 
-    def upload_single_file_from_blob(self, blob_name):
-        """Download blob, upload to Storj, then move to uploaded container"""
+    def upload_single_file_from_blob(self, blob_name, known_md5=None):
+        """
+        Download blob, upload to Storj, then move to uploaded container
+        known_md5: MD5 the API computed at ingest time (queue record). Blob metadata / Content-MD5
+        can be set by direct-upload clients, so without a queue MD5 the downloaded file is hashed.
+        """
         thread_id = threading.current_thread().name
 
         try:
@@ -465,7 +479,7 @@ class StorjUploader:
                 return False, blob_name, "download_failed"
 
             # Upload to Storj using existing method
-            success, _, status = self.upload_single_file(local_file_path)
+            success, _, status = self.upload_single_file(local_file_path, known_md5)
 
             # Clean up temporary file
             if local_file_path.exists():
@@ -0,0 +1,251 @@
+"""
+Admission control for the upload endpoints.
+
+アップロード系リクエストをボディ受信前（multipart 解析前）に受け付け判定する。
+- グローバルなバイト予算（Content-Length の合計）と同時処理数の上限
+- クライアントごとのトークンバケット（リクエスト数のレート制限）
+- Storj Container 側の処理キューの深さ
+いずれかを超える場合は 429 + Retry-After を返す。
+"""
+import json
+import math
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+
+class AdmissionRejected(Exception):
+    """受け付け拒否（429 で返す）"""
+
+    def __init__(self, reason: str, message: str, retry_after: int):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """リクエスト数のトークンバケット"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, now: Optional[float] = None) -> float:
+        """トークンを1つ取得する。取得できた場合は 0、できない場合は次のトークンまでの秒数を返す"""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class AdmissionController:
+    """バイト予算・同時処理数・クライアント別レート・キュー深さによる受け付け制御"""
+
+    def __init__(
+        self,
+        byte_budget: Optional[int] = None,
+        max_inflight: Optional[int] = None,
+        client_rate: Optional[float] = None,
+        client_burst: Optional[float] = None,
+        max_queue_depth: Optional[int] = None,
+        queue_depth_fn: Optional[Callable[[], int]] = None,
+        unknown_length_bytes: Optional[int] = None,
+        retry_after: Optional[int] = None
+    ):
+        self.byte_budget = byte_budget or int(os.getenv("ADMISSION_BYTE_BUDGET", str(1024 * 1024 * 1024)))
+        self.max_inflight = max_inflight or int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+        self.client_rate = client_rate or float(os.getenv("ADMISSION_CLIENT_RATE", "5"))
+        self.client_burst = client_burst or float(os.getenv("ADMISSION_CLIENT_BURST", "20"))
+        self.max_queue_depth = max_queue_depth if max_queue_depth is not None else int(
+            os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "1000")
+        )
+        # Content-Length のない（chunked）リクエストの見積もりサイズ
+        self.unknown_length_bytes = unknown_length_bytes or int(
+            os.getenv("ADMISSION_UNKNOWN_LENGTH_BYTES", str(64 * 1024 * 1024))
+        )
+        self.retry_after = retry_after or int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+        self.queue_depth_fn = queue_depth_fn
+        self.queue_depth_ttl = 2.0
+        self._queue_depth = 0
+        self._queue_depth_checked_at = 0.0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._max_buckets = 10000
+        self.bytes_in_flight = 0
+        self.inflight = 0
+        self._stats = {
+            "admitted": 0,
+            "rejected_byte_budget": 0,
+            "rejected_inflight": 0,
+            "rejected_client_rate": 0,
+            "rejected_queue_depth": 0,
+            "peak_bytes_in_flight": 0,
+            "peak_inflight": 0,
+        }
+
+    def _get_queue_depth(self) -> int:
+        # File Share の glob は重いため短時間キャッシュする
+        if self.queue_depth_fn is None:
+            return 0
+        now = time.monotonic()
+        if now - self._queue_depth_checked_at >= self.queue_depth_ttl:
+            try:
+                self._queue_depth = self.queue_depth_fn()
+            except Exception as e:
+                print(f"Failed to read queue depth for admission control: {e}")
+            self._queue_depth_checked_at = now
+        return self._queue_depth
+
+    def _get_bucket(self, client_id: str, now: float) -> TokenBucket:
+        bucket = self._buckets.get(client_id)
+        if bucket is None:
+            if len(self._buckets) >= self._max_buckets:
+                # 満タン（＝しばらく使われていない）バケットを破棄
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.is_idle(now)}
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._buckets[client_id] = bucket
+        return bucket
+
+    def admit(self, client_id: str, content_length: Optional[int]) -> int:
+        """
+        受け付け判定を行い、予約したバイト数を返す（release に渡す）。
+        受け付けられない場合は AdmissionRejected を送出する。
+        """
+        nbytes = content_length if content_length is not None else self.unknown_length_bytes
+
+        if self.max_queue_depth and self._get_queue_depth() >= self.max_queue_depth:
+            self._stats["rejected_queue_depth"] += 1
+            raise AdmissionRejected("queue_depth", "処理キューが混雑しています", self.retry_after * 5)
+        if self.inflight >= self.max_inflight:
+            self._stats["rejected_inflight"] += 1
+            raise AdmissionRejected("inflight", "同時アップロード数が上限に達しています", self.retry_after)
+        # 予算より大きい単一リクエストは、他に処理中のものがなければ受け付ける
+        if self.bytes_in_flight and self.bytes_in_flight + nbytes > self.byte_budget:
+            self._stats["rejected_byte_budget"] += 1
+            raise AdmissionRejected("byte_budget", "アップロード中のデータ量が上限に達しています", self.retry_after)
+
+        now = time.monotonic()
+        wait = self._get_bucket(client_id, now).try_take(now)
+        if wait > 0:
+            self._stats["rejected_client_rate"] += 1
+            raise AdmissionRejected("client_rate", "リクエストが多すぎます", max(1, math.ceil(wait)))
+
+        self.inflight += 1
+        self.bytes_in_flight += nbytes
+        self._stats["admitted"] += 1
+        self._stats["peak_inflight"] = max(self._stats["peak_inflight"], self.inflight)
+        self._stats["peak_bytes_in_flight"] = max(self._stats["peak_bytes_in_flight"], self.bytes_in_flight)
+        return nbytes
+
+    def release(self, nbytes: int):
+        self.inflight -= 1
+        self.bytes_in_flight -= nbytes
+
+    def get_stats(self) -> dict:
+        """統計情報（飽和度を含む）を返す"""
+        byte_saturation = self.bytes_in_flight / self.byte_budget if self.byte_budget else 0.0
+        inflight_saturation = self.inflight / self.max_inflight if self.max_inflight else 0.0
+        queue_saturation = self._queue_depth / self.max_queue_depth if self.max_queue_depth else 0.0
+        return {
+            **self._stats,
+            "bytes_in_flight": self.bytes_in_flight,
+            "byte_budget": self.byte_budget,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "queue_depth": self._queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "tracked_clients": len(self._buckets),
+            "saturation": round(max(byte_saturation, inflight_saturation, queue_saturation), 3),
+        }
+
+
+# X-Forwarded-For の末尾から数えて信頼するプロキシ（Container Apps のイングレスなど）が追加したエントリ数。
+# 先頭側はクライアントが自由に送れるため使わない。0（既定）の場合は X-Forwarded-For を使わず接続元アドレスを使う
+# （プロキシがないのに 1 以上にすると、クライアントが送った X-Forwarded-For をそのまま識別子にしてしまう）
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+
+def client_id(scope) -> str:
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if TRUSTED_PROXY_HOPS <= 0:
+        return peer
+    forwarded = []
+    for name, value in scope.get("headers", []):
+        if name == b"x-forwarded-for":
+            forwarded.extend(entry.strip() for entry in value.decode("latin-1").split(","))
+    forwarded = [entry for entry in forwarded if entry]
+    if not forwarded:
+        return peer
+    # 信頼するプロキシが追加した中で最もクライアント側のエントリ（エントリが少なければ先頭）
+    return forwarded[max(len(forwarded) - TRUSTED_PROXY_HOPS, 0)]
+
+
+def _content_length(scope) -> Optional[int]:
+    for name, value in scope.get("headers", []):
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class AdmissionMiddleware:
+    """アップロード系リクエストに AdmissionController を適用する ASGI ミドルウェア"""
+
+    def __init__(
+        self,
+        app,
+        controller: AdmissionController,
+        path_prefix: str = "/upload",
+        exempt_paths: Tuple[str, ...] = ()
+    ):
+        self.app = app
+        self.controller = controller
+        self.path_prefix = path_prefix
+        self.exempt_paths = set(exempt_paths)
+
+    def _applies(self, scope) -> bool:
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            return False
+        path = scope["path"]
+        return path.startswith(self.path_prefix) and path not in self.exempt_paths
+
+    async def __call__(self, scope, receive, send):
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            reserved = self.controller.admit(client_id(scope), _content_length(scope))
+        except AdmissionRejected as e:
+            body = json.dumps({"error": e.message, "reason": e.reason}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(e.retry_after).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(reserved)
@@ -3,9 +3,14 @@ Azure Blob Storage helper module.
 Local環境とAzure環境の両方でBlob Storageを使用します。
 """
 import os
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Optional
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+from typing import Dict, List, Optional, Tuple
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import (
+    BlobServiceClient, BlobClient, ContainerClient, BlobBlock, ContentSettings,
+    BlobSasPermissions, generate_blob_sas
+)
 
 class BlobStorageHelper:
     """Helper class for Azure Blob Storage operations."""
@@ -26,12 +31,23 @@ class BlobStorageHelper:
                 "Please set AZURE_STORAGE_ACCOUNT_NAME and AZURE_STORAGE_ACCOUNT_KEY"
             )
 
+        # Blob エンドポイント（Azurite 等のエミュレーター利用時は AZURE_STORAGE_BLOB_ENDPOINT で上書き）
+        # 例: http://127.0.0.1:10000/devstoreaccount1
+        self.custom_endpoint = os.getenv("AZURE_STORAGE_BLOB_ENDPOINT", "").rstrip("/")
+        self.account_url = self.custom_endpoint or f"https://{self.account_name}.blob.core.windows.net"
+        # クライアントに返す SAS URL のエンドポイント（コンテナ内部のホスト名と異なる場合に指定）
+        self.public_endpoint = os.getenv("AZURE_STORAGE_PUBLIC_BLOB_ENDPOINT", "").rstrip("/") or self.account_url
+
         # Initialize BlobServiceClient
         self.blob_service_client = BlobServiceClient(
-            account_url=f"https://{self.account_name}.blob.core.windows.net",
+            account_url=self.account_url,
             credential=self.account_key
         )
 
+        # エミュレーターは空の状態で起動するため、コンテナを作成しておく
+        if self.custom_endpoint:
+            self.ensure_containers()
+
     @staticmethod
     def _get_int_env(name: str, default: int) -> int:
         try:
@@ -40,7 +56,54 @@ class BlobStorageHelper:
             return default
         return value if value > 0 else default
 
-    def upload_file(self, file_path: str, blob_name: Optional[str] = None, container_name: Optional[str] = None) -> str:
+    def ensure_containers(self):
+        """Create the upload/uploaded containers if they do not exist."""
+        for container_name in (self.upload_container, self.uploaded_container):
+            try:
+                self.blob_service_client.create_container(container_name)
+            except ResourceExistsError:
+                pass
+
+    def generate_upload_sas_url(
+        self,
+        blob_name: str,
+        expiry_minutes: int = 15,
+        container_name: Optional[str] = None
+    ) -> Tuple[str, datetime]:
+        """
+        Issue a short-lived, write-only SAS URL for a single blob.
+
+        The URL allows Put Blob / Put Block / Put Block List (create + write) only,
+        so clients can upload directly without being able to read or list the container.
+
+        Returns:
+            (SAS URL, expiry time in UTC)
+        """
+        if container_name is None:
+            container_name = self.upload_container
+
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(minutes=expiry_minutes)
+        sas_token = generate_blob_sas(
+            account_name=self.account_name,
+            container_name=container_name,
+            blob_name=blob_name,
+            account_key=self.account_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            start=now - timedelta(minutes=5),  # クロックスキュー対策
+            expiry=expires_at
+        )
+        blob_client = self.blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+        blob_path = blob_client.url[len(self.account_url):]
+        return f"{self.public_endpoint}{blob_path}?{sas_token}", expires_at
+
+    def upload_file(
+        self,
+        file_path: str,
+        blob_name: Optional[str] = None,
+        container_name: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None
+    ) -> str:
         """
         Upload a file to Blob Storage.
 
@@ -48,6 +111,7 @@ class BlobStorageHelper:
             file_path: Path to the local file
             blob_name: Name for the blob (defaults to filename)
             container_name: Container name (defaults to upload_container)
+            metadata: Blob metadata (e.g. ingest-time md5/sha256)
 
         Returns:
             Blob name
@@ -69,14 +133,64 @@ class BlobStorageHelper:
                 "max_concurrency": self.upload_max_concurrency,
                 "timeout": 300  # 5分のタイムアウト
             }
+            if metadata:
+                upload_kwargs["metadata"] = metadata
             if self.upload_block_size_mb:
                 upload_kwargs["max_block_size"] = self.upload_block_size_mb * 1024 * 1024
             try:
                 blob_client.upload_blob(data, **upload_kwargs)
             except TypeError:
                 # Fallback for older azure-storage-blob versions without these kwargs.
-                blob_client.upload_blob(data, overwrite=True, timeout=300)
+                blob_client.upload_blob(data, overwrite=True, timeout=300, metadata=metadata)
+
+        return blob_name
+
+    def stage_block(self, blob_name: str, block_id: str, data: bytes, container_name: Optional[str] = None):
+        """
+        Stage a single block for a block blob (committed later by commit_block_list).
 
+        Args:
+            blob_name: Name of the blob
+            block_id: Base64 block ID (all IDs of a blob must have the same length)
+            data: Block contents
+            container_name: Container name (defaults to upload_container)
+        """
+        if container_name is None:
+            container_name = self.upload_container
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container=container_name,
+            blob=blob_name
+        )
+        blob_client.stage_block(block_id=block_id, data=data, length=len(data))
+
+    def commit_block_list(
+        self,
+        blob_name: str,
+        block_ids: List[str],
+        container_name: Optional[str] = None,
+        content_type: Optional[str] = None,
+        metadata: Optional[Dict[str, str]] = None
+    ) -> str:
+        """
+        Commit previously staged blocks into a block blob.
+
+        Returns:
+            Blob name
+        """
+        if container_name is None:
+            container_name = self.upload_container
+
+        blob_client = self.blob_service_client.get_blob_client(
+            container=container_name,
+            blob=blob_name
+        )
+        commit_kwargs = {}
+        if content_type:
+            commit_kwargs["content_settings"] = ContentSettings(content_type=content_type)
+        if metadata:
+            commit_kwargs["metadata"] = metadata
+        blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in block_ids], **commit_kwargs)
         return blob_name
 
     def download_file(self, blob_name: str, local_path: str, container_name: Optional[str] = None):
@@ -193,10 +307,15 @@ class BlobStorageHelper:
         if props.content_settings and props.content_settings.content_type:
             content_type = props.content_settings.content_type
         last_modified = props.last_modified.isoformat() if props.last_modified else ""
+        content_md5 = ""
+        if props.content_settings and props.content_settings.content_md5:
+            content_md5 = bytes(props.content_settings.content_md5).hex()
         return {
             "size": props.size,
             "content_type": content_type,
-            "last_modified": last_modified
+            "last_modified": last_modified,
+            "content_md5": content_md5,
+            "metadata": dict(props.metadata or {})
         }
 
     def download_blob_to_bytes(
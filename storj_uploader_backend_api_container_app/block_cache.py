@@ -0,0 +1,190 @@
+"""
+Block-level range cache for video streaming.
+
+動画の Range リクエストを固定サイズ（既定 4MB）にアラインしたブロック単位で取得し、
+ローカルディスク（tiered_cache.DiskCache: サイズ上限付き LRU・チェックサム付き）にキャッシュする。
+先読みしたブロックを確実に残すため、TinyLFU による受け入れ判定は使わない。
+- 同じブロックへの同時リクエストは1回の取得を共有する
+- 連続再生（前回のリクエストの続きからの読み込み）を検知したら後続ブロックを先読みする
+- キーにはオブジェクトのサイズ・更新日時を含めるため、内容が変わったオブジェクトの古いブロックは使われない
+- キャッシュするのは max_range_blocks ブロック以内の範囲だけ（全体・大きな範囲はブロックごとに rclone を
+  起動することになり、動画全体で LRU の他のエントリを追い出すため、呼び出し側でストリームのまま返す）
+- ヒットしたブロックは DiskCache.open で開き、必要な範囲だけを読む（チェックサムの検証はエントリごとに1回）
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from tiered_cache import DiskCache, cache_key_hash
+
+# fetch(offset, length) -> bytes
+BlockFetcher = Callable[[int, int], Awaitable[bytes]]
+
+
+class BlockCache:
+    """アラインされたブロックのディスクキャッシュ + 取得の共有 + 先読み"""
+
+    def __init__(
+        self,
+        root: Path,
+        block_size: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        read_ahead: Optional[int] = None,
+        max_range_blocks: Optional[int] = None,
+        max_tracked_objects: int = 1024
+    ):
+        self.block_size = block_size or int(os.getenv("BLOCK_CACHE_BLOCK_BYTES", str(4 * 1024 * 1024)))
+        max_bytes = max_bytes or int(os.getenv("BLOCK_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+        self.read_ahead = read_ahead if read_ahead is not None else int(os.getenv("BLOCK_CACHE_READ_AHEAD", "2"))
+        self.max_range_blocks = max_range_blocks or int(os.getenv("BLOCK_CACHE_MAX_RANGE_BLOCKS", "4"))
+        self.disk = DiskCache(root, max_bytes, admission=False)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._prefetches: Set[asyncio.Task] = set()
+        # オブジェクトごとに直前のリクエストで最後に返したブロック番号（連続再生の検知用）
+        self._last_block: "OrderedDict[str, int]" = OrderedDict()
+        self._max_tracked_objects = max_tracked_objects
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "shared_fetches": 0,
+            "fetched_bytes": 0,
+            "served_bytes": 0,
+            "prefetches": 0,
+        }
+
+    def _block_key(self, object_key: str, index: int) -> str:
+        return cache_key_hash(f"{object_key}#{self.block_size}#{index}")
+
+    def _block_length(self, index: int, size: int) -> int:
+        return min(self.block_size, size - index * self.block_size)
+
+    def accepts(self, start: int, end: int) -> bool:
+        """[start, end] をブロックキャッシュ経由で返すか（大きな範囲はキャッシュせずにストリームで返す）"""
+        return end // self.block_size - start // self.block_size + 1 <= self.max_range_blocks
+
+    def _read_cached(self, key_hash: str, offset: int, length: int) -> Optional[bytes]:
+        """キャッシュ済みブロックの [offset, offset + length) を読む（なければ None）"""
+        cached = self.disk.open(key_hash)
+        if cached is None:
+            return None
+        with cached.file as file:
+            data = os.pread(file.fileno(), length, cached.offset + offset)
+        return data if len(data) == length else None
+
+    async def get_block(
+        self,
+        object_key: str,
+        index: int,
+        size: int,
+        fetch: BlockFetcher,
+        offset: int = 0,
+        length: Optional[int] = None
+    ) -> bytes:
+        """
+        ブロックの [offset, offset + length) を返す（省略時はブロック全体）。
+        キャッシュになければブロック全体を取得する。同じブロックの取得中はその結果を待つ。
+        """
+        if length is None:
+            length = self._block_length(index, size) - offset
+        key_hash = self._block_key(object_key, index)
+        data = await asyncio.to_thread(self._read_cached, key_hash, offset, length)
+        if data is not None:
+            self._stats["hits"] += 1
+            return data
+
+        task = self._inflight.get(key_hash)
+        if task is not None:
+            self._stats["shared_fetches"] += 1
+        else:
+            self._stats["misses"] += 1
+            task = asyncio.create_task(self._fetch_block(key_hash, index, size, fetch))
+            self._inflight[key_hash] = task
+            task.add_done_callback(lambda _task: self._inflight.pop(key_hash, None))
+        # 待っているリクエストが切断されても、他の待ち手や先読みのために取得は継続する
+        data = await asyncio.shield(task)
+        return data[offset:offset + length]
+
+    async def _fetch_block(self, key_hash: str, index: int, size: int, fetch: BlockFetcher) -> bytes:
+        length = self._block_length(index, size)
+        data = await fetch(index * self.block_size, length)
+        if len(data) != length:
+            raise IOError(f"short block read: expected {length} bytes, got {len(data)}")
+        self._stats["fetched_bytes"] += length
+        try:
+            await asyncio.to_thread(self.disk.put, key_hash, data)
+        except OSError as e:
+            print(f"Failed to write block cache entry: {e}")
+        return data
+
+    def _prefetch(self, object_key: str, first: int, last: int, size: int, fetch: BlockFetcher):
+        for index in range(first, last + 1):
+            key_hash = self._block_key(object_key, index)
+            if key_hash in self._inflight or self.disk.contains(key_hash):
+                continue
+            self._stats["prefetches"] += 1
+            task = asyncio.create_task(self._prefetch_one(object_key, index, size, fetch))
+            self._prefetches.add(task)
+            task.add_done_callback(self._prefetches.discard)
+
+    async def _prefetch_one(self, object_key: str, index: int, size: int, fetch: BlockFetcher):
+        try:
+            await self.get_block(object_key, index, size, fetch)
+        except Exception as e:
+            print(f"Block prefetch failed for {object_key} block {index}: {e}")
+
+    def _is_sequential(self, object_key: str, first_block: int) -> bool:
+        last = self._last_block.get(object_key)
+        return last is not None and last <= first_block <= last + 1
+
+    def _remember(self, object_key: str, block: int):
+        self._last_block[object_key] = block
+        self._last_block.move_to_end(object_key)
+        while len(self._last_block) > self._max_tracked_objects:
+            self._last_block.popitem(last=False)
+
+    async def stream(
+        self,
+        object_key: str,
+        size: int,
+        start: int,
+        end: int,
+        fetch: BlockFetcher
+    ) -> AsyncIterator[bytes]:
+        """
+        [start, end]（両端を含む）の範囲をブロック単位で返す。
+        object_key にはオブジェクトのバージョン（サイズ・更新日時）を含めること。
+        """
+        first_block = start // self.block_size
+        end_block = end // self.block_size
+        last_object_block = (size - 1) // self.block_size
+        # 連続再生なら範囲の後ろも先読みする（プレイヤーは小さい範囲を続けて要求するため）
+        ahead_limit = last_object_block if self._is_sequential(object_key, first_block) else end_block
+
+        for index in range(first_block, end_block + 1):
+            if self.read_ahead:
+                self._prefetch(
+                    object_key,
+                    index + 1,
+                    min(index + self.read_ahead, ahead_limit),
+                    size,
+                    fetch
+                )
+            block_start = index * self.block_size
+            offset = max(start - block_start, 0)
+            chunk_end = min(end - block_start + 1, self._block_length(index, size))
+            chunk = await self.get_block(object_key, index, size, fetch, offset, chunk_end - offset)
+            self._stats["served_bytes"] += len(chunk)
+            self._remember(object_key, index)
+            yield chunk
+
+    def get_stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["shared_fetches"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "block_size": self.block_size,
+            "inflight": len(self._inflight),
+            "disk": self.disk.get_stats(),
+        }
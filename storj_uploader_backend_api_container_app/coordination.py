@@ -0,0 +1,225 @@
+"""
+Cross-process coordination for multi-worker deployments.
+
+uvicorn --workers N で起動した同一ホスト上のワーカー間で共有する同時実行数の上限・排他制御。
+ローカルディスク上のファイルに対する flock（fcntl）で実装する。
+- ProcessSemaphore: 全ワーカー合計の同時実行数の上限（rclone・ffmpeg など）。
+  上限と同じ数のスロットファイルのいずれかをロックできたら実行する
+- KeyLock: キー（動画のパスなど）ごとの排他。別のワーカーが同じ処理を実行中なら終わるまで待つ。
+  ロックファイルはキーのハッシュで固定数に振り分けるため増え続けない（まれに別のキーと待ち合う）
+- LeaderLock: 定期処理（容量整理など）を1つのワーカーだけで実行するための選出
+- ロックはプロセスが終了すると OS が解放するため、ワーカーが落ちてもスロットは残らない
+- File Share（SMB）上の flock は信頼できないため、COORDINATION_DIR はローカルディスクを指定する
+"""
+import asyncio
+import fcntl
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from pathlib import Path
+from typing import AsyncIterator, Iterator, List, Optional, Set
+
+# ロックを取得できなかった場合の再試行間隔（秒。待つごとに最大値まで伸ばす）
+_POLL_MIN_SECONDS = 0.01
+_POLL_MAX_SECONDS = 0.2
+
+
+def coordination_dir() -> Path:
+    root = Path(os.getenv("COORDINATION_DIR", "/tmp/storj_api_coordination"))
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def _try_flock(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class ProcessSemaphore:
+    """全ワーカー合計の同時実行数を limit に制限するセマフォ（プロセス内の複数スレッドからも使える）"""
+
+    def __init__(self, name: str, limit: int, root: Optional[Path] = None):
+        self.name = name
+        self.limit = max(limit, 1)
+        self.root = root or coordination_dir()
+        self._fds: List[Optional[int]] = [None] * self.limit
+        # このプロセスが保持中のスロット（同じ fd への flock は再取得できてしまうため自前で管理する）
+        self._held: Set[int] = set()
+        self._lock = threading.Lock()
+        self._stats = {
+            "acquired": 0,
+            # 他のワーカー（または自プロセス）が全スロットを使用中で待った回数
+            "waited": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _slot_fd(self, index: int) -> int:
+        fd = self._fds[index]
+        if fd is None:
+            fd = self._fds[index] = os.open(self.root / f"{self.name}.{index}.slot", os.O_RDWR | os.O_CREAT, 0o644)
+        return fd
+
+    def try_acquire(self) -> Optional[int]:
+        """空いているスロットをロックしてその番号を返す（なければ None）"""
+        with self._lock:
+            # ワーカー間で同じスロットから試さないように開始位置をずらす
+            first = random.randrange(self.limit)
+            for step in range(self.limit):
+                index = (first + step) % self.limit
+                if index in self._held:
+                    continue
+                if _try_flock(self._slot_fd(index)):
+                    self._held.add(index)
+                    return index
+        return None
+
+    def release(self, index: int):
+        with self._lock:
+            if index in self._held:
+                fcntl.flock(self._fds[index], fcntl.LOCK_UN)
+                self._held.discard(index)
+
+    def _record(self, waited_seconds: Optional[float]):
+        with self._lock:
+            self._stats["acquired"] += 1
+            if waited_seconds is not None:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds_total"] += waited_seconds
+                self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited_seconds)
+
+    async def acquire(self) -> int:
+        """スロットが空くまで（イベントループをブロックせずに）待ってロックする"""
+        index = self.try_acquire()
+        if index is not None:
+            self._record(None)
+            return index
+        started = time.perf_counter()
+        delay = _POLL_MIN_SECONDS
+        while index is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX_SECONDS)
+            index = self.try_acquire()
+        self._record(time.perf_counter() - started)
+        return index
+
+    def acquire_blocking(self) -> int:
+        """スレッドから使う acquire（スロットが空くまでスレッドを待たせる）"""
+        index = self.try_acquire()
+        if index is not None:
+            self._record(None)
+            return index
+        started = time.perf_counter()
+        delay = _POLL_MIN_SECONDS
+        while index is None:
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX_SECONDS)
+            index = self.try_acquire()
+        self._record(time.perf_counter() - started)
+        return index
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[int]:
+        index = await self.acquire()
+        try:
+            yield index
+        finally:
+            self.release(index)
+
+    @contextmanager
+    def blocking_slot(self) -> Iterator[int]:
+        index = self.acquire_blocking()
+        try:
+            yield index
+        finally:
+            self.release(index)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **{key: round(value, 4) if isinstance(value, float) else value for key, value in self._stats.items()},
+                "limit": self.limit,
+                # このワーカーが使用中のスロット数
+                "held": len(self._held),
+            }
+
+
+class KeyLock:
+    """キーごとのワーカー間排他（ロックファイルは stripes 個に振り分ける）"""
+
+    def __init__(self, name: str, stripes: int = 256, root: Optional[Path] = None):
+        self.name = name
+        self.stripes = stripes
+        self.root = (root or coordination_dir()) / name
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._stats = {"acquired": 0, "waited": 0}
+
+    def _path(self, key: str) -> Path:
+        stripe = int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % self.stripes
+        return self.root / f"{stripe:03d}.lock"
+
+    @asynccontextmanager
+    async def hold(self, key: str) -> AsyncIterator[bool]:
+        """
+        キーのロックを取得している間だけ実行する。
+        yield する値は、他のワーカー（またはこのプロセスの別の処理）の終了を待ったかどうか
+        （待った場合は結果がキャッシュ等に既にあるか呼び出し側で確認する）。
+        """
+        # ロックごとに開き直す（別々に開いたファイルへの flock は同じプロセス内でも排他になる）
+        fd = os.open(self._path(key), os.O_RDWR | os.O_CREAT, 0o644)
+        locked = False
+        try:
+            waited = False
+            delay = _POLL_MIN_SECONDS
+            while not _try_flock(fd):
+                waited = True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _POLL_MAX_SECONDS)
+            locked = True
+            self._stats["acquired"] += 1
+            if waited:
+                self._stats["waited"] += 1
+            yield waited
+        finally:
+            # fork した子プロセスが fd を引き継いでいても解放されるように明示的に解除する
+            if locked:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "stripes": self.stripes}
+
+
+class LeaderLock:
+    """1つのワーカーだけが保持するロック（保持していたワーカーが終了すると他のワーカーが引き継ぐ）"""
+
+    def __init__(self, name: str, root: Optional[Path] = None):
+        self.path = (root or coordination_dir()) / f"{name}.leader"
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def is_leader(self) -> bool:
+        """保持していなければ取得を試みる（取得済みなら True）"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if _try_flock(fd):
+            self._fd = fd
+            return True
+        os.close(fd)
+        return False
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
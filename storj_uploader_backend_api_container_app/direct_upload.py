@@ -0,0 +1,78 @@
+"""
+Direct-to-Blob upload tickets.
+
+クライアントが SAS URL で upload-target コンテナへ直接アップロードするための発行記録。
+発行時に File Share へチケットを保存し、完了コールバックでアトミックに取得（claim）することで、
+複数ワーカーからの重複完了や未発行の Blob 名の登録を防ぐ。
+
+レイアウト（tickets_dir 配下）:
+    {blob_name}.json        発行済み（アップロード待ち）
+    {blob_name}.claimed     完了処理中または完了済み
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+
+class DirectUploadTickets:
+    """SAS 直接アップロードの発行記録を File Share 上で管理する"""
+
+    def __init__(self, tickets_dir: Path, ttl_hours: Optional[float] = None):
+        self.tickets_dir = tickets_dir
+        self.ttl_hours = ttl_hours or float(os.getenv("DIRECT_UPLOAD_TICKET_TTL_HOURS", "24"))
+        self.tickets_dir.mkdir(parents=True, exist_ok=True)
+
+    def _pending_path(self, blob_name: str) -> Path:
+        return self.tickets_dir / f"{Path(blob_name).name}.json"
+
+    def _claimed_path(self, blob_name: str) -> Path:
+        return self.tickets_dir / f"{Path(blob_name).name}.claimed"
+
+    def issue(self, blob_name: str, ticket: dict):
+        """発行記録を保存する（File Share の I/O のためスレッドで呼ぶ）"""
+        ticket = {**ticket, "blob_name": blob_name, "issued_at": datetime.utcnow().isoformat()}
+        path = self._pending_path(blob_name)
+        temp = path.with_suffix(".json.tmp")
+        temp.write_text(json.dumps(ticket, indent=2), encoding="utf-8")
+        temp.replace(path)
+
+    def claim(self, blob_name: str) -> Optional[dict]:
+        """
+        発行記録をアトミックに取得する。
+        未発行・完了済み・他ワーカーが処理中の場合は None を返す。
+        """
+        pending = self._pending_path(blob_name)
+        claimed = self._claimed_path(blob_name)
+        try:
+            os.rename(pending, claimed)
+        except FileNotFoundError:
+            return None
+        return json.loads(claimed.read_text(encoding="utf-8"))
+
+    def is_claimed(self, blob_name: str) -> bool:
+        return self._claimed_path(blob_name).exists()
+
+    def release(self, blob_name: str):
+        """完了処理に失敗した場合に発行済み状態へ戻す（クライアントが再試行できるように）"""
+        try:
+            os.rename(self._claimed_path(blob_name), self._pending_path(blob_name))
+        except FileNotFoundError:
+            pass
+
+    def cleanup_expired(self) -> int:
+        """期限切れの発行記録・完了記録を削除する（定期処理の担当ワーカーがスレッドで呼ぶ）"""
+        removed = 0
+        cutoff = datetime.now() - timedelta(hours=self.ttl_hours)
+        for path in list(self.tickets_dir.glob("*.json")) + list(self.tickets_dir.glob("*.claimed")):
+            try:
+                if datetime.fromtimestamp(path.stat().st_mtime) < cutoff:
+                    path.unlink(missing_ok=True)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def get_stats(self) -> dict:
+        return {"pending_tickets": len(list(self.tickets_dir.glob("*.json")))}
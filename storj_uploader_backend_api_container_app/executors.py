@@ -0,0 +1,263 @@
+"""
+Bounded executors for offloading blocking work from the event loop.
+
+同時実行数と待ち行列の長さに上限を持つ Executor ラッパー。
+上限を超えた投入は ExecutorSaturatedError で即座に拒否し（バックプレッシャー）、
+呼び出しごとの待ち時間・CPU時間を記録する。
+
+用途ごとに別のバルクヘッド（I/O・メディアCPU処理・rclone・バックグラウンド処理）を用意し、
+ある用途の混雑が他の用途を枯渇させないようにする。
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional
+
+from coordination import ProcessSemaphore
+
+
+class ExecutorSaturatedError(Exception):
+    """Executor の待ち行列が上限に達した場合に送出"""
+
+    def __init__(self, name: str, retry_after: int = 1):
+        super().__init__(f"executor '{name}' is saturated")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict):
+    """ワーカー側で実行し、結果とCPU時間・実行時間を返す"""
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.thread_time() - cpu_start, time.perf_counter() - wall_start
+
+
+class BoundedExecutor:
+    """同時実行数・待ち行列長を制限し、統計を記録する Executor ラッパー"""
+
+    def __init__(
+        self,
+        name: str,
+        executor_factory: Callable[[], Executor],
+        max_concurrency: int,
+        max_queue: int,
+        retry_after: int = 1,
+        log_calls: bool = True,
+        process_slots: Optional[ProcessSemaphore] = None
+    ):
+        """process_slots: 全ワーカー合計の同時実行数の上限（実行中はスロットを1つ保持する）"""
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        # ブロック単位の I/O など呼び出し回数が多いプールでは1回ごとのログを出さない
+        self.log_calls = log_calls
+        self.process_slots = process_slots
+        self._executor_factory = executor_factory
+        self._executor: Optional[Executor] = None
+        self._executor_lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "cpu_seconds_total": 0.0,
+            "run_seconds_total": 0.0,
+        }
+
+    @property
+    def executor(self) -> Executor:
+        """実体の Executor（初回利用時に生成）"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = self._executor_factory()
+            return self._executor
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        fn を Executor 上で実行して結果を返す。
+        待ち行列が上限を超えている場合は ExecutorSaturatedError を送出する。
+        """
+        if self._pending >= self.max_concurrency + self.max_queue:
+            self._stats["rejected"] += 1
+            raise ExecutorSaturatedError(self.name, self.retry_after)
+
+        self._pending += 1
+        self._stats["submitted"] += 1
+        enqueued_at = time.perf_counter()
+        try:
+            async with self._semaphore:
+                # 他のワーカーがスロットを使い切っている間の待ちも待ち時間に含める
+                slot = await self.process_slots.acquire() if self.process_slots is not None else None
+                try:
+                    queue_wait = time.perf_counter() - enqueued_at
+                    self._stats["queue_wait_seconds_total"] += queue_wait
+                    self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], queue_wait)
+                    self._running += 1
+                    try:
+                        loop = asyncio.get_running_loop()
+                        result, cpu_seconds, run_seconds = await loop.run_in_executor(
+                            self.executor, _timed_call, fn, args, kwargs
+                        )
+                    except Exception:
+                        self._stats["failed"] += 1
+                        raise
+                    finally:
+                        self._running -= 1
+                finally:
+                    if slot is not None:
+                        self.process_slots.release(slot)
+        finally:
+            self._pending -= 1
+
+        self._stats["completed"] += 1
+        self._stats["cpu_seconds_total"] += cpu_seconds
+        self._stats["run_seconds_total"] += run_seconds
+        if not self.log_calls:
+            return result
+        name = getattr(fn, "__name__", str(fn))
+        print(f"[{self.name}] {name}: queue_wait={queue_wait * 1000:.1f}ms cpu={cpu_seconds * 1000:.1f}ms run={run_seconds * 1000:.1f}ms")
+        return result
+
+    def get_stats(self) -> Dict[str, float]:
+        """統計情報（飽和度を含む）を返す"""
+        capacity = self.max_concurrency + self.max_queue
+        completed = self._stats["completed"]
+        return {
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self._stats.items()},
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queued": max(self._pending - self._running, 0),
+            "saturation": round(self._pending / capacity, 3) if capacity else 0.0,
+            "avg_queue_wait_seconds": round(self._stats["queue_wait_seconds_total"] / completed, 4) if completed else 0.0,
+            "avg_cpu_seconds": round(self._stats["cpu_seconds_total"] / completed, 4) if completed else 0.0,
+        }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def create_process_pool_executor(name: str, max_workers: int, max_queue: int) -> BoundedExecutor:
+    """
+    プロセスプールを使う BoundedExecutor を生成する。
+    GILの影響を受けるPILのリサイズ等CPU処理はスレッドではなくプロセスで実行する。
+    """
+    start_method = os.getenv("MEDIA_POOL_START_METHOD", "spawn")
+
+    def factory() -> Executor:
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context(start_method)
+        )
+
+    return BoundedExecutor(name, factory, max_concurrency=max_workers, max_queue=max_queue)
+
+
+def create_thread_pool_executor(
+    name: str,
+    max_workers: int,
+    max_queue: int,
+    log_calls: bool = False,
+    process_slots: Optional[ProcessSemaphore] = None
+) -> BoundedExecutor:
+    """ブロッキング I/O（Blob Storage・File Share・rclone サブプロセス）用のスレッドプール BoundedExecutor を生成する"""
+
+    def factory() -> Executor:
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    return BoundedExecutor(
+        name,
+        factory,
+        max_concurrency=max_workers,
+        max_queue=max_queue,
+        log_calls=log_calls,
+        process_slots=process_slots
+    )
+
+
+class TaskBulkhead:
+    """
+    バックグラウンドのコルーチン（サムネイル生成の補完など）の同時実行数・待ち行列長を制限する。
+    上限を超えた投入は ExecutorSaturatedError で拒否する（呼び出し側は次の機会に再実行する）。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, retry_after: int = 5):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._pending = 0
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "queue_wait_seconds_total": 0.0,
+            "queue_wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+        }
+
+    def is_saturated(self) -> bool:
+        return self._pending >= self.max_concurrency + self.max_queue
+
+    async def run(self, coro_fn: Callable[..., Awaitable], *args, **kwargs):
+        """coro_fn(*args, **kwargs) を同時実行数の上限内で実行して結果を返す"""
+        if self.is_saturated():
+            self._stats["rejected"] += 1
+            raise ExecutorSaturatedError(self.name, self.retry_after)
+
+        self._pending += 1
+        self._stats["submitted"] += 1
+        enqueued_at = time.perf_counter()
+        try:
+            async with self._semaphore:
+                queue_wait = time.perf_counter() - enqueued_at
+                self._stats["queue_wait_seconds_total"] += queue_wait
+                self._stats["queue_wait_seconds_max"] = max(self._stats["queue_wait_seconds_max"], queue_wait)
+                self._running += 1
+                started_at = time.perf_counter()
+                try:
+                    result = await coro_fn(*args, **kwargs)
+                except Exception:
+                    self._stats["failed"] += 1
+                    raise
+                finally:
+                    self._running -= 1
+                    self._stats["run_seconds_total"] += time.perf_counter() - started_at
+        finally:
+            self._pending -= 1
+
+        self._stats["completed"] += 1
+        return result
+
+    def get_stats(self) -> Dict[str, float]:
+        """統計情報（飽和度を含む）を返す"""
+        capacity = self.max_concurrency + self.max_queue
+        completed = self._stats["completed"]
+        return {
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self._stats.items()},
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queued": max(self._pending - self._running, 0),
+            "saturation": round(self._pending / capacity, 3) if capacity else 0.0,
+            "avg_queue_wait_seconds": round(self._stats["queue_wait_seconds_total"] / completed, 4) if completed else 0.0,
+        }
+
+    def shutdown(self):
+        return None
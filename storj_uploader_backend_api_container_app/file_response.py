@@ -0,0 +1,96 @@
+"""
+File responses for cached media.
+
+ディスクキャッシュのサムネイル・uploaded/ に残っている元ファイルを、メモリに読み込まずに返すレスポンス。
+- ファイルの一部（キャッシュエントリのヘッダーを除いたペイロード）を1つの「ファイル」として扱い、
+  Range（単一範囲）・Content-Length・Last-Modified に対応する
+- サーバーが ASGI の zerocopy 拡張（http.response.zerocopy）に対応していれば sendfile で送る
+- 対応していない場合（uvicorn など）はスレッドで pread したチャンクを順に送る
+  （ファイル全体をメモリに載せず、bytes の連結・コピーもしない）
+- 呼び出し側で開いたファイルを受け取るため、送信中にキャッシュから追い出されても（unlink）最後まで送れる
+"""
+import asyncio
+import os
+from email.utils import formatdate
+from typing import BinaryIO, Mapping, Optional
+
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+class RangeFileResponse(Response):
+    """開いたファイルの [offset, offset + size) を返すレスポンス（start / end はその中の範囲）"""
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        size: int,
+        start: int,
+        end: int,
+        partial: bool,
+        offset: int = 0,
+        mtime: Optional[float] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        background: Optional[BackgroundTask] = None,
+        chunk_size: int = FILE_CHUNK_SIZE
+    ):
+        self.file = file
+        self.offset = offset
+        self.start = start
+        self.end = end
+        self.chunk_size = chunk_size
+        self.status_code = 206 if partial else 200
+        self.media_type = media_type
+        self.background = background
+        self.init_headers(headers)
+        self.headers["content-length"] = str(end - start + 1)
+        self.headers.setdefault("accept-ranges", "bytes")
+        if partial:
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        if mtime is not None:
+            self.headers.setdefault("last-modified", formatdate(mtime, usegmt=True))
+
+    async def _send_body(self, scope: Scope, send: Send):
+        position = self.offset + self.start
+        remaining = self.end - self.start + 1
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            await send({
+                "type": "http.response.zerocopy",
+                "file": self.file,
+                "offset": position,
+                "count": remaining,
+                "more_body": False,
+            })
+            return
+
+        fd = self.file.fileno()
+        while remaining > 0:
+            chunk = await asyncio.to_thread(os.pread, fd, min(self.chunk_size, remaining), position)
+            if not chunk:
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # ファイルが途中で切り詰められた場合（Content-Length 分は送れない）
+            raise RuntimeError(f"File ended {remaining} bytes before the declared length")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            if scope.get("method") == "HEAD":
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            else:
+                await self._send_body(scope, send)
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,358 @@
+"""
+Viewport-priority queue for on-demand thumbnail generation.
+
+オンデマンドのサムネイル生成（旧データの画像リサイズ・動画サムネイルの補完生成）を、
+クライアントの表示中の項目を優先して実行する待ち行列。
+- クライアントは POST /storj/images/visible で表示中のメディアのパス（画面の上から順）を送る
+- 表示中の項目は画面上の順に、表示状況が分からない項目（送ってこないクライアント）はその後に実行する
+- 表示中だったが画面外に出た項目（スクロールで通り過ぎたもの）は、実行前であれば取り消す
+  （取り消すのはその項目を要求したクライアントが通り過ぎ、どのクライアントでも表示されていない場合だけ）
+- 表示状況の更新時に待ち行列を並べ替える
+- 表示状況は一定時間更新がなければ破棄する（送ってこなくなったクライアントの古い情報で並べ替えない）
+- 表示状況は COORDINATION_DIR 上のファイルで同じホストのワーカー間で共有する（待ち行列自体はワーカーごと）
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from executors import ExecutorSaturatedError
+
+
+class GenerationDroppedError(ExecutorSaturatedError):
+    """画面外に出た項目の生成を取り消した場合に送出（API は 503 + Retry-After を返す）"""
+
+    def __init__(self, name: str, path: str, retry_after: int = 1):
+        super().__init__(name, retry_after)
+        self.path = path
+
+
+class ViewportTracker:
+    """
+    クライアントごとの表示中の項目と、画面外に出た項目。
+    shared_dir を指定すると通知をクライアントごとのファイルに書き出し、同じホストの他のワーカーと共有する
+    （通知を受けたワーカーと画像のリクエストを受けたワーカーが異なっても並べ替え・取り消しが効くように）。
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_clients: int = 1024,
+        max_left_items: int = 1000,
+        shared_dir: Optional[Path] = None
+    ):
+        self.ttl_seconds = ttl_seconds or float(os.getenv("VIEWPORT_TTL_SECONDS", "30"))
+        self._max_clients = max_clients
+        self._max_left_items = max_left_items
+        self.shared_dir = shared_dir
+        if shared_dir is not None:
+            shared_dir.mkdir(parents=True, exist_ok=True)
+        # クライアント -> (更新時刻, {パス: 画面上の順位}, {画面外に出たパス: 時刻})
+        # 時刻はワーカー間で比較するため time.time()
+        self._clients: "OrderedDict[str, Tuple[float, Dict[str, int], Dict[str, float]]]" = OrderedDict()
+        # 共有ファイル名 -> 読み込んだ時の更新時刻（read_shared を呼ぶスレッドだけが使う）
+        self._shared_mtimes: Dict[str, int] = {}
+        self._listeners: List[Callable[[], None]] = []
+        self._stats = {"updates": 0, "left_items": 0, "shared_merges": 0}
+
+    def add_listener(self, callback: Callable[[], None]):
+        """表示状況が変わったときに呼ぶ（待ち行列の並べ替え）"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+    def _store(self, client: str, record: Tuple[float, Dict[str, int], Dict[str, float]]):
+        self._clients.pop(client, None)
+        self._clients[client] = record
+        while len(self._clients) > self._max_clients:
+            self._clients.popitem(last=False)
+
+    def update(self, client: str, paths: Iterable[str]) -> Tuple[int, int]:
+        """クライアントの表示中の項目を置き換える。Returns: (表示中の件数, 画面外に出た件数)"""
+        now = time.time()
+        ranks: Dict[str, int] = {}
+        for path in paths:
+            ranks.setdefault(path, len(ranks))
+        previous = self._clients.get(client)
+        left_items: Dict[str, float] = {}
+        left = 0
+        if previous is not None:
+            left_items = {
+                path: left_at for path, left_at in previous[2].items()
+                if path not in ranks and now - left_at < self.ttl_seconds
+            }
+            for path in previous[1]:
+                if path not in ranks:
+                    left_items.pop(path, None)
+                    left_items[path] = now
+                    left += 1
+        while len(left_items) > self._max_left_items:
+            del left_items[next(iter(left_items))]
+        self._store(client, (now, ranks, left_items))
+
+        self._stats["updates"] += 1
+        self._stats["left_items"] += left
+        self._notify()
+        return len(ranks), left
+
+    def _shared_path(self, client: str) -> Path:
+        return self.shared_dir / f"{hashlib.sha1(client.encode('utf-8')).hexdigest()}.json"
+
+    def export(self, client: str) -> Optional[dict]:
+        """publish() に渡すクライアントの表示状況（イベントループ上で取得する）"""
+        record = self._clients.get(client)
+        if record is None:
+            return None
+        updated, ranks, left_items = record
+        return {
+            "client": client,
+            "updated": updated,
+            "paths": sorted(ranks, key=ranks.get),
+            "left": left_items,
+        }
+
+    def publish(self, state: Optional[dict]):
+        """クライアントの表示状況を共有ファイルに書き出す（スレッドで実行）"""
+        if self.shared_dir is None or state is None:
+            return
+        path = self._shared_path(state["client"])
+        temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            temp.write_text(json.dumps(state), encoding="utf-8")
+            temp.replace(path)
+        except OSError as e:
+            print(f"Failed to publish viewport {path}: {e}")
+
+    def read_shared(self) -> List[dict]:
+        """前回から更新された他のワーカーの通知を読む（スレッドで実行。結果は merge() に渡す）"""
+        if self.shared_dir is None:
+            return []
+        states = []
+        now = time.time()
+        seen = set()
+        for path in self.shared_dir.glob("*.json"):
+            try:
+                mtime_ns = path.stat().st_mtime_ns
+            except OSError:
+                continue
+            seen.add(path.name)
+            if self._shared_mtimes.get(path.name) == mtime_ns or now - mtime_ns / 1e9 >= self.ttl_seconds:
+                continue
+            try:
+                states.append(json.loads(path.read_text(encoding="utf-8")))
+            except (OSError, ValueError):
+                continue
+            self._shared_mtimes[path.name] = mtime_ns
+        for name in set(self._shared_mtimes) - seen:
+            del self._shared_mtimes[name]
+        return states
+
+    def merge(self, states: List[dict]):
+        """read_shared() の結果のうち、このワーカーの把握より新しい通知を取り込む（イベントループ上で呼ぶ）"""
+        changed = False
+        for state in states:
+            client = state["client"]
+            current = self._clients.get(client)
+            if current is not None and current[0] >= state["updated"]:
+                continue
+            ranks = {path: position for position, path in enumerate(state["paths"])}
+            self._store(client, (state["updated"], ranks, dict(state["left"])))
+            changed = True
+        if changed:
+            self._stats["shared_merges"] += 1
+            self._notify()
+
+    def prune_shared(self):
+        """期限切れの共有ファイルを削除する（スレッドで実行。1つのワーカーだけが呼ぶ）"""
+        if self.shared_dir is None:
+            return
+        now = time.time()
+        for path in self.shared_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime >= self.ttl_seconds * 2:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                continue
+
+    def _expire(self, now: float):
+        while self._clients:
+            client, record = next(iter(self._clients.items()))
+            if now - record[0] < self.ttl_seconds:
+                break
+            del self._clients[client]
+
+    def rank(self, path: str) -> Tuple[int, int]:
+        """並び順のキー（表示中: (0, 画面上の順位) / 不明: (1, 0)）"""
+        self._expire(time.time())
+        best: Optional[int] = None
+        for _updated, ranks, _left in self._clients.values():
+            position = ranks.get(path)
+            if position is not None and (best is None or position < best):
+                best = position
+        return (0, best) if best is not None else (1, 0)
+
+    def is_stale(self, path: str, client: Optional[str]) -> bool:
+        """client が表示していたが画面外に出した項目で、どのクライアントでも表示されていないか"""
+        if client is None:
+            return False
+        now = time.time()
+        self._expire(now)
+        record = self._clients.get(client)
+        if record is None:
+            return False
+        left_at = record[2].get(path)
+        return left_at is not None and now - left_at < self.ttl_seconds and self.rank(path)[0] != 0
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "clients": len(self._clients),
+            "visible_items": sum(len(ranks) for _updated, ranks, _left in self._clients.values()),
+            "left_pending": sum(len(left) for _updated, _ranks, left in self._clients.values()),
+            "shared": self.shared_dir is not None,
+        }
+
+
+class _Job:
+    __slots__ = ("path", "client", "seq", "ready", "cancelled")
+
+    def __init__(self, path: str, client: Optional[str], seq: int):
+        self.path = path
+        self.client = client
+        self.seq = seq
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.cancelled = False
+
+
+class PriorityGenerationQueue:
+    """表示中の項目を優先して同時実行数の上限内で実行し、画面外に出た項目を取り消す待ち行列"""
+
+    def __init__(self, name: str, viewport: ViewportTracker, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.viewport = viewport
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._heap: List[Tuple[Tuple[int, int], int, _Job]] = []
+        self._seq = itertools.count()
+        self._waiting = 0
+        self._running = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "dropped": 0,
+            "rejected": 0,
+            # 表示中の項目として（待ち行列の先頭から）実行した数
+            "visible_started": 0,
+            "reprioritized": 0,
+            "queue_wait_seconds_max": 0.0,
+        }
+        viewport.add_listener(self.reprioritize)
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._heap, (self.viewport.rank(job.path), job.seq, job))
+
+    @staticmethod
+    def _abandoned(job: _Job) -> bool:
+        """
+        待機側でキャンセル済み（ready がキャンセルされ、run() の except 節が待ち数を戻す前のものを含む）か。
+        ready を確定させた後でだけ待ち数・実行数を更新する。
+        """
+        return job.cancelled or job.ready.done()
+
+    def _drop(self, job: _Job):
+        if self._abandoned(job):
+            return
+        job.ready.set_exception(GenerationDroppedError(self.name, job.path))
+        job.cancelled = True
+        self._waiting -= 1
+        self._stats["dropped"] += 1
+
+    def _dispatch(self):
+        while self._running < self.max_concurrency and self._heap:
+            rank, _seq, job = heapq.heappop(self._heap)
+            if self._abandoned(job):
+                continue
+            if self.viewport.is_stale(job.path, job.client):
+                self._drop(job)
+                continue
+            job.ready.set_result(None)
+            self._waiting -= 1
+            self._running += 1
+            if rank[0] == 0:
+                self._stats["visible_started"] += 1
+
+    def reprioritize(self):
+        """表示状況の変化に合わせて並べ替え、画面外に出た項目を取り消す"""
+        jobs = [job for _rank, _seq, job in self._heap if not self._abandoned(job)]
+        self._heap = []
+        for job in jobs:
+            if self.viewport.is_stale(job.path, job.client):
+                self._drop(job)
+            else:
+                self._push(job)
+        self._stats["reprioritized"] += 1
+        self._dispatch()
+
+    async def run(
+        self,
+        path: str,
+        client: Optional[str],
+        coro_fn: Callable[..., Awaitable[Any]],
+        *args,
+        **kwargs
+    ) -> Any:
+        """
+        path の生成処理 coro_fn(*args, **kwargs) を順番が来たら実行して結果を返す。
+        client: 要求したクライアント（None は取り消さない。バックグラウンドの先読みなど）
+        """
+        if self.viewport.is_stale(path, client):
+            self._stats["dropped"] += 1
+            raise GenerationDroppedError(self.name, path)
+        if self._waiting >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise ExecutorSaturatedError(self.name)
+
+        job = _Job(path, client, next(self._seq))
+        self._waiting += 1
+        self._stats["submitted"] += 1
+        self._push(job)
+        enqueued_at = time.perf_counter()
+        self._dispatch()
+        try:
+            await job.ready
+        except asyncio.CancelledError:
+            if job.ready.done() and not job.ready.cancelled() and job.ready.exception() is None:
+                # 順番が来た直後にキャンセルされた場合は実行枠を返す
+                self._running -= 1
+                self._dispatch()
+            elif not job.cancelled:
+                job.cancelled = True
+                self._waiting -= 1
+            raise
+        self._stats["queue_wait_seconds_max"] = max(
+            self._stats["queue_wait_seconds_max"], time.perf_counter() - enqueued_at
+        )
+
+        try:
+            return await coro_fn(*args, **kwargs)
+        finally:
+            self._running -= 1
+            self._stats["completed"] += 1
+            self._dispatch()
+
+    def get_stats(self) -> dict:
+        return {
+            **{key: round(value, 4) if isinstance(value, float) else value for key, value in self._stats.items()},
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "waiting": self._waiting,
+        }
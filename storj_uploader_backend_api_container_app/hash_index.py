@@ -0,0 +1,187 @@
+"""
+Content hash index for pre-upload existence checks.
+
+サーバーが既に保持しているファイル（Storj バケット + 処理キュー）のハッシュ集合。
+Storj 上のオブジェクト名は "{name}_{md5先頭N桁}.ext" のため、バケット分は (サイズ, MD5先頭N桁) をキーにする。
+アップロード時に計算した完全な SHA-256 もキーとして登録する。
+メモリ上の set で判定し、File Share 上の JSON に永続化する（再起動時は読み込みのみで即利用可能）。
+
+永続化ファイルは複数のワーカー・レプリカで共有する:
+- keys: 最後の再構築結果（再構築は定期処理の担当ワーカーだけが行う）
+- added: 再構築以降に各ワーカーが登録したキーと登録時刻
+- 各ワーカーは sync() で自分の登録を added に追記し、他のワーカーの登録を取り込む（読み込み・書き込みの間は呼び出し側でロックする）
+- 再構築結果を書き出すときは、再構築の開始以降に登録されたキーだけを added に残す（削除されたファイルのキーは消える）
+"""
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+
+class HashIndex:
+    """(サイズ, MD5先頭) / SHA-256 の存在判定用インデックス"""
+
+    def __init__(self, persist_path: Path, hash_length: Optional[int] = None):
+        self.persist_path = persist_path
+        # storj_uploader.py の HASH_LENGTH と同じ値を使う
+        self.hash_length = hash_length or int(os.getenv("HASH_LENGTH", "10"))
+        self._name_hash_re = re.compile(rf"_([a-f0-9]{{{self.hash_length}}})(?:_\d{{14}})?(?:\.[^.]*)?$")
+        self._keys: Set[str] = set()
+        # 再構築中に登録されたキー（再構築結果に含まれないため入れ替え時に引き継ぐ）
+        self._recent: Set[str] = set()
+        # 前回の sync 以降にこのワーカーで登録したキー -> 登録時刻（永続化ファイルの added に追記する）
+        self._pending: Dict[str, float] = {}
+        # まだ書き出していない再構築結果と再構築の開始時刻
+        self._rebuilt: Optional[Tuple[Set[str], float]] = None
+        self.built_at: Optional[float] = None
+        self._stats = {
+            "check_calls": 0,
+            "checked_items": 0,
+            "found_items": 0,
+            "rebuilds": 0,
+            "last_rebuild_seconds": None,
+            "syncs": 0,
+        }
+
+    def _md5_key(self, size: int, md5: str) -> str:
+        return f"m:{size}:{md5[:self.hash_length].lower()}"
+
+    @staticmethod
+    def _sha256_key(sha256: str) -> str:
+        return f"s:{sha256.lower()}"
+
+    @property
+    def ready(self) -> bool:
+        return self.built_at is not None
+
+    def add(self, size: int, md5: Optional[str] = None, sha256: Optional[str] = None):
+        """受け付けたファイルを登録する"""
+        keys = []
+        if md5:
+            keys.append(self._md5_key(size, md5))
+        if sha256:
+            keys.append(self._sha256_key(sha256))
+        now = time.time()
+        for key in keys:
+            self._keys.add(key)
+            self._recent.add(key)
+            self._pending[key] = now
+
+    def check(self, items: list) -> list:
+        """
+        {"size", "md5", "sha256", ...} の辞書のリストを判定し、保持していない項目を返す。
+        ハッシュのない項目は判定できないため未保持として扱う。
+        数万件を1回で判定するため、キーの組み立てをループ内に展開している。
+        """
+        keys = self._keys
+        hash_length = self.hash_length
+        missing = []
+        for item in items:
+            sha256 = item.get("sha256")
+            if sha256 and f"s:{sha256.lower()}" in keys:
+                continue
+            md5 = item.get("md5")
+            if md5 and f"m:{int(item['size'])}:{md5[:hash_length].lower()}" in keys:
+                continue
+            missing.append(item)
+        self._stats["check_calls"] += 1
+        self._stats["checked_items"] += len(items)
+        self._stats["found_items"] += len(items) - len(missing)
+        return missing
+
+    def build_keys(self, objects: Iterable[Tuple[str, int]], queue_records: Iterable[dict]) -> Set[str]:
+        """
+        バケットのオブジェクト一覧とキューのレコードからキー集合を作る（スレッドで実行可能）。
+        """
+        keys: Set[str] = set()
+        for path, size in objects:
+            if path.startswith("thumbnails/"):
+                continue
+            match = self._name_hash_re.search(path.rsplit("/", 1)[-1])
+            if match:
+                keys.add(self._md5_key(size, match.group(1)))
+        for record in queue_records:
+            size = record.get("file_size") or 0
+            if record.get("md5"):
+                keys.add(self._md5_key(size, record["md5"]))
+            if record.get("sha256"):
+                keys.add(self._sha256_key(record["sha256"]))
+        return keys
+
+    def swap(self, keys: Set[str], build_seconds: float, started_at: float):
+        """再構築したキー集合に入れ替える（再構築中に登録されたキーは保持。次の sync で書き出す）"""
+        self._keys = keys | self._recent
+        self._recent = set()
+        self._rebuilt = (keys, started_at)
+        self.built_at = time.time()
+        self._stats["rebuilds"] += 1
+        self._stats["last_rebuild_seconds"] = round(build_seconds, 3)
+
+    def _read(self) -> Optional[dict]:
+        try:
+            data = json.loads(self.persist_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Failed to load hash index {self.persist_path}: {e}")
+            return None
+        if data.get("hash_length") != self.hash_length:
+            return None
+        return data
+
+    def sync(self):
+        """
+        永続化ファイルと同期する（スレッドで実行。複数ワーカーで同時に呼ばないよう呼び出し側でロックする）。
+        このワーカーの登録・再構築結果を書き出し、他のワーカーの登録・再構築結果を取り込む。
+        """
+        data = self._read() or {}
+        snapshot = set(data.get("keys", []))
+        added: Dict[str, float] = dict(data.get("added", {}))
+        built_at = data.get("built_at")
+        changed = False
+
+        if self._rebuilt is not None:
+            rebuilt, started_at = self._rebuilt
+            # 他のワーカー（別レプリカ）がより新しく再構築していればそちらを使う
+            if built_at is None or self.built_at > built_at:
+                snapshot = rebuilt
+                added = {key: at for key, at in added.items() if at >= started_at}
+                built_at = self.built_at
+                changed = True
+        for key, at in self._pending.items():
+            if key not in snapshot and key not in added:
+                added[key] = at
+                changed = True
+
+        if changed:
+            payload = {"hash_length": self.hash_length, "built_at": built_at, "keys": list(snapshot), "added": added}
+            temp = self.persist_path.with_name(f".{self.persist_path.name}.{os.getpid()}.tmp")
+            try:
+                temp.write_text(json.dumps(payload), encoding="utf-8")
+                temp.replace(self.persist_path)
+            except Exception as e:
+                # 書き出せなかった登録・再構築結果は次回の sync で再試行する
+                print(f"Failed to save hash index {self.persist_path}: {e}")
+                self._keys |= snapshot | set(added)
+                return
+
+        self._rebuilt = None
+        self._pending = {}
+        # 登録済みのキーは added に含まれるため、再構築中の登録の記録も不要になる
+        self._recent = set()
+        self._keys = snapshot | set(added)
+        self.built_at = built_at
+        self._stats["syncs"] += 1
+
+    def is_stale(self, max_age_seconds: float) -> bool:
+        return self.built_at is None or time.time() - self.built_at >= max_age_seconds
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "keys": len(self._keys),
+            "ready": self.ready,
+            "built_at": self.built_at,
+        }
@@ -0,0 +1,320 @@
+"""
+Streaming upload ingestion.
+
+アップロードされたパートをメモリに全量展開せず、固定サイズのチャンク単位で
+保存先（File Share / ローカル upload_target / Blob ステージングブロック）へ書き込む。
+ハッシュ計算・サイズ上限チェック・マジックバイトによる形式判定は同じ1パスの中で行う。
+"""
+import base64
+import binascii
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import aiofiles
+
+# 1回の read で取り込むサイズ（ピークメモリはほぼこの値 + Blobブロックサイズ）
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", str(1024 * 1024)))
+# 形式判定に使う先頭バイト数
+SNIFF_BYTES = 64
+
+_FTYP_BRANDS = {
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"hevc": "image/heic",
+    b"hevx": "image/heic",
+    b"heim": "image/heic",
+    b"heis": "image/heic",
+    b"mif1": "image/heif",
+    b"msf1": "image/heif",
+    b"avif": "image/avif",
+    b"qt  ": "video/quicktime",
+    b"M4V ": "video/x-m4v",
+    b"M4VH": "video/x-m4v",
+    b"M4VP": "video/x-m4v",
+}
+
+
+class FileTooLargeError(Exception):
+    """ストリーミング中にサイズ上限を超えた場合に送出"""
+
+    def __init__(self, max_size: int):
+        super().__init__(f"file exceeds {max_size} bytes")
+        self.max_size = max_size
+
+
+class DigestMismatchError(Exception):
+    """クライアント指定のハッシュと取り込んだ内容のハッシュが一致しない場合に送出"""
+
+    def __init__(self, algorithm: str):
+        super().__init__(f"{algorithm} digest mismatch")
+        self.algorithm = algorithm
+
+
+def normalize_md5(value: Optional[str]) -> Optional[str]:
+    """
+    MD5 を16進小文字に正規化する。
+    Content-MD5 ヘッダー（RFC 1864: base64）と16進表記の両方を受け付ける。
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if re.fullmatch(r"[0-9a-fA-F]{32}", value):
+        return value.lower()
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid MD5 digest")
+    if len(raw) != 16:
+        raise ValueError("invalid MD5 digest")
+    return raw.hex()
+
+
+def normalize_sha256(value: Optional[str]) -> Optional[str]:
+    """SHA-256 を16進小文字に正規化する（16進と base64 の両方を受け付ける）"""
+    if not value:
+        return None
+    value = value.strip()
+    if re.fullmatch(r"[0-9a-fA-F]{64}", value):
+        return value.lower()
+    try:
+        raw = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("invalid SHA-256 digest")
+    if len(raw) != 32:
+        raise ValueError("invalid SHA-256 digest")
+    return raw.hex()
+
+
+def parse_digest_header(value: Optional[str]) -> dict:
+    """
+    Digest ヘッダー（RFC 3230: "sha-256=<base64>, md5=<base64>"）を {アルゴリズム: 値} に分解する。
+    マルチパートのパートヘッダー名には数字を使えないため、SHA-256 はこの形式で受け取る。
+    """
+    digests = {}
+    for part in (value or "").split(","):
+        algorithm, sep, digest = part.strip().partition("=")
+        if sep:
+            digests[algorithm.strip().lower()] = digest.strip()
+    return digests
+
+
+def digest_metadata(result) -> dict:
+    """Blob メタデータに保存するハッシュ（取り込み時に計算済みの値）"""
+    return {"md5": result.md5, "sha256": result.sha256}
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """
+    先頭バイト（マジックバイト）からMIMEタイプを推定する。
+    判定できない場合は None を返す。
+    """
+    if not head:
+        return None
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head.startswith(b"BM"):
+        return "image/bmp"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "image/tiff"
+    if head.startswith(b"RIFF") and len(head) >= 12:
+        if head[8:12] == b"WEBP":
+            return "image/webp"
+        if head[8:12] == b"AVI ":
+            return "video/x-msvideo"
+    if len(head) >= 12 and head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in _FTYP_BRANDS:
+            return _FTYP_BRANDS[brand]
+        if brand.startswith(b"3g"):
+            return "video/3gpp"
+        return "video/mp4"
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "video/webm" if b"webm" in head else "video/x-matroska"
+    if head.startswith(b"FLV"):
+        return "video/x-flv"
+    if head.startswith(b"\x30\x26\xb2\x75\x8e\x66\xcf\x11"):
+        return "video/x-ms-wmv"
+    if head.startswith(b"%PDF"):
+        return "application/pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    return None
+
+
+class IngestResult:
+    """1パスのストリーミング取り込み結果"""
+
+    def __init__(self, size: int, md5: str, sha256: str, sniffed_type: Optional[str], location: str):
+        self.size = size
+        self.md5 = md5
+        self.sha256 = sha256
+        self.sniffed_type = sniffed_type
+        self.location = location
+
+    @property
+    def is_image(self) -> bool:
+        return bool(self.sniffed_type and self.sniffed_type.startswith("image/"))
+
+    @property
+    def is_video(self) -> bool:
+        return bool(self.sniffed_type and self.sniffed_type.startswith("video/"))
+
+
+class FileSink:
+    """ローカル/File Share のファイルへチャンクを書き込むシンク"""
+
+    def __init__(self, target_path: Path):
+        self.target_path = target_path
+        self.temp_path = target_path.with_name(f".{target_path.name}.{uuid.uuid4().hex[:8]}.part")
+        self._file = None
+
+    async def open(self):
+        self.target_path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = await aiofiles.open(self.temp_path, "wb")
+
+    async def write(self, chunk: bytes):
+        await self._file.write(chunk)
+
+    async def commit(self, result: IngestResult) -> str:
+        await self._file.close()
+        self._file = None
+        os.replace(self.temp_path, self.target_path)
+        return str(self.target_path)
+
+    async def abort(self):
+        if self._file is not None:
+            await self._file.close()
+            self._file = None
+        if self.temp_path.exists():
+            self.temp_path.unlink()
+
+
+class BlobBlockSink:
+    """
+    Blob Storage にブロック単位でステージングし、最後にコミットするシンク。
+    executor は I/O 用の BoundedExecutor（executors.create_thread_pool_executor）。
+    """
+
+    def __init__(
+        self,
+        blob_helper,
+        blob_name: str,
+        executor,
+        container_name: Optional[str] = None,
+        content_type: Optional[str] = None,
+        block_size: Optional[int] = None
+    ):
+        self.blob_helper = blob_helper
+        self.blob_name = blob_name
+        self.executor = executor
+        self.container_name = container_name
+        self.content_type = content_type
+        self.block_size = block_size or blob_helper.upload_block_size_mb * 1024 * 1024
+        self._buffer = bytearray()
+        self._block_ids: List[str] = []
+
+    async def open(self):
+        return None
+
+    async def _stage(self, data: bytes):
+        block_id = base64.b64encode(f"{len(self._block_ids):08d}".encode()).decode()
+        await self.executor.run(
+            self.blob_helper.stage_block,
+            self.blob_name,
+            block_id,
+            data,
+            self.container_name
+        )
+        self._block_ids.append(block_id)
+
+    async def write(self, chunk: bytes):
+        self._buffer.extend(chunk)
+        while len(self._buffer) >= self.block_size:
+            data = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            await self._stage(data)
+
+    async def commit(self, result: IngestResult) -> str:
+        if self._buffer or not self._block_ids:
+            await self._stage(bytes(self._buffer))
+            self._buffer.clear()
+        await self.executor.run(
+            self.blob_helper.commit_block_list,
+            self.blob_name,
+            list(self._block_ids),
+            self.container_name,
+            self.content_type or result.sniffed_type,
+            digest_metadata(result)
+        )
+        return self.blob_name
+
+    async def abort(self):
+        # コミットされていないステージングブロックはBlob側で自動破棄される
+        self._buffer.clear()
+        self._block_ids.clear()
+
+
+class StreamingIngestor:
+    """UploadFile をチャンク単位で読み取りシンクへ流し込む"""
+
+    def __init__(self, max_size: int, chunk_size: int = INGEST_CHUNK_SIZE):
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    async def ingest(
+        self,
+        upload,
+        sink,
+        expected_md5: Optional[str] = None,
+        expected_sha256: Optional[str] = None
+    ) -> IngestResult:
+        """
+        upload（starlette UploadFile 互換）を読み取り sink に書き込む。
+        サイズ上限を超えた場合は書き込み途中のデータを破棄して FileTooLargeError を送出する。
+        expected_md5 / expected_sha256（クライアント指定）と一致しない場合はコミットせずに
+        DigestMismatchError を送出する。
+        """
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        head = b""
+        size = 0
+
+        await sink.open()
+        try:
+            while True:
+                chunk = await upload.read(self.chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_size:
+                    raise FileTooLargeError(self.max_size)
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                md5.update(chunk)
+                sha256.update(chunk)
+                await sink.write(chunk)
+
+            result = IngestResult(
+                size=size,
+                md5=md5.hexdigest(),
+                sha256=sha256.hexdigest(),
+                sniffed_type=sniff_content_type(head),
+                location=""
+            )
+            if expected_md5 and expected_md5 != result.md5:
+                raise DigestMismatchError("MD5")
+            if expected_sha256 and expected_sha256 != result.sha256:
+                raise DigestMismatchError("SHA-256")
+            result.location = await sink.commit(result)
+            return result
+        except BaseException:
+            await sink.abort()
+            raise
@@ -8,20 +8,19 @@ HEICやJPEGなどの画像ファイル、動画ファイル、その他すべて
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, Request, Body
 from fastapi.responses import JSONResponse, Response, StreamingResponse, RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 import os
 import shutil
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 import uuid
 import tempfile
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 import hashlib
-import aiofiles
-import threading
+import json
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from PIL import Image
-import io
+from urllib.parse import parse_qs, urlsplit
 from dotenv import load_dotenv
 from storj_client import StorjClient
 from video_processor import VideoProcessor
@@ -29,10 +28,32 @@ from models import (
     UploadResponse, HealthResponse, StatusResponse, TriggerUploadResponse,
     ErrorResponse, FileUploadResult, FileInfo, FileStatus,
     StorjImageListResponse, StorjImageItem, DeleteMediaRequest, DeleteMediaResponse,
-    UploadStatusResponse
+    UploadStatusResponse, UploadSessionCreateRequest, UploadSessionResponse,
+    DirectUploadRequest, DirectUploadResponse,
+    UploadCheckItem, UploadCheckResponse, VisibleItemsRequest, VisibleItemsResponse
 )
 from upload_queue import UploadQueue
-from urllib import request as urllib_request
+from executors import (
+    ExecutorSaturatedError, TaskBulkhead, create_process_pool_executor, create_thread_pool_executor
+)
+from coordination import KeyLock, LeaderLock, ProcessSemaphore, coordination_dir
+import media_tasks
+from storj_trigger import StorjTriggerCoordinator
+from ingest import (
+    StreamingIngestor, FileSink, BlobBlockSink, FileTooLargeError, DigestMismatchError, IngestResult,
+    normalize_md5, normalize_sha256, parse_digest_header, digest_metadata
+)
+from resumable_upload import ResumableUploadManager, ResumableUploadError
+from direct_upload import DirectUploadTickets
+from admission import AdmissionController, AdmissionMiddleware, client_id
+from hash_index import HashIndex
+from tiered_cache import CachedFile, TieredThumbnailCache
+from block_cache import BlockCache
+from stat_cache import parse_mtime, version_token
+from streaming import StreamMonitor, StreamTransfer, blocking_iterator_stream
+from file_response import RangeFileResponse
+from prefetch import GalleryPrefetcher
+from generation_queue import GenerationDroppedError, PriorityGenerationQueue, ViewportTracker
 
 VIDEO_MIME_TYPES = {
     ".mp4": "video/mp4",
@@ -46,8 +67,22 @@ VIDEO_MIME_TYPES = {
     ".wmv": "video/x-ms-wmv"
 }
 
-_thumbnail_generation_lock = threading.Lock()
-_thumbnail_generation_in_progress: set[str] = set()
+IMAGE_MIME_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "heic": "image/heic",
+    "bmp": "image/bmp",
+    "tiff": "image/tiff",
+    "gif": "image/gif"
+}
+
+# バージョン付き URL（内容が変わると URL が変わる）のキャッシュヘッダー
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 動画サムネイルのプレースホルダー（生成後に差し替わるため短く）
+PLACEHOLDER_CACHE_CONTROL = "public, max-age=60"
+
 
 
 def _parse_range_header(range_header: str, file_size: int):
@@ -98,65 +133,228 @@ def _get_video_content_type(filename: str) -> str:
     return VIDEO_MIME_TYPES.get(ext, "application/octet-stream")
 
 
-def _generate_video_placeholder(width: int = 320, height: int = 240) -> bytes:
+def _get_image_content_type(filename: str) -> str:
+    ext = filename.lower().split('.')[-1]
+    return IMAGE_MIME_TYPES.get(ext, "image/jpeg")
+
+
+_video_placeholder_cache: dict = {}
+
+
+def _media_stat(use_blob_gallery: bool, bucket_name: str, container_name: str, image_path: str) -> Optional[dict]:
+    """stat キャッシュ（ギャラリー一覧で事前に埋まる）にあるサイズ・更新日時（ストレージには問い合わせない）"""
+    if use_blob_gallery:
+        return storj_client.stat_cache.get("blob", container_name, image_path)
+    return storj_client.stat_cache.get("storj", bucket_name, image_path)
+
+
+def _validator_headers(image_path: str, variant: str, stat: Optional[dict]) -> dict:
     """
-    Generate a placeholder image for videos without thumbnails.
-    Returns JPEG bytes of a gray image with a play icon.
+    ETag / Last-Modified。
+    ETag には内容のバージョン（サイズ・更新日時）を含め、削除・上書きで一致しなくなるようにする。
+    バージョンが分からない場合（このワーカーの stat キャッシュにない）は、ストレージを確認せずに 304 を返せないため付けない。
+    """
+    if stat is None:
+        return {}
+    etag_source = f"{image_path}|{variant}|{version_token(stat['size'], stat['mtime'])}"
+    headers = {}
+    mtime = parse_mtime(stat["mtime"])
+    if mtime is not None:
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    etag_hash = hashlib.sha256(etag_source.encode("utf-8")).hexdigest()
+    # Keep ETag ASCII-safe even for non-ASCII filenames.
+    headers["ETag"] = f"\"sha256-{etag_hash}\""
+    return headers
+
+
+def _is_current_version(version: Optional[str], stat: Optional[dict]) -> bool:
+    """
+    バージョン付き URL のトークンが現在の内容を指しているか。
+    stat が分からない場合は照合できないため False（immutable にせず通常のキャッシュヘッダーで返す）。
+    """
+    if version is None or stat is None:
+        return False
+    return version == version_token(stat["size"], stat["mtime"])
+
+
+def _image_response_headers(
+    image_path: str,
+    thumbnail: bool,
+    stat: Optional[dict] = None,
+    immutable: bool = False
+) -> dict:
+    """画像レスポンスのキャッシュヘッダー（サムネイルは1日、フルサイズは1時間。バージョン付き URL は immutable）"""
+    cache_max_age = 86400 if thumbnail else 3600
+    return {
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else f"public, max-age={cache_max_age}",
+        **_validator_headers(image_path, "thumb" if thumbnail else "full", stat)
+    }
+
+
+def _provisional_response_headers() -> dict:
+    """
+    プレースホルダー・サムネイル生成失敗時の元画像のキャッシュヘッダー。
+    本来のサムネイルと同じ ETag / Last-Modified を付けると、生成後も再検証が 304 になり置き換わらないため付けない。
     """
+    return {"Cache-Control": PLACEHOLDER_CACHE_CONTROL}
+
+
+def _is_provisional(cacheable: bool, message: str) -> bool:
+    """本来の内容ではない（プレースホルダー・リサイズ失敗時の元画像）レスポンスか"""
+    return not cacheable or message.startswith("Success (original")
+
+
+def _is_not_modified(request: Optional[Request], headers: dict) -> bool:
+    """If-None-Match（優先）/ If-Modified-Since がレスポンスの ETag / Last-Modified と一致するか"""
+    if request is None or "ETag" not in headers:
+        # バージョンの分からない内容は再検証に応じず、本文を返す
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag.removeprefix("W/") == headers["ETag"] for tag in tags)
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = headers.get("Last-Modified")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(if_modified_since) >= parsedate_to_datetime(last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _video_stream_response(
+    stream_iter,
+    transfer: StreamTransfer,
+    image_path: str,
+    start: int,
+    end: int,
+    file_size: int,
+    partial: bool,
+    stat: Optional[dict] = None,
+    immutable: bool = False
+) -> StreamingResponse:
+    """
+    動画の（Range）レスポンス。
+    クライアントが切断した場合もレスポンス終了時にストリームを閉じ、rclone / Blob の読み出しを止める。
+    """
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+        **_validator_headers(image_path, "full", stat)
+    }
+    if immutable:
+        headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    if partial:
+        headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+    tracked = stream_monitor.track(stream_iter, transfer)
+    return StreamingResponse(
+        tracked,
+        media_type=_get_video_content_type(image_path),
+        headers=headers,
+        status_code=206 if partial else 200,
+        background=BackgroundTask(tracked.aclose)
+    )
+
+
+def _file_response(
+    file,
+    request: Optional[Request],
+    media_type: str,
+    headers: dict,
+    offset: int = 0
+) -> Response:
+    """開いたファイル（offset 以降）をメモリに読み込まずに返す（Range・Last-Modified 対応。ファイルはレスポンスが閉じる）"""
     try:
-        # Create a dark gray image
-        img = Image.new('RGB', (width, height), color=(48, 48, 48))
-
-        # Draw a simple play triangle using pixels (no ImageDraw dependency)
-        # Center of image
-        cx, cy = width // 2, height // 2
-
-        # Draw a circle-like area and play triangle by setting pixels
-        from PIL import ImageDraw
-        draw = ImageDraw.Draw(img)
-
-        # Draw a circle (play button background)
-        circle_radius = min(width, height) // 4
-        draw.ellipse(
-            [cx - circle_radius, cy - circle_radius, cx + circle_radius, cy + circle_radius],
-            fill=(80, 80, 80),
-            outline=(120, 120, 120),
-            width=2
+        stat = os.fstat(file.fileno())
+        size = stat.st_size - offset
+        range_header = request.headers.get("range") if request else None
+        range_tuple = _parse_range_header(range_header, size) if range_header else None
+        if range_header and not range_tuple:
+            file.close()
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        start, end = range_tuple or (0, size - 1)
+        return RangeFileResponse(
+            file,
+            size,
+            start,
+            end,
+            bool(range_tuple),
+            offset=offset,
+            mtime=stat.st_mtime,
+            headers=headers,
+            media_type=media_type
         )
+    except BaseException:
+        file.close()
+        raise
 
-        # Draw play triangle
-        triangle_size = circle_radius // 2
-        triangle_points = [
-            (cx - triangle_size // 2 + 5, cy - triangle_size),
-            (cx - triangle_size // 2 + 5, cy + triangle_size),
-            (cx + triangle_size, cy)
-        ]
-        draw.polygon(triangle_points, fill=(200, 200, 200))
-
-        # Save to bytes
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=80)
-        return output.getvalue()
+
+async def _local_file_response(
+    path: Path,
+    request: Optional[Request],
+    media_type: str,
+    headers: dict
+) -> Optional[Response]:
+    """ローカルファイルを返す（既に削除されていた場合は None。呼び出し側で通常の取得にフォールバックする）"""
+    try:
+        file = await asyncio.to_thread(open, path, "rb")
+    except FileNotFoundError:
+        return None
+    return _file_response(file, request, media_type, headers)
+
+
+async def _lookup_media_stat(
+    use_blob_gallery: bool,
+    bucket_name: str,
+    container_name: str,
+    image_path: str
+) -> Optional[dict]:
+    """stat キャッシュにないサイズ・更新日時をストレージから1回取得する（結果は stat キャッシュに入る。失敗時は None）"""
+    try:
+        if use_blob_gallery:
+            return await _get_blob_stat(image_path, container_name)
+        await storj_client.get_storj_object_info(image_path, bucket_name)
     except Exception as e:
-        print(f"Error generating video placeholder: {e}")
-        # Return a minimal 1x1 gray JPEG as fallback
-        img = Image.new('RGB', (1, 1), color=(48, 48, 48))
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=80)
-        return output.getvalue()
+        print(f"Failed to look up media stat for {image_path}: {e}")
+        return None
+    return storj_client.stat_cache.get("storj", bucket_name, image_path)
+
+
+async def _get_blob_stat(blob_name: str, container_name: str) -> Optional[dict]:
+    """Blob のサイズ・更新日時・Content-Type（キャッシュになければ I/O バルクヘッドで取得。存在しない場合は None）"""
+    stat = storj_client.stat_cache.get("blob", container_name, blob_name)
+    if stat is None:
+        stat = await io_pool.run(storj_client.fetch_blob_stat, blob_name, container_name)
+    return stat
 
 
-def _generate_video_thumbnail(
+def _thumbnail_cache_key(source: str, container: str, image_path: str) -> str:
+    """サムネイルキャッシュのキー（取得元・バケット/コンテナ・パス）"""
+    return f"thumb:{source}:{container}:{image_path}"
+
+
+async def _generate_video_placeholder(width: int = 320, height: int = 240) -> bytes:
+    """
+    Generate a placeholder image for videos without thumbnails.
+    Returns JPEG bytes of a gray image with a play icon.
+    生成結果はサイズごとにメモ化する（内容は常に同じ）。
+    """
+    key = (width, height)
+    if key not in _video_placeholder_cache:
+        _video_placeholder_cache[key] = await media_pool.run(
+            media_tasks.generate_video_placeholder, width, height
+        )
+    return _video_placeholder_cache[key]
+
+
+async def _generate_video_thumbnail(
     video_path: str,
     bucket: str,
     width: int = 320,
     height: int = 240
 ) -> tuple:
-    cache_dir = Path(__file__).parent / "thumbnail_cache"
-    cache_dir.mkdir(exist_ok=True)
-    cache_filename = video_path.replace("/", "_").replace("\\", "_")
-    cache_path = cache_dir / cache_filename
-
     path_obj = Path(video_path)
     dir_name = path_obj.parent.name
     file_stem = path_obj.stem
@@ -165,18 +363,6 @@ def _generate_video_thumbnail(
     else:
         thumb_remote_path = f"thumbnails/{file_stem}_thumb.jpg"
 
-    if cache_path.exists() and cache_path.stat().st_size > 0:
-        upload_success, upload_error = storj_client.upload_storj_file(
-            local_path=cache_path,
-            remote_path=thumb_remote_path,
-            bucket_name=bucket
-        )
-        if upload_success:
-            print(f"✓ Thumbnail uploaded to Storj (cache): {thumb_remote_path}")
-        else:
-            print(f"⚠ Failed to upload thumbnail to Storj (cache): {upload_error}")
-        return True, cache_path.read_bytes(), "Success (cached)"
-
     temp_dir = Path(os.getenv("TEMP_DIR", "./temp"))
     temp_dir.mkdir(exist_ok=True, parents=True)
 
@@ -190,23 +376,23 @@ def _generate_video_thumbnail(
         ) as temp_file:
             temp_video = Path(temp_file.name)
 
-        download_success, download_error = storj_client.download_storj_file_to_path(
-            object_path=video_path,
-            dest_path=temp_video,
-            bucket_name=bucket,
-            timeout=300
+        download_success, download_error = await rclone_pool.run(
+            storj_client.download_storj_file_to_path,
+            video_path,
+            temp_video,
+            bucket,
+            300
         )
         if not download_success:
             return False, b"", download_error
 
         temp_thumb = temp_dir / f"{uuid.uuid4().hex}_thumb.jpg"
 
-        generated = VideoProcessor.generate_thumbnail(
+        generated = await _run_video_thumbnail_job(
             str(temp_video),
             str(temp_thumb),
-            width=width,
-            height=height,
-            method="ffmpeg"
+            width,
+            height
         )
 
         if not generated or not temp_thumb.exists():
@@ -216,18 +402,17 @@ def _generate_video_thumbnail(
         if not thumb_data:
             return False, b"", "Generated thumbnail is empty"
 
-        temp_cache_path = cache_path.with_name(cache_path.name + ".tmp")
-        with open(temp_cache_path, "wb") as cache_file:
-            cache_file.write(thumb_data)
-        temp_cache_path.replace(cache_path)
+        await thumbnail_cache.put(_thumbnail_cache_key("storj", bucket, video_path), thumb_data)
 
-        upload_success, upload_error = storj_client.upload_storj_file(
-            local_path=temp_thumb,
-            remote_path=thumb_remote_path,
-            bucket_name=bucket
+        upload_success, upload_error = await rclone_pool.run(
+            storj_client.upload_storj_file,
+            temp_thumb,
+            thumb_remote_path,
+            bucket
         )
         if upload_success:
             print(f"✓ Thumbnail uploaded to Storj: {thumb_remote_path}")
+            storj_client.thumbnail_resolver.add(bucket, thumb_remote_path)
         else:
             print(f"⚠ Failed to upload thumbnail to Storj: {upload_error}")
 
@@ -239,36 +424,227 @@ def _generate_video_thumbnail(
             temp_thumb.unlink()
 
 
-def _schedule_video_thumbnail_generation(video_path: str, bucket: str) -> None:
-    with _thumbnail_generation_lock:
-        if video_path in _thumbnail_generation_in_progress:
-            return
-        _thumbnail_generation_in_progress.add(video_path)
+def _is_thumbnail_object(image_path: str) -> bool:
+    """サムネイルそのもののオブジェクト（thumbnails/ 以下・動画サムネイルの {stem}_thumb*.jpg）か"""
+    name = image_path.rsplit("/", 1)[-1].lower()
+    return image_path.startswith("thumbnails/") or "_thumb_" in name or name.endswith("_thumb.jpg")
+
+
+def _gallery_thumbnail_target(thumbnail_url: Optional[str]) -> Optional[Tuple[str, bool]]:
+    """一覧の thumbnail_url から (メディアのパス, thumbnail パラメーター) を取り出す"""
+    if not thumbnail_url:
+        return None
+    parsed = urlsplit(thumbnail_url)
+    marker = "/storj/images/"
+    index = parsed.path.find(marker)
+    if index < 0:
+        return None
+    path = parsed.path[index + len(marker):]
+    if path.startswith("v/"):
+        # バージョン付き URL（v/{token}/{path}）
+        path = path.split("/", 2)[-1]
+    thumbnail = parse_qs(parsed.query).get("thumbnail", ["true"])[0].lower() == "true"
+    return path, thumbnail
 
+
+async def _prefetch_storj_thumbnails(bucket_name: str, targets: List[Tuple[str, str]]) -> int:
+    """(キャッシュキー, サムネイルのオブジェクト) を1回の rclone copy でまとめて取得してキャッシュに入れる"""
+    dest_dir = TEMP_DIR / "prefetch" / uuid.uuid4().hex
     try:
-        success, _image_data, error_msg = _generate_video_thumbnail(
-            video_path=video_path,
-            bucket=bucket
-        )
-        if success:
-            print(f"✓ Video thumbnail generated in background: {video_path}")
-        else:
-            print(f"✗ Video thumbnail generation failed: {video_path} ({error_msg})")
+        await storj_client.copy_storj_files([object_path for _key, object_path in targets], dest_dir, bucket_name)
+        stored = 0
+        for cache_key, object_path in targets:
+            try:
+                data = await asyncio.to_thread((dest_dir / object_path).read_bytes)
+            except FileNotFoundError:
+                continue
+            if data:
+                await thumbnail_cache.put(cache_key, data)
+                stored += 1
+        return stored
     finally:
-        with _thumbnail_generation_lock:
-            _thumbnail_generation_in_progress.discard(video_path)
+        await asyncio.to_thread(shutil.rmtree, dest_dir, True)
+
+
+async def _prefetch_blob_thumbnails(container_name: str, targets: List[Tuple[str, str, bool]]) -> int:
+    """
+    Blob ギャラリーのサムネイルを同時実行数を制限してまとめて取得する。
+    targets: (キャッシュキー, Blob 名, 画像からサムネイルを生成するか)
+    通常のリクエストと同じキーで single flight に登録するため、先読み中の画像へのリクエストは結果を共有する。
+    """
+    async def fetch(cache_key: str, blob_name: str, generate: bool) -> int:
+        try:
+            if generate:
+                success, data, _error = await storj_client.single_flight.run(
+                    ("blob_thumbnail", container_name, blob_name),
+                    _generate_blob_image_thumbnail,
+                    blob_name,
+                    container_name
+                )
+            else:
+                data = await storj_client.single_flight.run(
+                    ("blob_image", container_name, blob_name),
+                    io_pool.run,
+                    blob_helper.download_blob_to_bytes,
+                    blob_name=blob_name,
+                    container_name=container_name
+                )
+                success = bool(data)
+        except Exception as e:
+            # バルクヘッドの飽和・個別の取得失敗は先読みしないだけ（通常のリクエストで取得する）
+            print(f"Gallery prefetch skipped {blob_name}: {e}")
+            return 0
+        if not success or not data:
+            return 0
+        await thumbnail_cache.put(cache_key, data)
+        return 1
+
+    results = await _gather_bounded(
+        [fetch(cache_key, blob_name, generate) for cache_key, blob_name, generate in targets],
+        GALLERY_PREFETCH_CONCURRENCY
+    )
+    return sum(results)
+
 
-def _generate_image_thumbnail(image_data: bytes, size=(300, 300)) -> tuple:
+def _schedule_gallery_prefetch(request: Request, items: list, bucket: Optional[str], page_size: int):
+    """
+    一覧したページ（と次のページ）のサムネイルのうち、キャッシュにないものを先読みする。
+    Storj は事前生成済みのサムネイルのみ（1回の rclone copy）、Blob は画像のサムネイル生成も行う。
+    サムネイルのない動画（プレースホルダー・バックフィルで生成）は対象外。
+    Storj の一括取得は single flight に登録できないため、ブラウザがすぐに個別に取得する
+    このページ（先頭 page_size 件）は対象外にし、次のページ以降だけを先読みする。
+    """
+    gallery_source = os.getenv("GALLERY_SOURCE", "").lower()
+    use_blob_gallery = gallery_source in ("azure", "blob", "storage") and blob_helper
+    bucket_name = bucket or os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+    container_name = os.getenv("AZURE_STORAGE_UPLOADED_CONTAINER", "uploaded")
+
+    storj_targets: List[Tuple[str, str]] = []
+    blob_targets: List[Tuple[str, str, bool]] = []
+    for index, item in enumerate(items):
+        target = _gallery_thumbnail_target(item.get("thumbnail_url"))
+        if target is None:
+            continue
+        path, thumbnail = target
+        if thumbnail and VideoProcessor.is_video_file(path):
+            continue
+        if use_blob_gallery:
+            cache_key = _thumbnail_cache_key("blob", container_name, path)
+            if not thumbnail_cache.contains(cache_key):
+                blob_targets.append((cache_key, path, thumbnail))
+            continue
+        if index < page_size:
+            continue
+        cache_key = _thumbnail_cache_key("storj", bucket_name, path)
+        if thumbnail_cache.contains(cache_key):
+            continue
+        if thumbnail:
+            # 事前生成済みの画像サムネイル（一覧で stat キャッシュに入っているものだけ）
+            object_path = "thumbnails/" + path.rsplit(".", 1)[0] + ".jpg"
+            if storj_client.stat_cache.get("storj", bucket_name, object_path) is None:
+                continue
+        else:
+            object_path = path
+        storj_targets.append((cache_key, object_path))
+
+    if use_blob_gallery and blob_targets:
+        gallery_prefetcher.schedule(
+            client_id(request.scope),
+            lambda: _prefetch_blob_thumbnails(container_name, blob_targets)
+        )
+    elif storj_targets:
+        gallery_prefetcher.schedule(
+            client_id(request.scope),
+            lambda: _prefetch_storj_thumbnails(bucket_name, storj_targets)
+        )
+
+
+async def _run_backfill(coro_fn, *args):
+    """
+    バックグラウンド処理をバックフィル用バルクヘッドで実行する。
+    飽和している場合は破棄する（サムネイルは次回の表示時に再度生成される）。
+    """
     try:
-        with Image.open(io.BytesIO(image_data)) as img:
-            img.thumbnail(size)
-            output = io.BytesIO()
-            img.convert("RGB").save(output, format="JPEG", quality=85)
-        return True, output.getvalue(), "Success"
-    except Exception as e:
-        return False, b"", str(e)
+        return await backfill_tasks.run(coro_fn, *args)
+    except ExecutorSaturatedError:
+        name = getattr(coro_fn, "__name__", str(coro_fn))
+        print(f"[backfill] saturated, skipped {name}{args}")
+        return None
+
+
+async def _generate_video_thumbnail_once(video_path: str, bucket: str) -> tuple:
+    """
+    ワーカー間で排他して動画サムネイルを生成する。
+    他のワーカーが生成済みの場合（ディスクキャッシュはワーカー間で共有）は生成しない。
+    """
+    cache_key = _thumbnail_cache_key("storj", bucket, video_path)
+    async with generation_locks.hold(f"video_thumbnail:{bucket}:{video_path}"):
+        cached = await thumbnail_cache.get(cache_key)
+        if cached:
+            return True, cached, "Success (already generated)"
+        return await backfill_tasks.run(_generate_video_thumbnail, video_path=video_path, bucket=bucket)
+
 
-def _generate_video_thumbnail_from_blob(
+async def _schedule_video_thumbnail_generation(video_path: str, bucket: str, client: Optional[str] = None) -> None:
+    if backfill_tasks.is_saturated():
+        print(f"[backfill] saturated, skipped video thumbnail: {video_path}")
+        return
+    # 同じ動画の生成が実行中ならその結果を待つ（生成は1回だけ）
+    # 生成は表示中の動画を優先する待ち行列を通す
+    try:
+        success, _image_data, error_msg = await storj_client.single_flight.run(
+            ("generate_video_thumbnail", bucket, video_path),
+            video_generation_queue.run,
+            video_path,
+            client,
+            _generate_video_thumbnail_once,
+            video_path,
+            bucket
+        )
+    except GenerationDroppedError:
+        # 画面外に出た動画は生成しない（次に表示されたときにプレースホルダーを返して生成し直す）
+        path_obj = Path(video_path)
+        storj_client.thumbnail_resolver.forget_missing(bucket, path_obj.parent.name, path_obj.stem)
+        print(f"[generation] dropped video thumbnail (scrolled past): {video_path}")
+        return
+    except ExecutorSaturatedError as e:
+        print(f"[generation] saturated, skipped video thumbnail: {video_path} ({e})")
+        return
+    if success:
+        # _generate_video_thumbnail がキャッシュに登録済み
+        print(f"✓ Video thumbnail generated in background: {video_path}")
+    else:
+        print(f"✗ Video thumbnail generation failed: {video_path} ({error_msg})")
+
+async def _generate_image_thumbnail(image_data: bytes, size=(300, 300)) -> tuple:
+    return await media_pool.run(media_tasks.generate_image_thumbnail, image_data, size)
+
+async def _generate_queued_image_thumbnail(
+    media_path: str,
+    image_data: bytes,
+    size=(300, 300),
+    client: Optional[str] = None
+) -> tuple:
+    """
+    オンデマンドのリサイズ（表示中の画像を優先する待ち行列を通す。
+    要求したクライアント client が画面外に出したものは取り消す）
+    """
+    return await image_generation_queue.run(media_path, client, _generate_image_thumbnail, image_data, size)
+
+async def _run_video_thumbnail_job(*args) -> bool:
+    """動画サムネイル生成（ffmpeg / OpenCV）を全ワーカー合計の同時実行数の上限内で実行する"""
+    async with ffmpeg_slots.slot():
+        return await media_pool.run(media_tasks.generate_video_thumbnail, *args)
+
+async def _generate_blob_image_thumbnail(blob_name: str, container: str, client: Optional[str] = None) -> tuple:
+    image_data = await io_pool.run(
+        blob_helper.download_blob_to_bytes,
+        blob_name=blob_name,
+        container_name=container
+    )
+    return await _generate_queued_image_thumbnail(blob_name, image_data, client=client)
+
+async def _generate_video_thumbnail_from_blob(
     blob_name: str,
     container: str,
     width: int = 320,
@@ -277,13 +653,10 @@ def _generate_video_thumbnail_from_blob(
     if not blob_helper:
         return False, b"", "Blob Storage not available"
 
-    cache_dir = Path(__file__).parent / "thumbnail_cache"
-    cache_dir.mkdir(exist_ok=True)
-    cache_filename = blob_name.replace("/", "_").replace("\\", "_")
-    cache_path = cache_dir / cache_filename
-
-    if cache_path.exists() and cache_path.stat().st_size > 0:
-        return True, cache_path.read_bytes(), "Success (cached)"
+    cache_key = _thumbnail_cache_key("blob", container, blob_name)
+    cached = await thumbnail_cache.get(cache_key)
+    if cached:
+        return True, cached, "Success (cached)"
 
     temp_dir = Path(os.getenv("TEMP_DIR", "./temp"))
     temp_dir.mkdir(exist_ok=True, parents=True)
@@ -291,29 +664,29 @@ def _generate_video_thumbnail_from_blob(
     temp_video = None
     temp_thumb = None
     try:
-        video_data = blob_helper.download_blob_to_bytes(
-            blob_name=blob_name,
-            container_name=container
-        )
-        if not video_data:
-            return False, b"", "Failed to download video"
-
         with tempfile.NamedTemporaryFile(
             dir=temp_dir,
             suffix=Path(blob_name).suffix or ".mp4",
             delete=False
         ) as temp_file:
             temp_video = Path(temp_file.name)
-            temp_file.write(video_data)
+
+        await io_pool.run(
+            blob_helper.download_file,
+            blob_name,
+            str(temp_video),
+            container
+        )
+        if not temp_video.exists() or temp_video.stat().st_size == 0:
+            return False, b"", "Failed to download video"
 
         temp_thumb = temp_dir / f"{uuid.uuid4().hex}_thumb.jpg"
 
-        generated = VideoProcessor.generate_thumbnail(
+        generated = await _run_video_thumbnail_job(
             str(temp_video),
             str(temp_thumb),
-            width=width,
-            height=height,
-            method="ffmpeg"
+            width,
+            height
         )
 
         if not generated or not temp_thumb.exists():
@@ -323,10 +696,7 @@ def _generate_video_thumbnail_from_blob(
         if not thumb_data:
             return False, b"", "Generated thumbnail is empty"
 
-        temp_cache_path = cache_path.with_name(cache_path.name + ".tmp")
-        with open(temp_cache_path, "wb") as cache_file:
-            cache_file.write(thumb_data)
-        temp_cache_path.replace(cache_path)
+        await thumbnail_cache.put(cache_key, thumb_data)
 
         try:
             # Upload thumbnail to thumbnails/YYYYMM/ directory
@@ -334,10 +704,11 @@ def _generate_video_thumbnail_from_blob(
             dir_name = path_obj.parent.name  # YYYYMM
             file_stem = path_obj.stem  # filename without extension
             thumb_blob_path = f"thumbnails/{dir_name}/{file_stem}_thumb.jpg"
-            blob_helper.upload_file(
+            await io_pool.run(
+                blob_helper.upload_file,
                 str(temp_thumb),
-                blob_name=thumb_blob_path,
-                container_name=container
+                thumb_blob_path,
+                container
             )
         except Exception as upload_error:
             print(f"Failed to upload generated thumbnail: {upload_error}")
@@ -433,6 +804,17 @@ if BLOB_STORAGE_AVAILABLE and BlobStorageHelper:
         print(f"⚠ Failed to initialize Blob Storage in main.py: {e}")
         print("  Files will be stored locally instead")
 upload_queue = UploadQueue()
+storj_trigger = StorjTriggerCoordinator()
+
+# アップロード系リクエストの受け付け制御（バイト予算・同時数・クライアント別レート・処理キュー深さ）
+# CORS より内側に置き、429 応答にも CORS ヘッダーが付くようにする
+admission = AdmissionController(queue_depth_fn=upload_queue.get_pending_count)
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    path_prefix="/upload",
+    exempt_paths=("/upload/status", "/upload/check")
+)
 
 # CORS設定
 app.add_middleware(
@@ -452,7 +834,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["Content-Length", "Content-Range", "Accept-Ranges", "Content-Type"],
+    expose_headers=["Content-Length", "Content-Range", "Accept-Ranges", "Content-Type", "Range", "Upload-Offset"],
 )
 
 @app.get("/", include_in_schema=False)
@@ -479,15 +861,318 @@ TEMP_DIR = Path(os.getenv('TEMP_DIR', '/mnt/temp'))
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '2000000000'))  # 2GB
 SUPPORTED_IMAGE_FORMATS = {'jpeg', 'jpg', 'png', 'heic', 'heif', 'webp', 'bmp', 'tiff'}
 MIRROR_BLOB_TO_LOCAL = os.getenv('MIRROR_BLOB_TO_LOCAL', 'true').lower() == 'true'
+# アップロード取り込み先: queue (File Share キュー) / local (upload_target) / blob (upload-target コンテナ)
+INGEST_DESTINATION = os.getenv('INGEST_DESTINATION', 'queue').lower()
 
 # ディレクトリ作成
 UPLOAD_TARGET_DIR.mkdir(exist_ok=True, parents=True)
 TEMP_DIR.mkdir(exist_ok=True, parents=True)
 UPLOADED_DIR.mkdir(exist_ok=True, parents=True)
 
-# 並列処理用ThreadPoolExecutor（Blob Storage I/O用）
+# 用途ごとのバルクヘッド（同時実行数・待ち行列上限・飽和度メトリクスをそれぞれ持つ）
+# I/O: Blob Storage のアップロード・ダウンロード、File Share 上のファイル移動
 UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '8'))
-blob_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+IO_QUEUE_LIMIT = int(os.getenv('IO_QUEUE_LIMIT', '256'))
+io_pool = create_thread_pool_executor("io", UPLOAD_WORKERS, IO_QUEUE_LIMIT)
+
+# CPU処理（画像検証・サムネイル生成）用プロセスプール（待ち行列に上限あり）
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', str(os.cpu_count() or 2)))
+MEDIA_QUEUE_LIMIT = int(os.getenv('MEDIA_QUEUE_LIMIT', '32'))
+media_pool = create_process_pool_executor("media", MEDIA_WORKERS, MEDIA_QUEUE_LIMIT)
+
+# Storj への rclone 呼び出し（サブプロセス待ちのためスレッドで実行）
+RCLONE_WORKERS = int(os.getenv('RCLONE_WORKERS', '4'))
+RCLONE_QUEUE_LIMIT = int(os.getenv('RCLONE_QUEUE_LIMIT', '32'))
+# rclone の同時実行数は全ワーカー合計でも制限する（storj_client の非同期呼び出しと共有）
+rclone_pool = create_thread_pool_executor(
+    "rclone",
+    RCLONE_WORKERS,
+    RCLONE_QUEUE_LIMIT,
+    process_slots=storj_client.rclone_slots
+)
+
+# バックグラウンド処理（動画サムネイルの補完生成・ハッシュインデックス再構築）
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '2'))
+BACKFILL_QUEUE_LIMIT = int(os.getenv('BACKFILL_QUEUE_LIMIT', '64'))
+backfill_tasks = TaskBulkhead("backfill", BACKFILL_CONCURRENCY, BACKFILL_QUEUE_LIMIT)
+
+bulkheads = (io_pool, media_pool, rclone_pool, backfill_tasks)
+
+# ワーカー間の調整（uvicorn --workers N で起動した場合も同一ホスト全体で上限・排他を守る）
+# ffmpeg / OpenCV による動画サムネイル生成の全ワーカー合計の同時実行数
+FFMPEG_GLOBAL_CONCURRENCY = int(os.getenv('FFMPEG_GLOBAL_CONCURRENCY', str(os.cpu_count() or 2)))
+ffmpeg_slots = ProcessSemaphore("ffmpeg", FFMPEG_GLOBAL_CONCURRENCY)
+# 同じ動画のサムネイルを複数のワーカーが生成しないための排他
+generation_locks = KeyLock("generation")
+# ハッシュインデックスの永続化ファイルとの同期（読み込み・書き出し）の排他
+hash_index_lock = KeyLock("hash_index", stripes=1)
+# 定期処理（uploaded/ の容量整理・共有キャッシュの整理）を実行するワーカーの選出
+maintenance_leader = LeaderLock("maintenance")
+
+# 1リクエスト内で並列処理するパート数の上限
+UPLOAD_PART_CONCURRENCY = int(os.getenv('UPLOAD_PART_CONCURRENCY', '4'))
+
+
+async def _gather_bounded(coros: list, limit: int = None) -> list:
+    """同時実行数を制限して asyncio.gather する（結果の順序は保持）"""
+    semaphore = asyncio.Semaphore(limit or UPLOAD_PART_CONCURRENCY)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[run(coro) for coro in coros])
+
+# 再開可能アップロード（セッションは File Share 上に保持し、再起動後も再開可能）
+resumable_uploads = ResumableUploadManager(TEMP_DIR / "sessions", MAX_FILE_SIZE)
+# 期限切れのアップロードセッション・直接アップロードの発行記録を削除する間隔
+UPLOAD_CLEANUP_SECONDS = int(os.getenv("UPLOAD_CLEANUP_SECONDS", "600"))
+
+# アップロード前存在確認用ハッシュインデックス（バケット + 処理キューから構築し File Share に永続化）
+HASH_INDEX_REFRESH_SECONDS = int(os.getenv('HASH_INDEX_REFRESH_SECONDS', '3600'))
+HASH_INDEX_FLUSH_SECONDS = int(os.getenv('HASH_INDEX_FLUSH_SECONDS', '30'))
+HASH_CHECK_MAX_ITEMS = int(os.getenv('HASH_CHECK_MAX_ITEMS', '50000'))
+hash_index = HashIndex(TEMP_DIR / "hash_index.json")
+
+# Blob 直接アップロード（SAS URL 発行記録は File Share 上に保持）
+DIRECT_UPLOAD_SAS_EXPIRY_MINUTES = int(os.getenv('DIRECT_UPLOAD_SAS_EXPIRY_MINUTES', '15'))
+direct_upload_tickets = DirectUploadTickets(TEMP_DIR / "direct_uploads")
+
+# サムネイルキャッシュ（メモリ LRU + サイズ上限付きディスク + File Share 上のレプリカ間共有層）
+THUMBNAIL_CACHE_DIR = Path(os.getenv("THUMBNAIL_CACHE_DIR", str(Path(__file__).parent / "thumbnail_cache")))
+THUMBNAIL_SHARED_CACHE = os.getenv("THUMBNAIL_SHARED_CACHE", "true").lower() == "true"
+THUMBNAIL_SHARED_CACHE_DIR = Path(os.getenv("THUMBNAIL_SHARED_CACHE_DIR", str(TEMP_DIR / "thumbnail_cache")))
+THUMBNAIL_SHARED_CACHE_PRUNE_SECONDS = int(os.getenv("THUMBNAIL_SHARED_CACHE_PRUNE_SECONDS", "3600"))
+thumbnail_cache = TieredThumbnailCache(
+    THUMBNAIL_CACHE_DIR,
+    shared_dir=THUMBNAIL_SHARED_CACHE_DIR if THUMBNAIL_SHARED_CACHE else None
+)
+
+# 動画の Range リクエスト用ブロックキャッシュ（ローカルディスク）
+BLOCK_CACHE_ENABLED = os.getenv("BLOCK_CACHE", "true").lower() == "true"
+BLOCK_CACHE_DIR = Path(os.getenv("BLOCK_CACHE_DIR", str(Path(__file__).parent / "block_cache")))
+block_cache = BlockCache(BLOCK_CACHE_DIR) if BLOCK_CACHE_ENABLED else None
+# ローカルディスク層（サムネイル・ブロックキャッシュ）の使用量の測定と容量上限の適用の間隔
+DISK_CACHE_PRUNE_SECONDS = int(os.getenv("DISK_CACHE_PRUNE_SECONDS", "60"))
+
+# 動画ストリームの送信量・切断による破棄量の集計
+stream_monitor = StreamMonitor()
+
+# uploaded/ の走査（容量上限の適用）間隔（見つからない場合の再走査は ORIGIN_CACHE_RESCAN_SECONDS ごと）
+ORIGIN_CACHE_SCAN_SECONDS = int(os.getenv("ORIGIN_CACHE_SCAN_SECONDS", "300"))
+# ギャラリー一覧（/storj/images）のブラウザキャッシュ
+GALLERY_LIST_MAX_AGE_SECONDS = int(os.getenv("GALLERY_LIST_MAX_AGE_SECONDS", "0"))
+GALLERY_LIST_STALE_SECONDS = int(os.getenv("GALLERY_LIST_STALE_SECONDS", "60"))
+# ギャラリー一覧の取得時にサムネイルを先読みする後続ページ数（0 で先読みしない）
+GALLERY_PREFETCH_PAGES = int(os.getenv("GALLERY_PREFETCH_PAGES", "1"))
+# Blob ギャラリーの先読みで同時に取得・生成するサムネイル数
+GALLERY_PREFETCH_CONCURRENCY = int(os.getenv("GALLERY_PREFETCH_CONCURRENCY", "4"))
+gallery_prefetcher = GalleryPrefetcher()
+# オンデマンドのサムネイル生成の待ち行列（POST /storj/images/visible で通知された表示中の項目を優先し、
+# 画面外に出た項目の生成は取り消す）。動画はダウンロードと ffmpeg を含むためバックフィルと同じ同時実行数にする
+GENERATION_QUEUE_LIMIT = int(os.getenv("GENERATION_QUEUE_LIMIT", "256"))
+IMAGE_GENERATION_CONCURRENCY = int(os.getenv("IMAGE_GENERATION_CONCURRENCY", str(MEDIA_WORKERS)))
+# 表示状況の通知はワーカー間で共有する（他のワーカーの通知を取り込む間隔）
+VIEWPORT_SYNC_SECONDS = float(os.getenv("VIEWPORT_SYNC_SECONDS", "1"))
+viewport_tracker = ViewportTracker(shared_dir=coordination_dir() / "viewport")
+image_generation_queue = PriorityGenerationQueue(
+    "image_generation", viewport_tracker, IMAGE_GENERATION_CONCURRENCY, GENERATION_QUEUE_LIMIT
+)
+video_generation_queue = PriorityGenerationQueue(
+    "video_generation", viewport_tracker, BACKFILL_CONCURRENCY, GENERATION_QUEUE_LIMIT
+)
+
+
+@app.exception_handler(ExecutorSaturatedError)
+async def executor_saturated_handler(request: Request, exc: ExecutorSaturatedError):
+    """処理プールが飽和している場合は 503 + Retry-After を返す"""
+    return JSONResponse(
+        status_code=503,
+        content={"error": f"サーバーが混雑しています ({exc.name})"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(ResumableUploadError)
+async def resumable_upload_error_handler(request: Request, exc: ResumableUploadError):
+    return JSONResponse(status_code=exc.status_code, content={"error": exc.message})
+
+
+async def _rebuild_hash_index():
+    """バケットの一覧と処理キューからハッシュインデックスを再構築"""
+    started = datetime.now()
+    success, objects, error = await rclone_pool.run(storj_client.list_storj_object_sizes)
+    if not success:
+        print(f"Hash index rebuild skipped: {error}")
+        return
+    records = await io_pool.run(lambda: list(upload_queue.iter_pending_requests()))
+    keys = await io_pool.run(hash_index.build_keys, objects, records)
+    hash_index.swap(keys, (datetime.now() - started).total_seconds(), started.timestamp())
+    print(f"Hash index rebuilt: {len(keys)} keys from {len(objects)} objects and {len(records)} queued requests")
+
+
+async def _sync_hash_index():
+    # 同じホストのワーカー間で読み込み・書き出しが交互に入らないようにする
+    async with hash_index_lock.hold("sync"):
+        await io_pool.run(hash_index.sync)
+
+
+async def _index_completed_uploads(since: float) -> float:
+    """
+    since 以降に Storj へのアップロードが完了したキューのレコードをインデックスに登録する。
+    Returns: 次回の since（走査の開始時刻）
+    """
+    scanned_at = datetime.now().timestamp()
+    records = await io_pool.run(upload_queue.completed_requests_since, since)
+    for record in records:
+        hash_index.add(record.get("file_size") or 0, md5=record.get("md5"), sha256=record.get("sha256"))
+    return scanned_at
+
+
+async def _hash_index_maintenance_loop():
+    """
+    定期的に File Share 上のインデックスと同期する（各ワーカーの登録を書き出し、他のワーカーの登録を取り込む）。
+    アップロード完了の登録とバケット一覧からの再構築は定期処理の担当ワーカーだけが行う。
+    """
+    completed_since = datetime.now().timestamp()
+    while True:
+        try:
+            if maintenance_leader.is_leader():
+                completed_since = await _index_completed_uploads(completed_since)
+            await _sync_hash_index()
+            if maintenance_leader.is_leader() and hash_index.is_stale(HASH_INDEX_REFRESH_SECONDS):
+                await _run_backfill(_rebuild_hash_index)
+                await _sync_hash_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Hash index maintenance error: {e}")
+        await asyncio.sleep(HASH_INDEX_FLUSH_SECONDS)
+
+
+async def _thumbnail_cache_maintenance_loop():
+    """共有層の容量を定期的に整理する"""
+    if thumbnail_cache.shared is None:
+        return
+    while True:
+        try:
+            if maintenance_leader.is_leader():
+                await _run_backfill(asyncio.to_thread, thumbnail_cache.shared.prune)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Shared thumbnail cache prune error: {e}")
+        await asyncio.sleep(THUMBNAIL_SHARED_CACHE_PRUNE_SECONDS)
+
+
+async def _disk_cache_maintenance_loop():
+    """
+    ローカルディスク層を全ワーカーの合計で容量上限内に保つ。
+    担当ワーカーがディスク上の使用量を測って古いエントリを削除し、他のワーカーはその測定値を読み込む。
+    """
+    caches = [thumbnail_cache.disk]
+    if block_cache is not None:
+        caches.append(block_cache.disk)
+    for cache in caches:
+        await io_pool.run(cache.load)
+    while True:
+        for cache in caches:
+            try:
+                if maintenance_leader.is_leader():
+                    await _run_backfill(asyncio.to_thread, cache.prune)
+                else:
+                    await io_pool.run(cache.refresh_usage)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Disk cache prune error ({cache.root}): {e}")
+        await asyncio.sleep(DISK_CACHE_PRUNE_SECONDS)
+
+
+async def _upload_cleanup_loop():
+    """
+    期限切れのアップロードセッション・直接アップロードの発行記録を定期的に削除する
+    （File Share 上のため1つのワーカーだけが行う）
+    """
+    while True:
+        try:
+            if maintenance_leader.is_leader():
+                removed = await _run_backfill(asyncio.to_thread, resumable_uploads.cleanup_expired)
+                if removed:
+                    print(f"Removed {removed} expired upload sessions")
+                removed = await _run_backfill(asyncio.to_thread, direct_upload_tickets.cleanup_expired)
+                if removed:
+                    print(f"Removed {removed} expired direct upload tickets")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Upload cleanup error: {e}")
+        await asyncio.sleep(UPLOAD_CLEANUP_SECONDS)
+
+
+async def _viewport_sync_loop():
+    """他のワーカーが受け付けた表示状況の通知を取り込み、このワーカーの生成の待ち行列に反映する"""
+    while True:
+        try:
+            states = await io_pool.run(viewport_tracker.read_shared)
+            viewport_tracker.merge(states)
+            if maintenance_leader.is_leader():
+                await io_pool.run(viewport_tracker.prune_shared)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Viewport sync error: {e}")
+        await asyncio.sleep(VIEWPORT_SYNC_SECONDS)
+
+
+def _scan_and_enforce_origin_quota():
+    storj_client.origin_cache.scan()
+    storj_client.origin_cache.enforce_quota()
+
+
+async def _origin_cache_maintenance_loop():
+    """uploaded/ を定期的に走査し、容量上限を超えた分を古いものから削除する"""
+    while True:
+        try:
+            # uploaded/ の削除は1つのワーカーだけが行う（他のワーカーは参照時の再走査で索引だけを更新する）
+            if maintenance_leader.is_leader():
+                await _run_backfill(asyncio.to_thread, _scan_and_enforce_origin_quota)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Origin cache maintenance error: {e}")
+        await asyncio.sleep(ORIGIN_CACHE_SCAN_SECONDS)
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.hash_index_task = asyncio.create_task(_hash_index_maintenance_loop())
+    app.state.thumbnail_cache_task = asyncio.create_task(_thumbnail_cache_maintenance_loop())
+    app.state.origin_cache_task = None
+    gallery_source = os.getenv("GALLERY_SOURCE", "").lower()
+    if storj_client.origin_cache is not None and not (gallery_source in ("azure", "blob", "storage") and blob_helper):
+        app.state.origin_cache_task = asyncio.create_task(_origin_cache_maintenance_loop())
+    app.state.disk_cache_task = asyncio.create_task(_disk_cache_maintenance_loop())
+    app.state.viewport_sync_task = asyncio.create_task(_viewport_sync_loop())
+    app.state.upload_cleanup_task = asyncio.create_task(_upload_cleanup_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    app.state.hash_index_task.cancel()
+    app.state.thumbnail_cache_task.cancel()
+    app.state.disk_cache_task.cancel()
+    app.state.viewport_sync_task.cancel()
+    app.state.upload_cleanup_task.cancel()
+    if app.state.origin_cache_task is not None:
+        app.state.origin_cache_task.cancel()
+    await gallery_prefetcher.aclose()
+    await _sync_hash_index()
+    await thumbnail_cache.flush()
+    for bulkhead in bulkheads:
+        bulkhead.shutdown()
+    maintenance_leader.release()
+    await storj_trigger.aclose()
 
 class ImageProcessor:
     """画像処理クラス"""
@@ -498,14 +1183,16 @@ class ImageProcessor:
         return filename.lower().split('.')[-1] in SUPPORTED_IMAGE_FORMATS
 
     @staticmethod
-    def validate_image(file_content: bytes) -> bool:
-        """画像ファイルの検証"""
-        try:
-            with Image.open(io.BytesIO(file_content)) as img:
-                img.verify()
-            return True
-        except Exception:
-            return False
+    def validate_image(source) -> bool:
+        """画像ファイルの検証（バイト列またはファイルパス）"""
+        return media_tasks.validate_image(source)
+
+    @staticmethod
+    async def validate_image_async(source) -> bool:
+        """画像ファイルの検証をプロセスプールで実行"""
+        if isinstance(source, Path):
+            source = str(source)
+        return await media_pool.run(media_tasks.validate_image, source)
 
     @staticmethod
     def generate_unique_filename(original_filename: str) -> str:
@@ -519,9 +1206,9 @@ class FileProcessor:
     """汎用ファイル処理クラス（動画・その他ファイル用）"""
 
     @staticmethod
-    def validate_file_basic(file_content: bytes, filename: str) -> bool:
+    def validate_file_basic(file_size: int, filename: str) -> bool:
         """基本的なファイル検証（空ファイルチェック等）"""
-        if not file_content or len(file_content) == 0:
+        if not file_size:
             return False
 
         # ファイル名の基本検証
@@ -558,14 +1245,14 @@ def _log_file_status(filename: str, stage: str, status: str, details: str = ""):
     print(f"[{timestamp}] [{status_icon}] [{stage}] {filename}{detail_str}")
 
 
-def _sync_upload_to_blob(file_path: Path, blob_name: str, container_name: str = None):
+def _sync_upload_to_blob(file_path: Path, blob_name: str, container_name: str = None, metadata: dict = None):
     """同期的にBlobにアップロード（ThreadPoolExecutor用）"""
     try:
         print(f"[DEBUG] Starting blob upload: {blob_name}, size: {file_path.stat().st_size if file_path.exists() else 'N/A'}")
         if container_name:
-            blob_helper.upload_file(str(file_path), blob_name, container_name=container_name)
+            blob_helper.upload_file(str(file_path), blob_name, container_name=container_name, metadata=metadata)
         else:
-            blob_helper.upload_file(str(file_path), blob_name)
+            blob_helper.upload_file(str(file_path), blob_name, metadata=metadata)
         print(f"[DEBUG] Completed blob upload: {blob_name}")
     except Exception as e:
         print(f"[ERROR] _sync_upload_to_blob for {blob_name}: {e}")
@@ -574,62 +1261,114 @@ def _sync_upload_to_blob(file_path: Path, blob_name: str, container_name: str =
         raise
 
 
-def _sync_generate_thumbnail(video_file_path: str, thumbnail_path: str, width: int, height: int):
-    """同期的にサムネイル生成（ThreadPoolExecutor用）"""
-    return VideoProcessor.generate_thumbnail(video_file_path, thumbnail_path, width=width, height=height)
+def _ingest_sink(unique_filename: str, content_type: str):
+    """INGEST_DESTINATION に応じた書き込み先シンクを返す"""
+    if INGEST_DESTINATION == "blob" and blob_helper:
+        return BlobBlockSink(blob_helper, unique_filename, io_pool, content_type=content_type)
+    if INGEST_DESTINATION == "local":
+        return FileSink(UPLOAD_TARGET_DIR / unique_filename)
+    return FileSink(upload_queue.files_dir / unique_filename)
+
+
+def _ingested_to_blob() -> bool:
+    return INGEST_DESTINATION == "blob" and blob_helper is not None
+
+
+async def _ingest_upload(file: UploadFile, unique_filename: str, content_type: str) -> IngestResult:
+    """
+    アップロードパートをチャンク単位で取り込み先へストリーミング保存。
+    パートヘッダー Digest (md5=, sha-256=) / Content-MD5 があれば取り込み中に計算したハッシュと照合する。
+    """
+    digests = parse_digest_header(file.headers.get("digest"))
+    expected_md5 = normalize_md5(file.headers.get("content-md5") or digests.get("md5"))
+    expected_sha256 = normalize_sha256(digests.get("sha-256"))
+    ingestor = StreamingIngestor(max_size=MAX_FILE_SIZE)
+    return await ingestor.ingest(
+        file,
+        _ingest_sink(unique_filename, content_type),
+        expected_md5=expected_md5,
+        expected_sha256=expected_sha256
+    )
+
 
-def _trigger_storj_processor():
-    """Storj Container (KEDA HTTP) を起動させるためのHTTPトリガー"""
-    url = os.getenv("STORJ_CONTAINER_URL")
-    if not url:
-        print("STORJ_CONTAINER_URL not set; skipping trigger")
-        return False, "STORJ_CONTAINER_URL not set"
+async def _discard_ingested(result: IngestResult) -> None:
+    """検証に失敗した取り込み済みデータを削除"""
     try:
-        req = urllib_request.Request(url, method="POST")
-<<<<<<< HEAD
-        # KEDA HTTP scaler can take 30-60 seconds to spin up a replica from 0; allow 90s timeout
-        with urllib_request.urlopen(req, timeout=90) as resp:
-=======
-        # KEDA HTTP scaler can take a few seconds to spin up a replica; allow a longer timeout
-        with urllib_request.urlopen(req, timeout=20) as resp:
->>>>>>> remotes/origin/claude/android-mobile-compatibility-XDY7B
-            _ = resp.read()
-        print(f"Triggered Storj processor via HTTP: {url}")
-        return True, "triggered"
+        if _ingested_to_blob():
+            await io_pool.run(blob_helper.delete_blob, result.location)
+        else:
+            Path(result.location).unlink(missing_ok=True)
     except Exception as e:
-        print(f"Failed to trigger Storj processor: {e}")
-        return False, str(e)
+        print(f"Failed to discard ingested file {result.location}: {e}")
 
-def _schedule_trigger_after_upload(background_tasks: BackgroundTasks, success_count: int) -> None:
-    """Kick the Storj processor after successful uploads without blocking the response."""
-    if success_count <= 0:
-        return
-    background_tasks.add_task(_trigger_storj_processor)
 
-async def _enqueue_file(
+async def _auto_trigger_storj_upload():
+    """
+    upload_target のファイル数が5個以上になったら Storj Uploader を実行する。
+    ファイル数の取得（ディレクトリの走査・Blob の一覧）とスレッドの起動はイベントループを止めないよう io_pool で行う。
+    """
+    file_count = await io_pool.run(storj_client.count_files_in_target)
+    if file_count >= 5:
+        _log_file_status("*", "BACKEND:AUTO_TRIGGER", "processing", f"triggering Storj upload for {file_count} files")
+        await io_pool.run(storj_client.run_storj_uploader_async)
+
+
+async def _finalize_ingest(
     unique_filename: str,
     original_filename: str,
-    content: bytes,
+    result: IngestResult,
     content_type: str
 ) -> FileUploadResult:
-    """ファイルをFile Shareキューに保存し、Storj Containerをトリガー"""
-    files_dir = upload_queue.files_dir
-    files_dir.mkdir(parents=True, exist_ok=True)
-    target_path = files_dir / unique_filename
+    """
+    取り込み先に応じてキュー登録、またはupload_target蓄積時の自動トリガーを行う。
+    ハッシュインデックスには Storj へのアップロードが完了してから登録する（_index_completed_uploads）。
+    ここで登録すると、アップロードに失敗しても /upload/check が保持済みと答え、クライアントが再送しなくなる。
+    """
+    if INGEST_DESTINATION in ("local", "blob"):
+        await _auto_trigger_storj_upload()
+        return FileUploadResult(
+            filename=original_filename,
+            saved_as=unique_filename,
+            status=FileStatus.SUCCESS,
+            message="アップロード対象に追加しました"
+        )
+
+    return await _enqueue_file(
+        unique_filename=unique_filename,
+        original_filename=original_filename,
+        file_path=Path(result.location),
+        file_size=result.size,
+        content_type=content_type,
+        md5=result.md5,
+        sha256=result.sha256
+    )
 
-    async with aiofiles.open(target_path, 'wb') as f:
-        await f.write(content)
 
+async def _enqueue_file(
+    unique_filename: str,
+    original_filename: str,
+    file_path: Optional[Path],
+    file_size: int,
+    content_type: str,
+    blob_name: Optional[str] = None,
+    md5: Optional[str] = None,
+    sha256: Optional[str] = None
+) -> FileUploadResult:
+    """File Share（または Blob）に保存済みのファイルをキューに登録し、Storj Containerをトリガー"""
     upload_queue.add_upload_request(
-        file_path=target_path,
+        file_path=file_path,
         file_name=unique_filename,
-        file_size=len(content),
+        file_size=file_size,
         content_type=content_type,
         saved_as=unique_filename,
-        original_name=original_filename
+        original_name=original_filename,
+        blob_name=blob_name,
+        md5=md5,
+        sha256=sha256
     )
 
-    _trigger_storj_processor()
+    # デバウンスされた非同期トリガー（複数ファイルでも起動は1回にまとまる）
+    storj_trigger.request_trigger()
 
     return FileUploadResult(
         filename=original_filename,
@@ -638,6 +1377,66 @@ async def _enqueue_file(
         message="キューに追加しました"
     )
 
+async def _place_assembled_upload(result: IngestResult, unique_filename: str) -> IngestResult:
+    """組み立て済みファイル（再開可能アップロード）を取り込み先へ移動"""
+    source = Path(result.location)
+    if _ingested_to_blob():
+        # 動画のサムネイルは組み立て済みのローカルファイルから Blob アップロードと並行して生成する
+        thumbnail_task = _start_spool_thumbnail(source, unique_filename)
+        try:
+            await io_pool.run(
+                _sync_upload_to_blob, source, unique_filename, None, digest_metadata(result)
+            )
+        except Exception:
+            thumbnail_path = await _await_spool_thumbnail(thumbnail_task)
+            if thumbnail_path:
+                thumbnail_path.unlink(missing_ok=True)
+            raise
+        thumbnail_path = await _await_spool_thumbnail(thumbnail_task)
+        source.unlink(missing_ok=True)
+        if thumbnail_path:
+            await _publish_video_thumbnail(thumbnail_path)
+        location = unique_filename
+    else:
+        target_dir = UPLOAD_TARGET_DIR if INGEST_DESTINATION == "local" else upload_queue.files_dir
+        target = target_dir / unique_filename
+        await io_pool.run(shutil.move, str(source), str(target))
+        location = str(target)
+    return IngestResult(result.size, result.md5, result.sha256, result.sniffed_type, location)
+
+async def _generate_direct_upload_video_thumbnail(blob_name: str) -> None:
+    """
+    Blob に直接アップロードされた動画のサムネイル（{stem}_thumb.jpg）を生成してキューに登録する。
+    Storj Container がサムネイルを thumbnails/YYYYMM/ に配置する。
+    """
+    temp_video = TEMP_DIR / f"{uuid.uuid4().hex}{Path(blob_name).suffix}"
+    thumbnail_filename = f"{Path(blob_name).stem}_thumb.jpg"
+    thumbnail_path = upload_queue.files_dir / thumbnail_filename
+    _log_file_status(blob_name, "BACKEND:THUMBNAIL", "processing", "downloading from Blob for thumbnail")
+    try:
+        await io_pool.run(blob_helper.download_file, blob_name, str(temp_video))
+        success = await _run_video_thumbnail_job(
+            str(temp_video),
+            str(thumbnail_path),
+            320,
+            240
+        )
+        if not success or not thumbnail_path.exists():
+            _log_file_status(blob_name, "BACKEND:THUMBNAIL", "error", "failed to generate thumbnail")
+            return
+        await _enqueue_file(
+            unique_filename=thumbnail_filename,
+            original_filename=thumbnail_filename,
+            file_path=thumbnail_path,
+            file_size=thumbnail_path.stat().st_size,
+            content_type="image/jpeg"
+        )
+        _log_file_status(thumbnail_filename, "BACKEND:THUMBNAIL", "success", "thumbnail queued")
+    except Exception as e:
+        _log_file_status(blob_name, "BACKEND:THUMBNAIL", "error", str(e))
+    finally:
+        temp_video.unlink(missing_ok=True)
+
 def _file_status(name: str) -> str:
     """
     アップロード進捗ステータスを判定 (File Share キュー準拠)
@@ -657,139 +1456,130 @@ def _file_status(name: str) -> str:
         return "error"
     return "unknown"
 
+def _start_spool_thumbnail(video_path: Path, video_filename: str) -> Optional[asyncio.Task]:
+    """
+    動画であれば、API が保持しているローカルのファイルからサムネイル生成を開始する。
+    Blob へのアップロードと並行して実行するため、Blob から動画を再ダウンロードする必要がない。
+    """
+    if not VideoProcessor.is_video_file(video_filename):
+        return None
+    return asyncio.create_task(_generate_spool_video_thumbnail(video_path, video_filename))
+
+
+async def _generate_spool_video_thumbnail(video_path: Path, video_filename: str) -> Optional[Path]:
+    """ローカルの動画からサムネイル（{stem}_thumb.jpg）を TEMP_DIR に生成し、そのパスを返す"""
+    thumbnail_path = TEMP_DIR / f"{Path(video_filename).stem}_thumb.jpg"
+    _log_file_status(video_filename, "BACKEND:THUMBNAIL", "processing", "generating video thumbnail from local spool")
+    try:
+        success = await _run_video_thumbnail_job(
+            str(video_path),
+            str(thumbnail_path),
+            320,
+            240,
+            "opencv"
+        )
+    except Exception as e:
+        _log_file_status(video_filename, "BACKEND:THUMBNAIL", "error", str(e))
+        return None
+    if not success or not thumbnail_path.exists():
+        _log_file_status(video_filename, "BACKEND:THUMBNAIL", "error", "failed to generate thumbnail")
+        return None
+    _log_file_status(thumbnail_path.name, "BACKEND:THUMBNAIL", "success", "thumbnail generated")
+    return thumbnail_path
+
+
+async def _await_spool_thumbnail(thumbnail_task: Optional[asyncio.Task]) -> Optional[Path]:
+    """サムネイル生成の完了を待つ（動画のローカルファイルを移動・削除する前に呼ぶ）"""
+    if thumbnail_task is None:
+        return None
+    return await thumbnail_task
+
+
+async def _publish_video_thumbnail(thumbnail_path: Path) -> None:
+    """
+    生成したサムネイルを upload-target（Blob Storage またはローカル）に配置する。
+    Storj Container が thumbnails/YYYYMM/ にアップロードする。
+    """
+    thumbnail_filename = thumbnail_path.name
+    try:
+        if blob_helper:
+            upload_container = os.getenv("AZURE_STORAGE_UPLOAD_CONTAINER", "upload-target")
+            _log_file_status(thumbnail_filename, "BACKEND:BLOB_UPLOAD", "processing", "uploading thumbnail to Blob")
+            await io_pool.run(
+                _sync_upload_to_blob,
+                thumbnail_path,
+                thumbnail_filename,
+                upload_container
+            )
+            _log_file_status(thumbnail_filename, "BACKEND:BLOB_UPLOAD", "success", f"uploaded to {upload_container}")
+            if not MIRROR_BLOB_TO_LOCAL:
+                thumbnail_path.unlink(missing_ok=True)
+                return
+        target = UPLOAD_TARGET_DIR / thumbnail_filename
+        await io_pool.run(shutil.move, str(thumbnail_path), str(target))
+        _log_file_status(thumbnail_filename, "BACKEND:LOCAL_MOVE", "success", "thumbnail placed in local upload_target")
+    except Exception as e:
+        _log_file_status(thumbnail_filename, "BACKEND:THUMBNAIL", "error", f"failed to place thumbnail: {e}")
+        thumbnail_path.unlink(missing_ok=True)
+
+
 async def save_file_to_target(file_path: Path, target_path: Path):
     """ファイルをターゲットディレクトリに移動し、必要に応じてアップロードをトリガー"""
-    loop = asyncio.get_event_loop()
     filename = target_path.name
+    # 動画のサムネイルは手元のファイルから生成し、Blob へのアップロードと並行させる
+    thumbnail_task = _start_spool_thumbnail(file_path, filename)
     try:
-        # Blob Storageが利用可能な場合はBlobにアップロード、そうでなければローカルに移動
+        blob_uploaded = False
         if blob_helper:
             try:
                 # Blobにアップロード（非同期）
-                blob_name = target_path.name
                 _log_file_status(filename, "BACKEND:BLOB_UPLOAD", "processing", "uploading to Blob Storage")
-                await loop.run_in_executor(
-                    blob_executor,
+                await io_pool.run(
                     _sync_upload_to_blob,
                     file_path,
-                    blob_name,
+                    filename,
                     None
                 )
+                blob_uploaded = True
                 _log_file_status(filename, "BACKEND:BLOB_UPLOAD", "success", "uploaded to upload-target container")
+            except Exception as blob_error:
+                _log_file_status(filename, "BACKEND:BLOB_UPLOAD", "error", str(blob_error))
 
-                # Blobへのアップロード後にローカルupload_targetにも配置（Storj Containerがローカルモードでも拾えるようにする）
-                if MIRROR_BLOB_TO_LOCAL:
-                    try:
-                        target_path.parent.mkdir(parents=True, exist_ok=True)
-                        shutil.move(str(file_path), str(target_path))
-                        _log_file_status(filename, "BACKEND:LOCAL_MIRROR", "success", "mirrored to local upload_target")
-                    except Exception as mirror_error:
-                        _log_file_status(filename, "BACKEND:LOCAL_MIRROR", "error", f"mirror failed: {mirror_error}")
-                        if file_path.exists():
-                            file_path.unlink()
-                else:
+        # サムネイル生成がローカルファイルを読み終えるまで移動・削除しない
+        thumbnail_path = await _await_spool_thumbnail(thumbnail_task)
+        thumbnail_task = None
+
+        if blob_uploaded:
+            # Blobへのアップロード後にローカルupload_targetにも配置（Storj Containerがローカルモードでも拾えるようにする）
+            if MIRROR_BLOB_TO_LOCAL:
+                try:
+                    target_path.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(file_path), str(target_path))
+                    _log_file_status(filename, "BACKEND:LOCAL_MIRROR", "success", "mirrored to local upload_target")
+                except Exception as mirror_error:
+                    _log_file_status(filename, "BACKEND:LOCAL_MIRROR", "error", f"mirror failed: {mirror_error}")
                     if file_path.exists():
                         file_path.unlink()
-
-            except Exception as blob_error:
-                _log_file_status(filename, "BACKEND:BLOB_UPLOAD", "error", str(blob_error))
-                # フォールバック: ローカルファイルシステムに移動
-                await loop.run_in_executor(blob_executor, shutil.move, str(file_path), str(target_path))
-                _log_file_status(filename, "BACKEND:LOCAL_MOVE", "success", "moved to local target directory")
+            else:
+                if file_path.exists():
+                    file_path.unlink()
         else:
-            # Blob Storageが利用不可の場合はローカルに移動
+            # Blob Storageが利用不可（またはアップロード失敗）の場合はローカルに移動
             _log_file_status(filename, "BACKEND:LOCAL_MOVE", "processing", "moving to local directory")
-            await loop.run_in_executor(blob_executor, shutil.move, str(file_path), str(target_path))
-            _log_file_status(filename, "BACKEND:LOCAL_MOVE", "success", "moved to target directory")
-
-        # 動画ファイルの場合、サムネイルを生成
-        # Note: サムネイル生成はローカルファイルが必要なため、Blob Storageモードでは一時的にダウンロードが必要
-        video_filename = target_path.name
-        if VideoProcessor.is_video_file(video_filename):
-            _log_file_status(filename, "BACKEND:THUMBNAIL", "processing", "generating video thumbnail")
-            try:
-                temp_video_path = None
-                # Blob Storageからダウンロードしてサムネイル生成
-                if blob_helper and blob_helper.blob_exists(video_filename):
-                    # 一時ファイルにダウンロード（非同期）
-                    temp_video_path = TEMP_DIR / video_filename
-                    _log_file_status(filename, "BACKEND:THUMBNAIL", "processing", "downloading from Blob for thumbnail")
-                    await loop.run_in_executor(
-                        blob_executor,
-                        blob_helper.download_file,
-                        video_filename,
-                        str(temp_video_path)
-                    )
-                    video_file_path = temp_video_path
-                else:
-                    # ローカルファイルを使用
-                    video_file_path = target_path
-
-                # サムネイルのファイル名を生成 (basename_thumb.jpg)
-                video_stem = Path(video_filename).stem  # 拡張子なしのファイル名
-                thumbnail_filename = f"{video_stem}_thumb.jpg"
-                thumbnail_path = TEMP_DIR / thumbnail_filename
-
-                # サムネイル生成（非同期）
-                success = await loop.run_in_executor(
-                    blob_executor,
-                    _sync_generate_thumbnail,
-                    str(video_file_path),
-                    str(thumbnail_path),
-                    320,
-                    240
-                )
-
-                if success:
-                    _log_file_status(thumbnail_filename, "BACKEND:THUMBNAIL", "success", "thumbnail generated")
-                    # サムネイルをBlob Storageのupload-targetコンテナにアップロード
-                    # storj_container_appがStorjにアップロードする
-                    if blob_helper:
-                        try:
-                            # upload-targetコンテナに保存（storj_uploaderが処理する）
-                            upload_container = os.getenv("AZURE_STORAGE_UPLOAD_CONTAINER", "upload-target")
-                            _log_file_status(thumbnail_filename, "BACKEND:BLOB_UPLOAD", "processing", "uploading thumbnail to Blob")
-                            await loop.run_in_executor(
-                                blob_executor,
-                                _sync_upload_to_blob,
-                                thumbnail_path,
-                                thumbnail_filename,
-                                upload_container
-                            )
-                            _log_file_status(thumbnail_filename, "BACKEND:BLOB_UPLOAD", "success", f"uploaded to {upload_container}")
-                            if MIRROR_BLOB_TO_LOCAL:
-                                try:
-                                    local_thumb_path = UPLOAD_TARGET_DIR / thumbnail_filename
-                                    local_thumb_path.parent.mkdir(parents=True, exist_ok=True)
-                                    shutil.move(str(thumbnail_path), str(local_thumb_path))
-                                    _log_file_status(thumbnail_filename, "BACKEND:LOCAL_MIRROR", "success", "thumbnail mirrored to local upload_target")
-                                except Exception as thumb_mirror_error:
-                                    _log_file_status(thumbnail_filename, "BACKEND:LOCAL_MIRROR", "error", f"mirror failed: {thumb_mirror_error}")
-                                    if thumbnail_path.exists():
-                                        thumbnail_path.unlink()
-                            else:
-                                if thumbnail_path.exists():
-                                    thumbnail_path.unlink()  # アップロード後削除
-                        except Exception as thumb_upload_error:
-                            _log_file_status(thumbnail_filename, "BACKEND:BLOB_UPLOAD", "error", str(thumb_upload_error))
-                else:
-                    _log_file_status(filename, "BACKEND:THUMBNAIL", "error", "failed to generate thumbnail")
-
-                # 一時ダウンロードしたファイルを削除
-                if temp_video_path and temp_video_path.exists():
-                    temp_video_path.unlink()
+            await io_pool.run(shutil.move, str(file_path), str(target_path))
+            _log_file_status(filename, "BACKEND:LOCAL_MOVE", "success", "moved to target directory")
 
-            except Exception as thumb_error:
-                _log_file_status(filename, "BACKEND:THUMBNAIL", "error", str(thumb_error))
+        if thumbnail_path:
+            await _publish_video_thumbnail(thumbnail_path)
 
         # ファイル数が5個以上になったら自動的にアップロードを実行
-        file_count = storj_client.count_files_in_target()
-        if file_count >= 5:
-            _log_file_status("*", "BACKEND:AUTO_TRIGGER", "processing", f"triggering Storj upload for {file_count} files")
-            storj_client.run_storj_uploader_async()
+        await _auto_trigger_storj_upload()
 
     except Exception as e:
         _log_file_status(filename, "BACKEND:ERROR", "error", str(e))
+        thumbnail_path = await _await_spool_thumbnail(thumbnail_task)
+        if thumbnail_path:
+            thumbnail_path.unlink(missing_ok=True)
         if file_path.exists():
             file_path.unlink()
 
@@ -868,24 +1658,49 @@ async def upload_images(
                     "message": "サポートされていない画像形式です"
                 }
 
-            # ファイル内容を読み取り
-            content = await file.read()
+            # 一意のファイル名生成
+            unique_filename = ImageProcessor.generate_unique_filename(file.filename)
+            content_type = file.content_type or "application/octet-stream"
+
+            # チャンク単位で取り込み先へ保存（ハッシュ・サイズ・形式判定も同時に実施）
+            try:
+                ingested = await _ingest_upload(file, unique_filename, content_type)
+            except FileTooLargeError:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"ファイルサイズが上限({MAX_FILE_SIZE / (1024*1024):.1f}MB)を超えています"
+                }
+            except DigestMismatchError as e:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"{e.algorithm} が一致しません"
+                }
+            except ValueError as e:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"ハッシュの指定が不正です: {e}"
+                }
 
-            # 画像検証
-            if not ImageProcessor.validate_image(content):
+            # 画像検証（マジックバイト + ローカル保存時はPILによる検証）
+            is_valid_image = ingested.is_image
+            if is_valid_image and not _ingested_to_blob():
+                is_valid_image = await ImageProcessor.validate_image_async(Path(ingested.location))
+            if not is_valid_image:
+                await _discard_ingested(ingested)
                 return {
                     "filename": file.filename,
                     "status": "error",
                     "message": "有効な画像ファイルではありません"
                 }
 
-            # 一意のファイル名生成
-            unique_filename = ImageProcessor.generate_unique_filename(file.filename)
-            result = await _enqueue_file(
+            result = await _finalize_ingest(
                 unique_filename=unique_filename,
                 original_filename=file.filename,
-                content=content,
-                content_type=file.content_type or "application/octet-stream"
+                result=ingested,
+                content_type=content_type
             )
 
             _log_file_status(file.filename, "BACKEND:COMPLETE", "success", f"queued as {unique_filename}")
@@ -896,6 +1711,13 @@ async def upload_images(
                 "message": "アップロード完了、処理キューに追加されました"
             }
 
+        except ExecutorSaturatedError as e:
+            _log_file_status(file.filename, "BACKEND:ERROR", "error", str(e))
+            return {
+                "filename": file.filename,
+                "status": "error",
+                "message": "サーバーが混雑しています。しばらくしてから再試行してください"
+            }
         except Exception as e:
             _log_file_status(file.filename, "BACKEND:ERROR", "error", str(e))
             return {
@@ -904,10 +1726,9 @@ async def upload_images(
                 "message": f"処理エラー: {str(e)}"
             }
 
-    # 複数ファイルを並列処理
-    results = await asyncio.gather(*[process_single_image(file) for file in files])
+    # 複数ファイルを並列処理（同時実行数は UPLOAD_PART_CONCURRENCY まで）
+    results = await _gather_bounded([process_single_image(file) for file in files])
     success_count = len([r for r in results if r["status"] == "success"])
-    _schedule_trigger_after_upload(background_tasks, success_count)
 
     return {
         "message": f"{success_count}個のファイルが正常にアップロードされました",
@@ -990,27 +1811,52 @@ async def upload_files(
                     "file_info": FileProcessor.get_file_info(file.filename, file.size)
                 }
 
-            # ファイル内容を読み取り
-            content = await file.read()
+            # 一意のファイル名生成
+            unique_filename = FileProcessor.generate_unique_filename(file.filename)
+            content_type = file.content_type or "application/octet-stream"
+
+            # チャンク単位で取り込み先へ保存（ハッシュ・サイズ・形式判定も同時に実施）
+            try:
+                ingested = await _ingest_upload(file, unique_filename, content_type)
+            except FileTooLargeError:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"ファイルサイズが上限({MAX_FILE_SIZE / (1024*1024):.1f}MB)を超えています",
+                    "file_info": FileProcessor.get_file_info(file.filename, file.size or 0)
+                }
+            except DigestMismatchError as e:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"{e.algorithm} が一致しません",
+                    "file_info": FileProcessor.get_file_info(file.filename, file.size or 0)
+                }
+            except ValueError as e:
+                return {
+                    "filename": file.filename,
+                    "status": "error",
+                    "message": f"ハッシュの指定が不正です: {e}",
+                    "file_info": FileProcessor.get_file_info(file.filename, file.size or 0)
+                }
 
             # 基本的なファイル検証（形式制限なし）
-            if not FileProcessor.validate_file_basic(content, file.filename):
+            if not FileProcessor.validate_file_basic(ingested.size, file.filename):
+                await _discard_ingested(ingested)
                 return {
                     "filename": file.filename,
                     "status": "error",
                     "message": "無効なファイルです（空ファイルまたは無効なファイル名）",
-                    "file_info": FileProcessor.get_file_info(file.filename, len(content))
+                    "file_info": FileProcessor.get_file_info(file.filename, ingested.size)
                 }
 
-            # 一意のファイル名生成
-            unique_filename = FileProcessor.generate_unique_filename(file.filename)
-            file_info = FileProcessor.get_file_info(file.filename, len(content))
+            file_info = FileProcessor.get_file_info(file.filename, ingested.size)
 
-            await _enqueue_file(
+            await _finalize_ingest(
                 unique_filename=unique_filename,
                 original_filename=file.filename,
-                content=content,
-                content_type=file.content_type or "application/octet-stream"
+                result=ingested,
+                content_type=content_type
             )
 
             _log_file_status(file.filename, "BACKEND:COMPLETE", "success", f"queued as {unique_filename}")
@@ -1022,6 +1868,14 @@ async def upload_files(
                 "file_info": file_info
             }
 
+        except ExecutorSaturatedError as e:
+            _log_file_status(file.filename, "BACKEND:ERROR", "error", str(e))
+            return {
+                "filename": file.filename,
+                "status": "error",
+                "message": "サーバーが混雑しています。しばらくしてから再試行してください",
+                "file_info": FileProcessor.get_file_info(file.filename, 0) if file.filename else {}
+            }
         except Exception as e:
             _log_file_status(file.filename, "BACKEND:ERROR", "error", str(e))
             return {
@@ -1031,10 +1885,9 @@ async def upload_files(
                 "file_info": FileProcessor.get_file_info(file.filename, 0) if file.filename else {}
             }
 
-    # 複数ファイルを並列処理
-    results = await asyncio.gather(*[process_single_file(file) for file in files])
+    # 複数ファイルを並列処理（同時実行数は UPLOAD_PART_CONCURRENCY まで）
+    results = await _gather_bounded([process_single_file(file) for file in files])
     success_count = len([r for r in results if r["status"] == "success"])
-    _schedule_trigger_after_upload(background_tasks, success_count)
 
     return {
         "message": f"{success_count}個のファイルが正常にアップロードされました",
@@ -1063,6 +1916,355 @@ async def upload_single_file(
     """
     return await upload_files(background_tasks, [file])
 
+def _upload_session_response(state: dict) -> dict:
+    return {**state, "upload_url": f"/upload/sessions/{state['session_id']}"}
+
+def _upload_offset_headers(state: dict) -> dict:
+    headers = {"Upload-Offset": str(state["offset"])}
+    if state["offset"]:
+        headers["Range"] = f"bytes=0-{state['offset'] - 1}"
+    return headers
+
+@app.post(
+    "/upload/sessions",
+    response_model=UploadSessionResponse,
+    status_code=201,
+    tags=["files"],
+    summary="再開可能アップロードセッション作成",
+    description="""
+    大きなファイル（モバイル回線からの動画等）を分割して送信するためのセッションを作成します。
+
+    **処理フロー:**
+    1. `POST /upload/sessions` でセッション作成（ファイル名・サイズ・任意でSHA-256/MD5）
+    2. `PUT /upload/sessions/{session_id}` に `Content-Range: bytes start-end/total` 付きでチャンクを送信（並列送信可）
+    3. 中断した場合は `GET /upload/sessions/{session_id}` で受信済みオフセット・未受信レンジを取得して再開
+    4. `POST /upload/sessions/{session_id}/complete` で組み立て・ハッシュ検証・処理キュー登録
+
+    セッションは File Share 上に保存されるため、APIの再起動後も再開できます。
+    """,
+    responses={
+        400: {"description": "リクエストエラー", "model": ErrorResponse},
+        413: {"description": "ファイルサイズ超過", "model": ErrorResponse},
+    }
+)
+async def create_upload_session(request: UploadSessionCreateRequest):
+    """再開可能アップロードセッション作成"""
+    session = await io_pool.run(
+        resumable_uploads.create_session,
+        filename=request.filename,
+        file_size=request.file_size,
+        content_type=request.content_type,
+        sha256=request.sha256,
+        md5=request.md5
+    )
+    _log_file_status(session["filename"], "BACKEND:SESSION", "processing", f"session={session['session_id']} size={request.file_size}")
+    return _upload_session_response(await io_pool.run(resumable_uploads.describe, session))
+
+@app.put(
+    "/upload/sessions/{session_id}",
+    response_model=UploadSessionResponse,
+    tags=["files"],
+    summary="チャンク送信",
+    description="""リクエストボディのバイト列を `Content-Range: bytes start-end/total` の位置に書き込みます。
+    異なるレンジのチャンクは並列に送信できます。レスポンスの `Upload-Offset` / `Range` ヘッダーは先頭から連続して受信済みの範囲です。""",
+    responses={
+        400: {"description": "Content-Range不正・ボディ長不一致", "model": ErrorResponse},
+        404: {"description": "セッションが存在しない", "model": ErrorResponse},
+        409: {"description": "セッション完了済み", "model": ErrorResponse},
+        410: {"description": "セッション期限切れ", "model": ErrorResponse},
+        416: {"description": "レンジがファイルサイズの範囲外", "model": ErrorResponse},
+    }
+)
+async def upload_session_chunk(session_id: str, request: Request):
+    """チャンク送信"""
+    content_length = request.headers.get("content-length")
+    state = await resumable_uploads.write_chunk(
+        session_id,
+        request.headers.get("content-range"),
+        request.stream(),
+        content_length=int(content_length) if content_length and content_length.isdigit() else None
+    )
+    return JSONResponse(content=_upload_session_response(state), headers=_upload_offset_headers(state))
+
+@app.get(
+    "/upload/sessions/{session_id}",
+    response_model=UploadSessionResponse,
+    tags=["files"],
+    summary="アップロードセッション状態取得",
+    description="受信済みオフセットと未受信レンジを返します。中断後の再開位置の確認に使用します。",
+    responses={
+        404: {"description": "セッションが存在しない", "model": ErrorResponse},
+        410: {"description": "セッション期限切れ", "model": ErrorResponse},
+    }
+)
+async def get_upload_session(session_id: str):
+    """アップロードセッション状態取得"""
+    state = await io_pool.run(lambda: resumable_uploads.describe(resumable_uploads.get_session(session_id)))
+    return JSONResponse(content=_upload_session_response(state), headers=_upload_offset_headers(state))
+
+@app.post(
+    "/upload/sessions/{session_id}/complete",
+    response_model=UploadResponse,
+    tags=["files"],
+    summary="アップロードセッション完了",
+    description="全レンジの受信を確認し、SHA-256/MD5を検証した上でファイルを処理キューに登録します。",
+    responses={
+        404: {"description": "セッションが存在しない", "model": ErrorResponse},
+        409: {"description": "未受信レンジあり・完了済み", "model": ErrorResponse},
+        422: {"description": "ハッシュ不一致", "model": ErrorResponse},
+    }
+)
+async def complete_upload_session(session_id: str):
+    """アップロードセッション完了"""
+    # 同じセッションの完了処理は1つだけ（同時の /complete は 409）
+    session = await io_pool.run(resumable_uploads.claim, session_id)
+    try:
+        if session["status"] == "placed":
+            # 前回の完了処理が取り込み先への移動後に失敗した場合は、移動後の処理から再開する
+            unique_filename = session["saved_as"]
+            original_filename = session["filename"]
+            content_type = session["resolved_content_type"]
+            placed = resumable_uploads.placed_result(session)
+            _log_file_status(original_filename, "BACKEND:SESSION", "processing", f"resuming completion of {unique_filename}")
+        else:
+            session, assembled = await resumable_uploads.finalize(session_id)
+            original_filename = session["filename"]
+            _log_file_status(original_filename, "BACKEND:SESSION", "processing", f"assembled sha256={assembled.sha256[:12]}")
+
+            if not FileProcessor.validate_file_basic(assembled.size, original_filename):
+                raise HTTPException(status_code=400, detail="無効なファイルです（空ファイルまたは無効なファイル名）")
+
+            unique_filename = FileProcessor.generate_unique_filename(original_filename)
+            content_type = session["content_type"]
+            if content_type == "application/octet-stream" and assembled.sniffed_type:
+                content_type = assembled.sniffed_type
+
+            placed = await _place_assembled_upload(assembled, unique_filename)
+            await io_pool.run(resumable_uploads.mark_placed, session, unique_filename, placed, content_type)
+
+        result = await _finalize_ingest(
+            unique_filename=unique_filename,
+            original_filename=original_filename,
+            result=placed,
+            content_type=content_type
+        )
+        await io_pool.run(resumable_uploads.mark_completed, session, unique_filename)
+    finally:
+        # バルクヘッドの飽和で解放できないと再試行が 409 になるため、待ち行列を通さずに解放する
+        await asyncio.to_thread(resumable_uploads.release, session_id)
+    _log_file_status(original_filename, "BACKEND:COMPLETE", "success", f"queued as {unique_filename}")
+
+    result.file_info = FileInfo(**FileProcessor.get_file_info(original_filename, placed.size))
+    return {
+        "message": "1個のファイルが正常にアップロードされました",
+        "results": [result]
+    }
+
+@app.delete(
+    "/upload/sessions/{session_id}",
+    tags=["files"],
+    summary="アップロードセッション中止",
+    description="セッションと受信済みデータを削除します。",
+    responses={
+        404: {"description": "セッションが存在しない", "model": ErrorResponse},
+    }
+)
+async def delete_upload_session(session_id: str):
+    """アップロードセッション中止"""
+    await io_pool.run(resumable_uploads.delete_session, session_id)
+    return {"session_id": session_id, "status": "deleted"}
+
+@app.post(
+    "/upload/check",
+    response_model=UploadCheckResponse,
+    tags=["files"],
+    summary="アップロード前存在確認",
+    description="""
+    (ファイル名, サイズ, ハッシュ) の一覧を `{"items": [...]}` で受け取り、サーバーが保持していない項目だけを返します。
+    アプリ再インストール後などにカメラロール全体を再アップロードしないための確認に使用します。
+
+    - `md5`: Storj バケット上のファイル（ファイル名に埋め込まれた MD5 先頭桁）とサイズで照合
+    - `sha256`: このAPIで受け付けたファイル（処理キュー・Storj へのアップロード完了済み）と照合
+    - ハッシュのない項目は照合できないため、常に missing として返します
+
+    数万件を1リクエストで判定できるよう、項目ごとのモデル検証は行わずに照合します。
+    """,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "required": ["items"],
+                        "properties": {
+                            "items": {"type": "array", "items": {"$ref": "#/components/schemas/UploadCheckItem"}}
+                        }
+                    }
+                }
+            }
+        }
+    },
+    responses={
+        413: {"description": "項目数が上限を超過", "model": ErrorResponse},
+        422: {"description": "リクエスト形式エラー", "model": ErrorResponse},
+    }
+)
+async def check_uploads(request: Request):
+    """アップロード前存在確認"""
+    try:
+        items = json.loads(await request.body())["items"]
+        if not isinstance(items, list):
+            raise TypeError("items must be a list")
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=422, detail='{"items": [{"name", "size", "md5"/"sha256"}]} 形式で指定してください')
+    if len(items) > HASH_CHECK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"項目数が上限({HASH_CHECK_MAX_ITEMS})を超えています")
+
+    try:
+        missing = hash_index.check(items)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="size（整数）と md5/sha256（文字列）を指定してください")
+
+    # 件数が多いためレスポンスモデルの検証を経由せずに返す
+    return JSONResponse(content={
+        "missing": missing,
+        "checked_count": len(items),
+        "missing_count": len(missing),
+        "index_ready": hash_index.ready,
+    })
+
+@app.post(
+    "/upload/direct",
+    response_model=DirectUploadResponse,
+    tags=["files"],
+    summary="Blob直接アップロードURL発行",
+    description="""
+    upload-target コンテナへ直接アップロードするための、短時間有効・書き込み専用の SAS URL を発行します。
+    ファイルの中身は API サーバーを経由しないため、大きなファイルでも API の CPU・帯域を消費しません。
+
+    **処理フロー:**
+    1. `POST /upload/direct` で SAS URL を取得
+    2. `upload_url` に `PUT`（`x-ms-blob-type: BlockBlob`）、または `comp=block` / `comp=blocklist` で並列ブロックアップロード
+    3. `POST /upload/direct/{saved_as}/complete` を呼び出すと処理キューに登録され、動画はサムネイル生成が予約されます
+
+    Blob Storage が設定されていない場合は 503 を返します。
+    """,
+    responses={
+        400: {"description": "リクエストエラー", "model": ErrorResponse},
+        413: {"description": "ファイルサイズ超過", "model": ErrorResponse},
+        503: {"description": "Blob Storage 未設定", "model": ErrorResponse},
+    }
+)
+async def create_direct_upload(request: DirectUploadRequest):
+    """Blob直接アップロードURL発行"""
+    if not blob_helper:
+        raise HTTPException(status_code=503, detail="Blob Storage が設定されていません")
+    if not FileProcessor.validate_file_basic(request.file_size, request.filename):
+        raise HTTPException(status_code=400, detail="無効なファイルです（空ファイルまたは無効なファイル名）")
+    if request.file_size > MAX_FILE_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"ファイルサイズが上限({MAX_FILE_SIZE / (1024*1024):.1f}MB)を超えています"
+        )
+    try:
+        md5 = normalize_md5(request.md5)
+        sha256 = normalize_sha256(request.sha256)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"ハッシュの指定が不正です: {e}")
+
+    original_filename = Path(request.filename).name
+    unique_filename = FileProcessor.generate_unique_filename(original_filename)
+    content_type = request.content_type or "application/octet-stream"
+    upload_url, expires_at = blob_helper.generate_upload_sas_url(
+        unique_filename,
+        expiry_minutes=DIRECT_UPLOAD_SAS_EXPIRY_MINUTES
+    )
+    await io_pool.run(direct_upload_tickets.issue, unique_filename, {
+        "original_name": original_filename,
+        "file_size": request.file_size,
+        "content_type": content_type,
+        "md5": md5,
+        "sha256": sha256,
+        "expires_at": expires_at.isoformat(),
+    })
+    _log_file_status(original_filename, "BACKEND:DIRECT_UPLOAD", "processing", f"SAS issued for {unique_filename}")
+
+    return {
+        "saved_as": unique_filename,
+        "upload_url": upload_url,
+        "expires_at": expires_at.isoformat(),
+        "required_headers": {
+            "x-ms-blob-type": "BlockBlob",
+            "x-ms-blob-content-type": content_type,
+        },
+        "block_size": blob_helper.upload_block_size_mb * 1024 * 1024,
+        "complete_url": f"/upload/direct/{unique_filename}/complete",
+    }
+
+@app.post(
+    "/upload/direct/{saved_as}/complete",
+    response_model=UploadResponse,
+    tags=["files"],
+    summary="Blob直接アップロード完了通知",
+    description="Blob へのアップロード完了を通知します。Blob の存在とサイズを確認し、処理キューに登録します。動画の場合はサムネイル生成をバックグラウンドで実行します。",
+    responses={
+        404: {"description": "発行されていないファイル名", "model": ErrorResponse},
+        409: {"description": "Blob 未アップロード・完了済み", "model": ErrorResponse},
+        422: {"description": "サイズ不一致", "model": ErrorResponse},
+        503: {"description": "Blob Storage 未設定", "model": ErrorResponse},
+    }
+)
+async def complete_direct_upload(saved_as: str, background_tasks: BackgroundTasks):
+    """Blob直接アップロード完了通知"""
+    if not blob_helper:
+        raise HTTPException(status_code=503, detail="Blob Storage が設定されていません")
+
+    ticket = await io_pool.run(direct_upload_tickets.claim, saved_as)
+    if ticket is None:
+        if await io_pool.run(direct_upload_tickets.is_claimed, saved_as):
+            raise HTTPException(status_code=409, detail="既に完了処理済みです")
+        raise HTTPException(status_code=404, detail="発行されていないファイル名です")
+
+    # 完了処理のどこで失敗してもチケットを戻し、再試行が 409 にならないようにする
+    try:
+        try:
+            properties = await io_pool.run(blob_helper.get_blob_properties, saved_as)
+        except Exception as e:
+            _log_file_status(saved_as, "BACKEND:DIRECT_UPLOAD", "error", f"blob not found: {e}")
+            raise HTTPException(status_code=409, detail="Blob がまだアップロードされていません")
+
+        if properties["size"] != ticket["file_size"]:
+            raise HTTPException(
+                status_code=422,
+                detail=f"Blob サイズ({properties['size']})が申告サイズ({ticket['file_size']})と一致しません"
+            )
+        # Blob の Content-MD5・メタデータは SAS を持つクライアントが任意に設定できるため使わない。
+        # ハッシュインデックスには登録せず、キューにも MD5 を渡さない（Storj Uploader がダウンロードしたファイルから計算する）
+
+        original_filename = ticket["original_name"]
+        result = await _enqueue_file(
+            unique_filename=saved_as,
+            original_filename=original_filename,
+            file_path=None,
+            file_size=properties["size"],
+            content_type=properties["content_type"] or ticket["content_type"],
+            blob_name=saved_as
+        )
+    except Exception:
+        # バルクヘッドの飽和で戻せないと再試行が 409 になるため、待ち行列を通さずに戻す
+        await asyncio.to_thread(direct_upload_tickets.release, saved_as)
+        raise
+    if VideoProcessor.is_video_file(saved_as):
+        background_tasks.add_task(_run_backfill, _generate_direct_upload_video_thumbnail, saved_as)
+    _log_file_status(original_filename, "BACKEND:COMPLETE", "success", f"queued blob {saved_as}")
+
+    result.file_info = FileInfo(**FileProcessor.get_file_info(original_filename, properties["size"]))
+    return {
+        "message": "1個のファイルが正常にアップロードされました",
+        "results": [result]
+    }
+
 @app.get(
     "/health",
     response_model=HealthResponse,
@@ -1129,6 +2331,63 @@ async def get_status():
             "error": str(e)
         }
 
+@app.get(
+    "/metrics",
+    tags=["system"],
+    summary="処理プールのメトリクス取得",
+    description="""処理プールの飽和度・待ち時間・CPU時間などのメトリクスを取得します。
+
+    **取得できる情報:**
+    - executors: バルクヘッド（io / media / rclone / backfill）ごとの実行数・待ち行列長・拒否数・飽和度・平均待ち時間・平均CPU時間
+    - storj_trigger: Storj Container 起動トリガーの要求数・集約数・送信数・稼働状態
+    - resumable_uploads: 進行中の再開可能アップロードセッション数
+    - direct_uploads: 完了通知待ちの Blob 直接アップロード数
+    - admission: アップロード受け付け制御の処理中バイト数・同時数・拒否数・飽和度（レプリカ数の目安）
+    - hash_index: アップロード前存在確認用インデックスのキー数・照合数・再構築時間
+    - thumbnail_cache: サムネイルキャッシュ（メモリ / ディスク / 共有層）のヒット率・エントリ数・容量・追い出し数
+    - thumbnail_resolver: 動画サムネイルのパス索引（一覧取得回数・索引ヒット数・ネガティブキャッシュ件数）
+    - stat_cache: オブジェクトのメタ情報キャッシュ（ヒット数・事前投入数・無効化数・件数）
+    - block_cache: 動画 Range 用ブロックキャッシュ（ヒット率・取得/配信バイト数・先読み数）
+    - streams: 動画ストリームの送信量・切断で破棄された数とバイト数（wasted_bytes: 取得したが送れなかった量）
+    - origin_cache: uploaded/ に残っているアップロード済みファイルからの配信（ヒット率・ファイル数・容量・追い出し数）
+    - single_flight: 同じ画像・サムネイルの同時取得の集約（実行数・集約された数（操作別）・実行中の数）
+    - gallery_prefetch: ギャラリー一覧取得時のサムネイル先読み（実行数・取得数・取り消し数（次の一覧 / クライアントの離脱）・上限超過で見送った数）
+    - coordination: ワーカー間の調整（rclone / ffmpeg の全ワーカー合計のスロット待ち・生成の排他・定期処理の担当か）。値は応答したワーカーのもの
+    - generation_queue: オンデマンドのサムネイル生成の待ち行列（画像 / 動画ごとの実行数・表示中として優先した数・画面外に出て取り消した数・待ち数、表示中の項目の通知数）
+    """
+)
+async def get_metrics():
+    """メトリクス取得"""
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "executors": {bulkhead.name: bulkhead.get_stats() for bulkhead in bulkheads},
+        "storj_trigger": storj_trigger.get_stats(),
+        "resumable_uploads": resumable_uploads.get_stats(),
+        "direct_uploads": direct_upload_tickets.get_stats(),
+        "admission": admission.get_stats(),
+        "hash_index": hash_index.get_stats(),
+        "thumbnail_cache": thumbnail_cache.get_stats(),
+        "thumbnail_resolver": storj_client.thumbnail_resolver.get_stats(),
+        "stat_cache": storj_client.stat_cache.get_stats(),
+        "block_cache": block_cache.get_stats() if block_cache is not None else None,
+        "streams": stream_monitor.get_stats(),
+        "origin_cache": storj_client.origin_cache.get_stats() if storj_client.origin_cache is not None else None,
+        "single_flight": storj_client.single_flight.get_stats(),
+        "gallery_prefetch": gallery_prefetcher.get_stats(),
+        "coordination": {
+            "rclone_slots": storj_client.rclone_slots.get_stats(),
+            "ffmpeg_slots": ffmpeg_slots.get_stats(),
+            "generation_locks": generation_locks.get_stats(),
+            "maintenance_leader": maintenance_leader.held,
+            "pid": os.getpid()
+        },
+        "generation_queue": {
+            "images": image_generation_queue.get_stats(),
+            "videos": video_generation_queue.get_stats(),
+            "viewport": viewport_tracker.get_stats()
+        }
+    }
+
 @app.post(
     "/trigger-upload",
     response_model=TriggerUploadResponse,
@@ -1154,7 +2413,7 @@ async def trigger_upload():
                 "files_count": 0
             }
 
-        success, output = _trigger_storj_processor()
+        success, output = await storj_trigger.trigger_now()
 
         return {
             "status": "success" if success else "error",
@@ -1200,19 +2459,29 @@ async def trigger_upload_async(force: bool = False):
                 "files_count": 0
             }
 
-        success, output = _trigger_storj_processor()
+        if not storj_trigger.url:
+            return {
+                "status": "error",
+                "message": "トリガーに失敗しました: STORJ_CONTAINER_URL not set",
+                "files_to_process": file_count,
+                "output": "STORJ_CONTAINER_URL not set"
+            }
+
+        # 応答を待たずにバックグラウンドで起動（起動中なら完了後に1回だけ再実行）
+        storj_trigger.request_trigger()
+        output = "already running; rerun scheduled" if storj_trigger.is_processor_awake else "scheduled"
 
         if file_count == 0 and force:
             return {
-                "status": "started" if success else "error",
-                "message": "Storj コンテナを強制起動しました" if success else f"トリガーに失敗しました: {output}",
+                "status": "started",
+                "message": "Storj コンテナを強制起動しました",
                 "files_count": 0,
                 "output": output
             }
 
         return {
-            "status": "started" if success else "error",
-            "message": "Storj コンテナを起動しました" if success else f"トリガーに失敗しました: {output}",
+            "status": "started",
+            "message": "Storj コンテナを起動しました",
             "files_to_process": file_count,
             "output": output
         }
@@ -1248,7 +2517,8 @@ async def get_storj_images(
     limit: int = 100,
     offset: int = 0,
     bucket: str = None,
-    request: Request = None
+    request: Request = None,
+    response: Response = None
 ):
     """
     Storjに保存されている画像リストを取得
@@ -1265,9 +2535,12 @@ async def get_storj_images(
                 base_url = f"{scheme}://{host}".rstrip("/")
             else:
                 base_url = str(request.base_url).rstrip("/")
-        success, images, message = storj_client.list_storj_images(
+        # 次のページ分もまとめて一覧し、返すのはこのページだけ（残りはサムネイルの先読みに使う）
+        prefetch_limit = limit * GALLERY_PREFETCH_PAGES if request is not None else 0
+        success, images, message = await rclone_pool.run(
+            storj_client.list_storj_images,
             bucket_name=bucket,
-            limit=limit,
+            limit=limit + prefetch_limit,
             offset=offset,
             base_url=base_url
         )
@@ -1280,6 +2553,18 @@ async def get_storj_images(
                 message=f"Failed to retrieve images: {message}"
             )
 
+        if prefetch_limit and images:
+            _schedule_gallery_prefetch(request, images, bucket, limit)
+        if len(images) > limit:
+            images = images[:limit]
+            message = f"Successfully retrieved {len(images)} images"
+
+        if response is not None:
+            # 一覧は短時間だけ再利用し、期限切れ後は裏で再検証させる（画像 URL 自体はバージョン付きで不変）
+            response.headers["Cache-Control"] = (
+                f"public, max-age={GALLERY_LIST_MAX_AGE_SECONDS}, "
+                f"stale-while-revalidate={GALLERY_LIST_STALE_SECONDS}"
+            )
         return StorjImageListResponse(
             success=True,
             images=[StorjImageItem(**img) for img in images],
@@ -1312,7 +2597,12 @@ async def delete_storj_media(request: DeleteMediaRequest):
         raise HTTPException(status_code=400, detail="削除対象のパスが指定されていません")
 
     try:
-        success, deleted, failed, message = storj_client.delete_gallery_paths(request.paths)
+        success, deleted, failed, message = await rclone_pool.run(storj_client.delete_gallery_paths, request.paths)
+        bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        container_name = os.getenv("AZURE_STORAGE_UPLOADED_CONTAINER", "uploaded")
+        for path in deleted:
+            await thumbnail_cache.invalidate(_thumbnail_cache_key("storj", bucket_name, path))
+            await thumbnail_cache.invalidate(_thumbnail_cache_key("blob", container_name, path))
         return {
             "success": success,
             "deleted": deleted,
@@ -1322,6 +2612,65 @@ async def delete_storj_media(request: DeleteMediaRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post(
+    "/storj/images/visible",
+    response_model=VisibleItemsResponse,
+    tags=["storj"],
+    summary="表示中のメディアの通知",
+    description="""ギャラリーで現在表示中のメディアのパス（一覧の `path`、画面の上から順）を通知します。
+
+    オンデマンドのサムネイル生成（事前生成されていない画像のリサイズ・動画サムネイルの生成）は、
+    通知された表示中の項目を画面上の順に優先して実行します。前回の通知から画面外に出た項目の生成のうち、
+    同じクライアントが要求したものは実行前であれば取り消します（他のクライアントで表示中のものは除く。
+    その画像へのリクエストは 503 + Retry-After。再び表示されたときに生成します）。
+    スクロールが止まったとき・表示範囲が変わったときに送ってください（通知しないクライアントの生成は従来どおり到着順）。
+    通知は `VIEWPORT_TTL_SECONDS` 更新がなければ破棄します。通知はワーカー間で共有します（`VIEWPORT_SYNC_SECONDS` ごとに反映）。
+    """,
+    responses={
+        200: {"description": "受付結果", "model": VisibleItemsResponse},
+    }
+)
+async def update_visible_media(payload: VisibleItemsRequest, request: Request):
+    client = client_id(request.scope)
+    visible, left = viewport_tracker.update(client, payload.paths)
+    # 画像のリクエストは他のワーカーが受けることがあるため、表示状況を共有する
+    await io_pool.run(viewport_tracker.publish, viewport_tracker.export(client))
+    # ギャラリーの表示が続いている間は先読みを続ける
+    gallery_prefetcher.touch(client)
+    return {"success": True, "visible": visible, "left": left}
+
+@app.get(
+    "/storj/images/v/{version}/{image_path:path}",
+    tags=["storj"],
+    summary="Storj画像取得（バージョン付き URL）",
+    description="""ギャラリー一覧の thumbnail_url / url が指すバージョン付き URL です。
+
+    **パラメータ:**
+    - **version**: 内容のバージョン（一覧のサイズ・更新日時から生成したトークン）
+    - **image_path** / **thumbnail** / **bucket**: /storj/images/{image_path} と同じ
+
+    内容が変わると URL が変わるため、`Cache-Control: public, max-age=31536000, immutable` で返します
+    （トークンが現在のバージョンと一致しない場合・プレースホルダーの場合は通常のキャッシュヘッダー）。
+    """,
+    responses={
+        200: {"description": "画像データ"},
+        304: {"description": "変更なし"},
+        404: {"description": "画像が見つかりません"},
+        500: {"description": "サーバーエラー"}
+    }
+)
+async def get_versioned_storj_image(
+    version: str,
+    image_path: str,
+    thumbnail: bool = True,
+    bucket: str = None,
+    request: Request = None,
+    background_tasks: BackgroundTasks = None
+):
+    """バージョン付き URL の画像・動画を配信（/storj/images/{image_path} より先に登録する）"""
+    return await _serve_storj_media(image_path, thumbnail, bucket, request, background_tasks, version=version)
+
+
 @app.get(
     "/storj/images/{image_path:path}",
     tags=["storj"],
@@ -1333,6 +2682,11 @@ async def delete_storj_media(request: DeleteMediaRequest):
     - **bucket**: Storjバケット名（オプション、指定しない場合は環境変数から取得）
     - **thumbnail**: trueの場合、300x300pxのサムネイルを返す（デフォルト: true）
 
+    **再検証:**
+    - If-None-Match / If-Modified-Since が ETag / Last-Modified と一致する場合は、ストレージに問い合わせずに 304 を返す
+    - ETag にはギャラリー一覧で取得したサイズ・更新日時を含めるため、削除・上書きされたオブジェクトでは一致しない
+    - サイズ・更新日時が分からない場合（一覧を取得していないワーカー）は ETag / Last-Modified を付けず、304 も返さない
+
     **使用例:**
     ```bash
     # サムネイルを取得（デフォルト）
@@ -1352,6 +2706,7 @@ async def delete_storj_media(request: DeleteMediaRequest):
                 "image/heic": {}
             }
         },
+        304: {"description": "変更なし（If-None-Match / If-Modified-Since が一致。ストレージには問い合わせない）"},
         404: {"description": "画像が見つかりません"},
         500: {"description": "サーバーエラー"}
     }
@@ -1367,31 +2722,84 @@ async def get_storj_image(
     Storjから画像を取得して配信
     thumbnailがtrueの場合はサムネイル（300x300px）を返す
     """
+    return await _serve_storj_media(image_path, thumbnail, bucket, request, background_tasks)
+
+
+async def _serve_storj_media(
+    image_path: str,
+    thumbnail: bool,
+    bucket: Optional[str],
+    request: Optional[Request],
+    background_tasks: Optional[BackgroundTasks],
+    version: Optional[str] = None
+):
+    """
+    画像・動画の配信（/storj/images と バージョン付き URL の共通処理）
+    version: バージョン付き URL のトークン（現在のバージョンと一致すれば immutable として返す）
+    """
     print(f"=== Image Request ===")
     print(f"image_path: {image_path}")
     print(f"thumbnail: {thumbnail}")
     print(f"bucket: {bucket}")
     print(f"====================")
 
+    # 表示状況を通知したクライアントの生成は、そのクライアントが画面外に出したら取り消す
+    client = client_id(request.scope) if request is not None else None
+    if client is not None:
+        # ギャラリーの表示が続いている間は先読みを続ける
+        gallery_prefetcher.touch(client)
+
     try:
         gallery_source = os.getenv("GALLERY_SOURCE", "").lower()
         use_blob_gallery = gallery_source in ("azure", "blob", "storage") and blob_helper
         is_video = VideoProcessor.is_video_file(image_path)
+        bucket_name = bucket or os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        container_name = os.getenv("AZURE_STORAGE_UPLOADED_CONTAINER", "uploaded")
+
+        # 再検証（If-None-Match / If-Modified-Since）はキャッシュ・ストレージを参照する前に 304 で返す
+        media_stat = _media_stat(use_blob_gallery, bucket_name, container_name, image_path)
+        if version is not None and media_stat is None:
+            # バージョン付き URL はトークンを照合できた場合だけ immutable にする（このワーカーの stat キャッシュにない場合は取得する）
+            media_stat = await _lookup_media_stat(use_blob_gallery, bucket_name, container_name, image_path)
+        immutable = _is_current_version(version, media_stat)
+        if is_video and not thumbnail:
+            response_headers = _validator_headers(image_path, "full", media_stat)
+            if immutable:
+                response_headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response_headers = _image_response_headers(image_path, thumbnail, media_stat, immutable)
+        if _is_not_modified(request, response_headers):
+            return Response(status_code=304, headers=response_headers)
+
+        # サムネイル（動画サムネイルのオブジェクトを含む）はメモリ / ディスクキャッシュを先に確認する
+        thumbnail_key = None
+        cacheable = True
+        if thumbnail or (not is_video and _is_thumbnail_object(image_path)):
+            if use_blob_gallery:
+                thumbnail_key = _thumbnail_cache_key("blob", container_name, image_path)
+            else:
+                thumbnail_key = _thumbnail_cache_key("storj", bucket_name, image_path)
+            cached = await thumbnail_cache.get_for_response(thumbnail_key)
+            if isinstance(cached, CachedFile):
+                # ディスク層のヒットはファイルのまま返す
+                return _file_response(
+                    cached.file,
+                    request,
+                    'image/jpeg',
+                    response_headers,
+                    offset=cached.offset
+                )
+            if cached:
+                return Response(content=cached, media_type='image/jpeg', headers=response_headers)
 
         if use_blob_gallery:
-            container_name = os.getenv("AZURE_STORAGE_UPLOADED_CONTAINER", "uploaded")
-            if not blob_helper.blob_exists(
-                image_path,
-                container_name=container_name
-            ):
+            # 存在確認とサイズ取得は stat キャッシュ（ギャラリー一覧で事前に埋まる）で1回にまとめる
+            blob_stat = await _get_blob_stat(image_path, container_name)
+            if blob_stat is None:
                 raise HTTPException(status_code=404, detail="Blob not found")
 
             if is_video and not thumbnail:
-                props = blob_helper.get_blob_properties(
-                    blob_name=image_path,
-                    container_name=container_name
-                )
-                file_size = props.get("size")
+                file_size = blob_stat.get("size")
                 if not isinstance(file_size, int) or file_size <= 0:
                     raise HTTPException(status_code=404, detail="Invalid file size")
 
@@ -1402,32 +2810,37 @@ async def get_storj_image(
 
                 if range_tuple:
                     start, end = range_tuple
-                    content_length = end - start + 1
-                    status_code = 206
                 else:
                     start, end = 0, file_size - 1
-                    content_length = file_size
-                    status_code = 200
-
-                stream_iter = blob_helper.stream_blob(
-                    blob_name=image_path,
-                    container_name=container_name,
-                    offset=start if range_tuple else None,
-                    length=content_length if range_tuple else None
-                )
+                content_length = end - start + 1
 
-                headers = {
-                    "Accept-Ranges": "bytes",
-                    "Content-Length": str(content_length)
-                }
-                if range_tuple:
-                    headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+                transfer = StreamTransfer(content_length)
+                if block_cache is not None and range_tuple and block_cache.accepts(start, end):
+                    stream_iter = block_cache.stream(
+                        f"blob:{container_name}:{image_path}:{file_size}:{blob_stat.get('mtime', '')}",
+                        file_size,
+                        start,
+                        end,
+                        lambda offset, length: io_pool.run(
+                            blob_helper.download_blob_to_bytes,
+                            image_path,
+                            container_name,
+                            offset,
+                            length
+                        )
+                    )
+                else:
+                    blob_chunks = await io_pool.run(
+                        blob_helper.stream_blob,
+                        blob_name=image_path,
+                        container_name=container_name,
+                        offset=start if range_tuple else None,
+                        length=content_length if range_tuple else None
+                    )
+                    stream_iter = blocking_iterator_stream(blob_chunks, io_pool.run, transfer)
 
-                return StreamingResponse(
-                    stream_iter,
-                    media_type=_get_video_content_type(image_path),
-                    headers=headers,
-                    status_code=status_code
+                return _video_stream_response(
+                    stream_iter, transfer, image_path, start, end, file_size, bool(range_tuple), blob_stat, immutable
                 )
 
             if thumbnail:
@@ -1439,31 +2852,43 @@ async def get_storj_image(
                     file_stem = path_obj.stem  # filename without extension
 
                     # Use storj_client to get thumbnail from Storj
-                    success, image_data, error_msg = storj_client.get_storj_thumbnail_by_prefix(
+                    success, image_data, error_msg = await storj_client.get_storj_thumbnail_by_prefix(
                         video_stem=file_stem,
                         dir_name=dir_name,
                         bucket_name=bucket
                     )
 
-                    if not success or not image_data:
+                    if success and image_data:
+                        await thumbnail_cache.put(thumbnail_key, image_data)
+                    else:
                         # Return placeholder if thumbnail not found
                         print(f"⚠ Video thumbnail not found in Storj, returning placeholder for: {image_path}")
-                        image_data = _generate_video_placeholder()
+                        image_data = await _generate_video_placeholder()
                         success = True
+                        cacheable = False
                         error_msg = "Placeholder (thumbnail not found in Storj)"
                 else:
-                    image_data = blob_helper.download_blob_to_bytes(
-                        blob_name=image_path,
-                        container_name=container_name
+                    success, image_data, error_msg = await storj_client.single_flight.run(
+                        ("blob_thumbnail", container_name, image_path),
+                        _generate_blob_image_thumbnail,
+                        image_path,
+                        container_name,
+                        client
                     )
-                    success, image_data, error_msg = _generate_image_thumbnail(image_data)
+                    if success:
+                        await thumbnail_cache.put(thumbnail_key, image_data)
             else:
-                image_data = blob_helper.download_blob_to_bytes(
+                image_data = await storj_client.single_flight.run(
+                    ("blob_image", container_name, image_path),
+                    io_pool.run,
+                    blob_helper.download_blob_to_bytes,
                     blob_name=image_path,
                     container_name=container_name
                 )
                 success = bool(image_data)
                 error_msg = "Success" if success else "Blob is empty"
+                if success and thumbnail_key is not None:
+                    await thumbnail_cache.put(thumbnail_key, image_data)
 
             if not success:
                 raise HTTPException(status_code=404, detail=error_msg)
@@ -1474,31 +2899,29 @@ async def get_storj_image(
                 if is_video:
                     content_type = _get_video_content_type(image_path)
                 else:
-                    ext = image_path.lower().split('.')[-1]
-                    content_type_map = {
-                        'jpg': 'image/jpeg',
-                        'jpeg': 'image/jpeg',
-                        'png': 'image/png',
-                        'webp': 'image/webp',
-                        'heic': 'image/heic',
-                        'bmp': 'image/bmp',
-                        'tiff': 'image/tiff',
-                        'gif': 'image/gif'
-                    }
-                    content_type = content_type_map.get(ext, 'image/jpeg')
-
-            cache_max_age = 86400 if thumbnail else 3600
-            etag_source = f"{image_path}|{'thumb' if thumbnail else 'full'}"
-            etag_hash = hashlib.sha256(etag_source.encode("utf-8")).hexdigest()
-            headers = {
-                "Cache-Control": f"public, max-age={cache_max_age}",
-                "ETag": f"\"sha256-{etag_hash}\""
-            }
+                    content_type = _get_image_content_type(image_path)
 
+            if _is_provisional(cacheable, error_msg):
+                headers = _provisional_response_headers()
+            else:
+                headers = _image_response_headers(image_path, thumbnail, blob_stat, immutable)
             return Response(content=image_data, media_type=content_type, headers=headers)
 
+        # アップロード済みファイルが uploaded/ に残っていれば Storj に問い合わせずにローカルから返す
+        local_origin = None
+        if not thumbnail:
+            local_origin = await storj_client.get_local_origin(image_path, bucket)
+        if local_origin is not None:
+            if is_video:
+                media_type = _get_video_content_type(image_path)
+            else:
+                media_type = _get_image_content_type(image_path)
+            response = await _local_file_response(local_origin, request, media_type, response_headers)
+            if response is not None:
+                return response
+
         if is_video and not thumbnail:
-            info_success, info, info_error = storj_client.get_storj_object_info(
+            info_success, info, info_error = await storj_client.get_storj_object_info(
                 object_path=image_path,
                 bucket_name=bucket
             )
@@ -1516,79 +2939,85 @@ async def get_storj_image(
 
             if range_tuple:
                 start, end = range_tuple
-                content_length = end - start + 1
-                status_code = 206
             else:
                 start, end = 0, file_size - 1
-                content_length = file_size
-                status_code = 200
-
-            stream_success, stream_iter, stream_error = storj_client.stream_storj_file(
-                object_path=image_path,
-                bucket_name=bucket,
-                offset=start if range_tuple else None,
-                count=content_length if range_tuple else None
-            )
-            if not stream_success:
-                raise HTTPException(status_code=500, detail=stream_error)
-
-            headers = {
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(content_length)
-            }
-            if range_tuple:
-                headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            content_length = end - start + 1
+
+            transfer = StreamTransfer(content_length)
+            # 小さな Range だけブロックキャッシュを使う（全体・大きな範囲は1回の取得でストリームする）
+            if block_cache is not None and range_tuple and block_cache.accepts(start, end):
+                stream_iter = block_cache.stream(
+                    f"storj:{bucket_name}:{image_path}:{file_size}:{info.get('ModTime', '')}",
+                    file_size,
+                    start,
+                    end,
+                    lambda offset, length: storj_client.read_storj_range(image_path, offset, length, bucket_name)
+                )
+            else:
+                stream_success, stream_iter, stream_error = storj_client.stream_storj_file(
+                    object_path=image_path,
+                    bucket_name=bucket,
+                    offset=start if range_tuple else None,
+                    count=content_length if range_tuple else None,
+                    transfer=transfer
+                )
+                if not stream_success:
+                    raise HTTPException(status_code=500, detail=stream_error)
 
-            return StreamingResponse(
+            return _video_stream_response(
                 stream_iter,
-                media_type=_get_video_content_type(image_path),
-                headers=headers,
-                status_code=status_code
+                transfer,
+                image_path,
+                start,
+                end,
+                file_size,
+                bool(range_tuple),
+                _media_stat(False, bucket_name, container_name, image_path),
+                immutable
             )
 
         # サムネイルまたはフルサイズ画像を取得
         if thumbnail:
             if is_video:
-                bucket_name = bucket or os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
                 # Thumbnail is in thumbnails/YYYYMM/ directory
                 path_obj = Path(image_path)
                 dir_name = path_obj.parent.name  # YYYYMM
                 file_stem = path_obj.stem  # filename without extension
-                success, image_data, error_msg = storj_client.get_storj_thumbnail_by_prefix(
+                known_missing = storj_client.thumbnail_resolver.is_known_missing(bucket_name, dir_name, file_stem)
+                success, image_data, error_msg = await storj_client.get_storj_thumbnail_by_prefix(
                     video_stem=file_stem,
                     dir_name=dir_name,
                     bucket_name=bucket_name
                 )
                 if not success or not image_data:
-                    thumbnail_path = f"thumbnails/{dir_name}/{file_stem}_thumb.jpg"
-                    legacy_success, legacy_data, legacy_error = storj_client.get_storj_image(
-                        image_path=thumbnail_path,
-                        bucket_name=bucket_name
+                    # 旧形式（{stem}_thumb.jpg）も索引に含まれるため、見つからなければ
+                    # プレースホルダーを返し、生成はバックフィルに任せる。
+                    # 生成を予約するのは索引で「存在しない」と判定された時だけ（一覧取得の失敗時は予約しない）。
+                    # ネガティブキャッシュの期限内は再予約しない（生成に失敗し続ける動画で Storj を叩かない）
+                    newly_missing = (
+                        not known_missing
+                        and storj_client.thumbnail_resolver.is_known_missing(bucket_name, dir_name, file_stem)
                     )
-                    if legacy_success and legacy_data:
-                        success, image_data, error_msg = legacy_success, legacy_data, legacy_error
-                    else:
-                        # Generate thumbnail on-demand (synchronously for first request)
-                        print(f"⚠ Thumbnail not found in Storj, generating on-demand for: {image_path}")
-                        gen_success, gen_data, gen_error = _generate_video_thumbnail(
-                            video_path=image_path,
-                            bucket=bucket_name
+                    if newly_missing and background_tasks is not None:
+                        print(f"⚠ Thumbnail not found in Storj, scheduling generation for: {image_path}")
+                        background_tasks.add_task(
+                            _schedule_video_thumbnail_generation, image_path, bucket_name, client
                         )
-                        if gen_success and gen_data:
-                            success, image_data, error_msg = gen_success, gen_data, gen_error
-                        else:
-                            print(f"✗ Failed to generate thumbnail: {gen_error}")
-                            image_data = _generate_video_placeholder()
-                            success = True
-                            error_msg = "Placeholder (thumbnail generation failed)"
+                    image_data = await _generate_video_placeholder()
+                    success = True
+                    cacheable = False
+                    error_msg = "Placeholder (thumbnail not found in Storj)"
             else:
-                success, image_data, error_msg = storj_client.get_storj_thumbnail(
+                success, image_data, error_msg = await storj_client.get_storj_thumbnail(
                     image_path=image_path,
-                    bucket_name=bucket,
-                    size=(300, 300)
+                    bucket_name=bucket_name,
+                    size=(300, 300),
+                    thumbnail_fn=lambda image_data, size: _generate_queued_image_thumbnail(
+                        image_path, image_data, size, client
+                    )
                 )
         else:
-            success, image_data, error_msg = storj_client.get_storj_image(
+            success, image_data, error_msg = await storj_client.get_storj_image(
                 image_path=image_path,
                 bucket_name=bucket
             )
@@ -1596,41 +3025,28 @@ async def get_storj_image(
         if not success:
             raise HTTPException(status_code=404, detail=error_msg)
 
+        # プレースホルダーやリサイズ失敗時の元画像はキャッシュしない
+        provisional = _is_provisional(cacheable, error_msg)
+        if thumbnail_key is not None and not provisional:
+            await thumbnail_cache.put(thumbnail_key, image_data)
+
         # Content-Typeを判定
         # サムネイルの場合は常にJPEG、それ以外は拡張子から判定
         if thumbnail:
             content_type = 'image/jpeg'
         else:
-            ext = image_path.lower().split('.')[-1]
-            content_type_map = {
-                'jpg': 'image/jpeg',
-                'jpeg': 'image/jpeg',
-                'png': 'image/png',
-                'webp': 'image/webp',
-                'heic': 'image/heic',
-                'bmp': 'image/bmp',
-                'tiff': 'image/tiff',
-                'gif': 'image/gif'
-            }
-            content_type = content_type_map.get(ext, 'image/jpeg')
-
-        # Add cache headers (cache for 1 day for thumbnails, 1 hour for full images)
-        cache_max_age = 86400 if thumbnail else 3600  # 1 day or 1 hour
-        etag_source = f"{image_path}|{'thumb' if thumbnail else 'full'}"
-        etag_hash = hashlib.sha256(etag_source.encode("utf-8")).hexdigest()
-        headers = {
-            "Cache-Control": f"public, max-age={cache_max_age}",
-            # Keep ETag ASCII-safe even for non-ASCII filenames.
-            "ETag": f"\"sha256-{etag_hash}\""
-        }
+            content_type = _get_image_content_type(image_path)
 
-        return Response(content=image_data, media_type=content_type, headers=headers)
+        if provisional:
+            response_headers = _provisional_response_headers()
+        return Response(content=image_data, media_type=content_type, headers=response_headers)
 
-    except HTTPException:
+    except (HTTPException, ExecutorSaturatedError):
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8010)
+    # 複数ワーカーで起動する場合はアプリをインポート文字列で渡す
+    uvicorn.run("main:app", host="0.0.0.0", port=8010, workers=int(os.getenv("API_WORKERS", "1")))
@@ -0,0 +1,101 @@
+"""
+CPU-bound media tasks.
+
+プロセスプールのワーカーで実行される関数群。
+ワーカー側で import されるため、このモジュールはアプリ初期化（StorjClient等）に依存しないこと。
+"""
+import io
+from pathlib import Path
+from typing import Tuple
+
+from PIL import Image, ImageDraw
+
+from video_processor import VideoProcessor
+
+
+def validate_image(source) -> bool:
+    """画像ファイルの検証（バイト列またはファイルパス）"""
+    try:
+        if isinstance(source, (str, Path)):
+            image_source = source
+        else:
+            image_source = io.BytesIO(source)
+        with Image.open(image_source) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+
+def generate_image_thumbnail(image_data: bytes, size=(300, 300)) -> Tuple[bool, bytes, str]:
+    """画像バイト列からJPEGサムネイルを生成"""
+    try:
+        with Image.open(io.BytesIO(image_data)) as img:
+            img.thumbnail(size)
+            output = io.BytesIO()
+            img.convert("RGB").save(output, format="JPEG", quality=85)
+        return True, output.getvalue(), "Success"
+    except Exception as e:
+        return False, b"", str(e)
+
+
+def generate_video_placeholder(width: int = 320, height: int = 240) -> bytes:
+    """
+    Generate a placeholder image for videos without thumbnails.
+    Returns JPEG bytes of a gray image with a play icon.
+    """
+    try:
+        # Create a dark gray image
+        img = Image.new('RGB', (width, height), color=(48, 48, 48))
+
+        # Center of image
+        cx, cy = width // 2, height // 2
+
+        draw = ImageDraw.Draw(img)
+
+        # Draw a circle (play button background)
+        circle_radius = min(width, height) // 4
+        draw.ellipse(
+            [cx - circle_radius, cy - circle_radius, cx + circle_radius, cy + circle_radius],
+            fill=(80, 80, 80),
+            outline=(120, 120, 120),
+            width=2
+        )
+
+        # Draw play triangle
+        triangle_size = circle_radius // 2
+        triangle_points = [
+            (cx - triangle_size // 2 + 5, cy - triangle_size),
+            (cx - triangle_size // 2 + 5, cy + triangle_size),
+            (cx + triangle_size, cy)
+        ]
+        draw.polygon(triangle_points, fill=(200, 200, 200))
+
+        # Save to bytes
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=80)
+        return output.getvalue()
+    except Exception as e:
+        print(f"Error generating video placeholder: {e}")
+        # Return a minimal 1x1 gray JPEG as fallback
+        img = Image.new('RGB', (1, 1), color=(48, 48, 48))
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=80)
+        return output.getvalue()
+
+
+def generate_video_thumbnail(
+    video_path: str,
+    thumbnail_path: str,
+    width: int = 320,
+    height: int = 240,
+    method: str = "ffmpeg"
+) -> bool:
+    """動画ファイルからサムネイルファイルを生成"""
+    return VideoProcessor.generate_thumbnail(
+        video_path,
+        thumbnail_path,
+        width=width,
+        height=height,
+        method=method
+    )
@@ -174,8 +174,8 @@ class StorjImageItem(BaseModel):
     path: str = Field(..., description="Storjでのフルパス")
     size: int = Field(..., description="ファイルサイズ（バイト）")
     modified_time: str = Field(..., description="最終更新時刻（ISO 8601形式）")
-    thumbnail_url: Optional[str] = Field(None, description="サムネイルURL")
-    url: Optional[str] = Field(None, description="フルサイズ画像/動画URL")
+    thumbnail_url: Optional[str] = Field(None, description="サムネイルURL（内容のバージョン付き）")
+    url: Optional[str] = Field(None, description="フルサイズ画像/動画URL（内容のバージョン付き）")
     is_video: bool = Field(False, description="動画ファイルかどうか")
 
     class Config:
@@ -185,8 +185,8 @@ class StorjImageItem(BaseModel):
                 "path": "202501/photo_20250110_abc123.jpg",
                 "size": 2457600,
                 "modified_time": "2025-01-10T12:34:56Z",
-                "thumbnail_url": "http://localhost:8010/storj/images/202501/photo_20250110_abc123.jpg?thumbnail=true",
-                "url": "http://localhost:8010/storj/images/202501/photo_20250110_abc123.jpg?thumbnail=false",
+                "thumbnail_url": "http://localhost:8010/storj/images/v/3f9a1c2b7d4e/202501/photo_20250110_abc123.jpg?thumbnail=true",
+                "url": "http://localhost:8010/storj/images/v/3f9a1c2b7d4e/202501/photo_20250110_abc123.jpg?thumbnail=false",
                 "is_video": False
             }
         }
@@ -232,3 +232,118 @@ class DeleteMediaResponse(BaseModel):
     deleted: List[str] = Field(..., description="削除成功パス一覧")
     failed: List[DeleteMediaFailure] = Field(..., description="削除失敗一覧")
     message: str = Field(..., description="結果メッセージ")
+
+class VisibleItemsRequest(BaseModel):
+    """表示中のメディア通知リクエストモデル"""
+    paths: List[str] = Field(..., description="表示中のメディアのパス一覧（画面の上から順。一覧の path）")
+
+class VisibleItemsResponse(BaseModel):
+    """表示中のメディア通知レスポンスモデル"""
+    success: bool = Field(..., description="受付成功フラグ")
+    visible: int = Field(..., description="表示中として受け付けた件数")
+    left: int = Field(..., description="前回の通知から画面外に出た件数（未実行の生成は取り消す）")
+
+class UploadSessionCreateRequest(BaseModel):
+    """再開可能アップロードセッション作成リクエストモデル"""
+    filename: str = Field(..., description="元のファイル名")
+    file_size: int = Field(..., description="ファイルサイズ（バイト）")
+    content_type: Optional[str] = Field(None, description="MIMEタイプ")
+    sha256: Optional[str] = Field(None, description="クライアント計算のSHA-256（完了時に検証）")
+    md5: Optional[str] = Field(None, description="クライアント計算のMD5（完了時に検証）")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "filename": "video.mp4",
+                "file_size": 1500000000,
+                "content_type": "video/mp4",
+                "sha256": None,
+                "md5": None
+            }
+        }
+
+class UploadSessionResponse(BaseModel):
+    """再開可能アップロードセッション状態モデル"""
+    session_id: str = Field(..., description="セッションID")
+    upload_url: str = Field(..., description="チャンク送信先URL（PUT + Content-Range）")
+    filename: str = Field(..., description="元のファイル名")
+    file_size: int = Field(..., description="ファイルサイズ（バイト）")
+    offset: int = Field(..., description="先頭から連続して受信済みのバイト数（再開位置）")
+    received_bytes: int = Field(..., description="受信済みバイト数の合計")
+    missing_ranges: List[List[int]] = Field(..., description="未受信のバイトレンジ [start, end]（末尾を含む）")
+    chunk_size: int = Field(..., description="推奨チャンクサイズ（バイト）")
+    status: str = Field(..., description="セッション状態 (uploading/completed)")
+    expires_at: str = Field(..., description="セッション有効期限（UTC）")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "session_id": "3f2c9a8e4b1d4c6e9f0a1b2c3d4e5f60",
+                "upload_url": "/upload/sessions/3f2c9a8e4b1d4c6e9f0a1b2c3d4e5f60",
+                "filename": "video.mp4",
+                "file_size": 1500000000,
+                "offset": 16777216,
+                "received_bytes": 25165824,
+                "missing_ranges": [[16777216, 25165823], [33554432, 1499999999]],
+                "chunk_size": 8388608,
+                "status": "uploading",
+                "expires_at": "2025-01-11T12:34:56"
+            }
+        }
+
+class DirectUploadRequest(BaseModel):
+    """Blob直接アップロードURL発行リクエストモデル"""
+    filename: str = Field(..., description="元のファイル名")
+    file_size: int = Field(..., description="ファイルサイズ（バイト）")
+    content_type: Optional[str] = Field(None, description="MIMEタイプ")
+    md5: Optional[str] = Field(None, description="クライアントで計算したMD5（16進 または base64）。記録のみで、重複判定・Storj のファイル名には使わない")
+    sha256: Optional[str] = Field(None, description="クライアントで計算したSHA-256（16進 または base64）。サーバーで検証できないため重複判定には使わない")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "filename": "video.mp4",
+                "file_size": 1500000000,
+                "content_type": "video/mp4"
+            }
+        }
+
+class DirectUploadResponse(BaseModel):
+    """Blob直接アップロードURL発行レスポンスモデル"""
+    saved_as: str = Field(..., description="保存されるファイル名（一意のファイル名）")
+    upload_url: str = Field(..., description="書き込み専用SAS URL（Put Blob / Put Block / Put Block List）")
+    expires_at: str = Field(..., description="SAS URLの有効期限（UTC）")
+    required_headers: Dict[str, str] = Field(..., description="Put Blob 時に必要なリクエストヘッダー")
+    block_size: int = Field(..., description="Put Block で並列アップロードする場合の推奨ブロックサイズ（バイト）")
+    complete_url: str = Field(..., description="アップロード完了後に呼び出すURL")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "saved_as": "video_20250110_123456_abc12345.mp4",
+                "upload_url": "https://account.blob.core.windows.net/upload-target/video_20250110_123456_abc12345.mp4?sv=...&sp=cw&sig=...",
+                "expires_at": "2025-01-10T12:49:56+00:00",
+                "required_headers": {"x-ms-blob-type": "BlockBlob", "x-ms-blob-content-type": "video/mp4"},
+                "block_size": 4194304,
+                "complete_url": "/upload/direct/video_20250110_123456_abc12345.mp4/complete"
+            }
+        }
+
+class UploadCheckItem(BaseModel):
+    """アップロード前存在確認の項目モデル"""
+    name: str = Field(..., description="ファイル名（クライアント側の識別用）")
+    size: int = Field(..., description="ファイルサイズ（バイト）")
+    md5: Optional[str] = Field(None, description="MD5（16進）")
+    sha256: Optional[str] = Field(None, description="SHA-256（16進）")
+
+    class Config:
+        json_schema_extra = {
+            "example": {"name": "IMG_0001.jpg", "size": 2457600, "md5": "9e107d9d372bb6826bd81d3542a419d6"}
+        }
+
+class UploadCheckResponse(BaseModel):
+    """アップロード前存在確認レスポンスモデル"""
+    missing: List[UploadCheckItem] = Field(..., description="サーバーが保持していない（アップロードが必要な）項目")
+    checked_count: int = Field(..., description="確認した項目数")
+    missing_count: int = Field(..., description="保持していない項目数")
+    index_ready: bool = Field(..., description="ハッシュインデックスが構築済みか（未構築の間は全件が missing になり得る）")
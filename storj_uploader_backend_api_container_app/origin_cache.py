@@ -0,0 +1,232 @@
+"""
+Local origin cache for uploaded media.
+
+ローカルモードでは Storj Container App（storj_uploader.py）がアップロードに成功したファイルを
+storj_container_app/uploaded/ に元のファイル名のまま移動する。
+Storj 上のパス（YYYYMM/{name}_{hash}[_{timestamp}].{ext}）をこのローカルファイルに対応付け、
+ギャラリーの読み込みを rclone cat ではなくローカルディスクから返す。
+- ファイル名のハッシュ（MD5 の先頭 HASH_LENGTH 文字）とローカルファイルの内容を照合し、
+  同名の別ファイルを返さない（照合結果はサイズ・更新日時が変わるまで再利用する）
+- uploaded/ の合計サイズが上限を超えたら、最後に参照されてから最も時間が経ったファイルから削除する（LRU）。
+  削除は定期処理の担当ワーカーだけが行い、参照時刻はファイルの atime で全ワーカーに共有する
+- uploaded/ は別プロセス（アップローダー）が追加するため、見つからない場合は一定間隔で再走査する
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# 参照時刻をファイルの atime に書き戻す間隔（参照のたびに書き込まない）
+_ACCESS_TOUCH_SECONDS = 60
+
+
+class _OriginEntry:
+    __slots__ = ("path", "size", "mtime_ns", "last_access", "digest")
+
+    def __init__(self, path: Path, size: int, mtime_ns: int, last_access: float):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.last_access = last_access
+        # 計算済みの MD5 の先頭（サイズ・更新日時が変わったら破棄する）
+        self.digest: Optional[str] = None
+
+
+class LocalOriginCache:
+    """Storj パス -> uploaded/ に残っているローカルファイル（容量上限付き LRU）"""
+
+    def __init__(
+        self,
+        root: Path,
+        max_bytes: Optional[int] = None,
+        hash_length: Optional[int] = None,
+        rescan_seconds: Optional[float] = None
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes or int(os.getenv("ORIGIN_CACHE_MAX_BYTES", str(20 * 1024 * 1024 * 1024)))
+        self.hash_length = hash_length or int(os.getenv("HASH_LENGTH", "10"))
+        self.rescan_seconds = rescan_seconds or float(os.getenv("ORIGIN_CACHE_RESCAN_SECONDS", "30"))
+        # storj_uploader.parse_filename_with_hash と同じ規則（name_hash または name_hash_YYYYMMDDHHMMSS）
+        self._name_pattern = re.compile(rf"(.+)_([a-f0-9]{{{self.hash_length}}})(?:_(\d{{14}}))?$")
+        # ローカルのファイル名 -> エントリ
+        self._entries: Dict[str, _OriginEntry] = {}
+        self._total_bytes = 0
+        self._last_scan = 0.0
+        # I/O バルクヘッドの複数スレッドから参照されるため
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "hash_mismatches": 0,
+            "scans": 0,
+            "evictions": 0,
+            "evicted_bytes": 0,
+        }
+
+    def _split_storj_path(self, storj_path: str) -> Optional[Tuple[str, str]]:
+        """YYYYMM/{name}_{hash}[_{timestamp}].{ext} を (ローカルのファイル名, hash) に分解する"""
+        parts = storj_path.split("/")
+        if len(parts) != 2 or not (len(parts[0]) == 6 and parts[0].isdigit()):
+            return None
+        name_parts = parts[1].rsplit(".", 1)
+        name_without_ext = name_parts[0]
+        match = self._name_pattern.match(name_without_ext)
+        if not match:
+            return None
+        local_name = match.group(1)
+        if len(name_parts) == 2:
+            local_name = f"{local_name}.{name_parts[1]}"
+        return local_name, match.group(2)
+
+    def scan(self):
+        """uploaded/ を走査して索引を更新する（容量上限の適用は enforce_quota）"""
+        found: Dict[str, os.stat_result] = {}
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    # .gitkeep などの隠しファイルは対象外
+                    if not entry.name.startswith(".") and entry.is_file(follow_symlinks=False):
+                        try:
+                            found[entry.name] = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            entries: Dict[str, _OriginEntry] = {}
+            for name, stat in found.items():
+                current = self._entries.get(name)
+                if current is not None and current.size == stat.st_size and current.mtime_ns == stat.st_mtime_ns:
+                    # 他のワーカーでの参照は atime に記録されている
+                    current.last_access = max(current.last_access, stat.st_atime)
+                    entries[name] = current
+                    continue
+                # 初回はアップローダーが移動した時刻（ctime）か、いずれかのワーカーが参照した時刻を最終参照とみなす
+                entries[name] = _OriginEntry(
+                    self.root / name,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    max(stat.st_mtime, stat.st_ctime, stat.st_atime)
+                )
+            self._entries = entries
+            self._total_bytes = sum(entry.size for entry in entries.values())
+            self._last_scan = time.time()
+            self._stats["scans"] += 1
+
+    def enforce_quota(self):
+        """
+        合計サイズが上限以下になるまで、最後の参照が古いファイルから削除する。
+        全ワーカーが同じ uploaded/ を見ているため、直前に scan() した定期処理の担当ワーカーだけが呼ぶ。
+        """
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            victims = sorted(self._entries.items(), key=lambda item: item[1].last_access)
+            for name, entry in victims:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                try:
+                    entry.path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"Failed to evict retained upload {entry.path}: {e}")
+                    continue
+                del self._entries[name]
+                self._total_bytes -= entry.size
+                self._stats["evictions"] += 1
+                self._stats["evicted_bytes"] += entry.size
+
+    def _file_digest(self, path: Path) -> str:
+        hash_md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                hash_md5.update(chunk)
+        return hash_md5.hexdigest()[:self.hash_length]
+
+    def lookup(self, storj_path: str) -> Optional[Path]:
+        """
+        Storj パスに対応するローカルファイルを返す（なければ None）。
+        初回はファイルを読んでハッシュを照合するため、I/O バルクヘッドなどのスレッドで呼ぶこと。
+        """
+        parsed = self._split_storj_path(storj_path)
+        if parsed is None:
+            return None
+        local_name, expected_hash = parsed
+
+        with self._lock:
+            entry = self._entries.get(local_name)
+            rescan = entry is None and time.time() - self._last_scan >= self.rescan_seconds
+        if rescan:
+            self.scan()
+            with self._lock:
+                entry = self._entries.get(local_name)
+        if entry is None:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        digest = entry.digest
+        if digest is None:
+            try:
+                stat = entry.path.stat()
+                digest = self._file_digest(entry.path)
+            except FileNotFoundError:
+                with self._lock:
+                    if self._entries.get(local_name) is entry:
+                        del self._entries[local_name]
+                        self._total_bytes -= entry.size
+                    self._stats["misses"] += 1
+                return None
+            if stat.st_size == entry.size and stat.st_mtime_ns == entry.mtime_ns:
+                entry.digest = digest
+
+        with self._lock:
+            if digest != expected_hash:
+                # 同名の別ファイル（後から同じ名前でアップロードされたものなど）
+                self._stats["hash_mismatches"] += 1
+                self._stats["misses"] += 1
+                return None
+            now = time.time()
+            touch = now - entry.last_access >= _ACCESS_TOUCH_SECONDS
+            entry.last_access = now
+            self._stats["hits"] += 1
+        if touch:
+            # 参照時刻を atime に残し、追い出しを行うワーカーからも見えるようにする（mtime は照合用に保つ）
+            try:
+                os.utime(entry.path, ns=(time.time_ns(), entry.mtime_ns))
+            except OSError:
+                pass
+        return entry.path
+
+    def remove(self, storj_path: str):
+        """Storj から削除されたオブジェクトのローカルファイルを削除する（削除後も配信されないように）"""
+        parsed = self._split_storj_path(storj_path)
+        if parsed is None:
+            return
+        local_path = self.lookup(storj_path)
+        if local_path is None:
+            return
+        try:
+            local_path.unlink()
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            entry = self._entries.pop(parsed[0], None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "files": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
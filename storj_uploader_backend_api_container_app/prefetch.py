@@ -0,0 +1,127 @@
+"""
+Speculative thumbnail prefetch for gallery paging.
+
+ギャラリー一覧（/storj/images）の取得時に、そのページと次のページのサムネイルを
+まとめて取得してサムネイルキャッシュに入れておく（投機的な先読み）。
+- クライアントごとに先読みは1つだけ。同じクライアントが次の一覧を取得したら前の先読みは取り消す
+- クライアントからのメディアのリクエストが一定時間ない場合（スクロールをやめた・画面を離れた）は取り消す
+- 同時に実行する先読みの数に上限を持ち、超えた場合は先読みしない（通常のリクエストを優先する）
+- 先読みの中身（rclone copy --files-from / Blob のダウンロード）は呼び出し側が渡すコルーチンで行う
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+# 取得してキャッシュに入れたサムネイル数を返す
+PrefetchJob = Callable[[], Awaitable[int]]
+
+
+class GalleryPrefetcher:
+    """クライアント単位で取り消せる、同時実行数上限付きの先読み"""
+
+    def __init__(
+        self,
+        max_active: Optional[int] = None,
+        idle_seconds: Optional[float] = None,
+        timeout_seconds: Optional[float] = None,
+        max_tracked_clients: int = 4096
+    ):
+        self.max_active = max_active or int(os.getenv("GALLERY_PREFETCH_MAX_ACTIVE", "2"))
+        self.idle_seconds = idle_seconds or float(os.getenv("GALLERY_PREFETCH_IDLE_SECONDS", "15"))
+        self.timeout_seconds = timeout_seconds or float(os.getenv("GALLERY_PREFETCH_TIMEOUT_SECONDS", "120"))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # クライアント -> 最後にメディア（一覧・画像）をリクエストした時刻
+        self._last_seen: "OrderedDict[str, float]" = OrderedDict()
+        self._max_tracked_clients = max_tracked_clients
+        self._stats = {
+            "scheduled": 0,
+            "completed": 0,
+            "prefetched": 0,
+            # 同じクライアントの次の一覧で取り消した数
+            "superseded": 0,
+            # クライアントのリクエストが途絶えたため取り消した数
+            "idle_cancelled": 0,
+            "timeouts": 0,
+            "failed": 0,
+            # 同時実行数の上限に達していたため先読みしなかった数
+            "dropped": 0,
+        }
+
+    def touch(self, client: str):
+        """クライアントがまだギャラリーを見ていることを記録する"""
+        self._last_seen[client] = time.monotonic()
+        self._last_seen.move_to_end(client)
+        while len(self._last_seen) > self._max_tracked_clients:
+            self._last_seen.popitem(last=False)
+
+    def schedule(self, client: str, job: PrefetchJob) -> bool:
+        """クライアントの先読みを開始する（前の先読みは取り消す）。開始しなかった場合は False"""
+        self.touch(client)
+        previous = self._tasks.pop(client, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            self._stats["superseded"] += 1
+        if len(self._tasks) >= self.max_active:
+            self._stats["dropped"] += 1
+            return False
+        task = asyncio.create_task(self._run(client, job))
+        self._tasks[client] = task
+        task.add_done_callback(lambda _task: self._forget(client, _task))
+        self._stats["scheduled"] += 1
+        return True
+
+    def _forget(self, client: str, task: asyncio.Task):
+        if self._tasks.get(client) is task:
+            del self._tasks[client]
+
+    async def _watch_idle(self, client: str):
+        """クライアントのリクエストが idle_seconds 途絶えたら戻る"""
+        while True:
+            idle = time.monotonic() - self._last_seen.get(client, 0.0)
+            if idle >= self.idle_seconds:
+                return
+            await asyncio.sleep(min(self.idle_seconds - idle, 1.0))
+
+    async def _run(self, client: str, job: PrefetchJob):
+        job_task = asyncio.create_task(job())
+        watcher = asyncio.create_task(self._watch_idle(client))
+        try:
+            done, _pending = await asyncio.wait(
+                {job_task, watcher},
+                timeout=self.timeout_seconds,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if job_task in done:
+                try:
+                    self._stats["prefetched"] += job_task.result()
+                    self._stats["completed"] += 1
+                except Exception as e:
+                    self._stats["failed"] += 1
+                    print(f"Gallery prefetch failed for {client}: {e}")
+            elif watcher in done:
+                self._stats["idle_cancelled"] += 1
+                print(f"Gallery prefetch cancelled (client idle): {client}")
+            else:
+                self._stats["timeouts"] += 1
+                print(f"Gallery prefetch timed out: {client}")
+        finally:
+            # 取り消し・タイムアウト時は取得中の rclone / ダウンロードも止める
+            for task in (job_task, watcher):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(job_task, watcher, return_exceptions=True)
+
+    async def aclose(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "active": len(self._tasks),
+            "max_active": self.max_active,
+        }
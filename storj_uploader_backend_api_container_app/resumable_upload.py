@@ -0,0 +1,377 @@
+"""
+Resumable chunked upload sessions.
+
+大きな動画をモバイル回線からアップロードするための再開可能アップロード。
+セッション情報と受信済みレンジは File Share 上のファイルとして保持するため、
+API の再起動や複数ワーカー（複数レプリカ）をまたいでも再開できる。
+
+レイアウト（sessions_dir 配下）:
+    {session_id}.json      セッションメタデータ
+    {session_id}.part      事前確保したデータファイル（各チャンクをオフセット位置に書き込む）
+    {session_id}.ranges/   受信完了したチャンクのマーカー（ファイル名: "{start}-{end}"）
+    {session_id}.completing 完了処理中のマーカー（O_EXCL で作成し、同時に1つの完了リクエストだけが進む）
+
+完了処理で取り込み先へ移動した後は status を "placed" として移動先を記録するため、
+キュー登録などで失敗した場合も再試行で移動後の処理から再開できる。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from ingest import IngestResult, SNIFF_BYTES, sniff_content_type
+
+_CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+# 完了処理中のマーカーがこの秒数より古い場合は、処理していたワーカーが落ちたものとして引き継ぐ
+_CLAIM_STALE_SECONDS = 3600
+
+
+class ResumableUploadError(Exception):
+    """再開可能アップロードの処理エラー（HTTPステータスコード付き）"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+def parse_content_range(header: Optional[str], file_size: int) -> Tuple[int, int]:
+    """
+    Content-Range ヘッダー（bytes start-end/total）を解析して (start, end) を返す。
+    end は末尾を含む。
+    """
+    match = _CONTENT_RANGE_RE.match((header or "").strip())
+    if not match:
+        raise ResumableUploadError(400, "Content-Range ヘッダーが不正です (bytes start-end/total)")
+    start, end, total = int(match.group(1)), int(match.group(2)), match.group(3)
+    if total != "*" and int(total) != file_size:
+        raise ResumableUploadError(400, "Content-Range の total がセッションのファイルサイズと一致しません")
+    if end < start or end >= file_size:
+        raise ResumableUploadError(416, "Content-Range がファイルサイズの範囲外です")
+    return start, end
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """重複・隣接する [start, end] レンジを結合する"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class ResumableUploadManager:
+    """File Share 上で再開可能アップロードセッションを管理する"""
+
+    def __init__(
+        self,
+        sessions_dir: Path,
+        max_file_size: int,
+        chunk_size: Optional[int] = None,
+        max_chunk_size: Optional[int] = None,
+        ttl_hours: Optional[float] = None
+    ):
+        self.sessions_dir = sessions_dir
+        self.max_file_size = max_file_size
+        self.chunk_size = chunk_size or int(os.getenv("RESUMABLE_CHUNK_SIZE", str(8 * 1024 * 1024)))
+        self.max_chunk_size = max_chunk_size or int(os.getenv("RESUMABLE_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+        self.ttl_hours = ttl_hours or float(os.getenv("RESUMABLE_SESSION_TTL_HOURS", "24"))
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+
+    def _meta_path(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.json"
+
+    def _data_path(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.part"
+
+    def _ranges_dir(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.ranges"
+
+    def _claim_path(self, session_id: str) -> Path:
+        return self.sessions_dir / f"{session_id}.completing"
+
+    def _write_meta(self, session: dict):
+        path = self._meta_path(session["session_id"])
+        temp = path.with_suffix(".json.tmp")
+        temp.write_text(json.dumps(session, indent=2), encoding="utf-8")
+        temp.replace(path)
+
+    def create_session(
+        self,
+        filename: str,
+        file_size: int,
+        content_type: Optional[str] = None,
+        sha256: Optional[str] = None,
+        md5: Optional[str] = None
+    ) -> dict:
+        """セッションを作成し、データファイルを事前確保する（File Share の I/O のためスレッドで呼ぶ）"""
+        if not filename or not filename.strip():
+            raise ResumableUploadError(400, "ファイル名が指定されていません")
+        if file_size <= 0:
+            raise ResumableUploadError(400, "ファイルサイズが不正です")
+        if file_size > self.max_file_size:
+            raise ResumableUploadError(
+                413, f"ファイルサイズが上限({self.max_file_size / (1024*1024):.1f}MB)を超えています"
+            )
+
+        session_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        session = {
+            "session_id": session_id,
+            "filename": Path(filename).name,
+            "file_size": file_size,
+            "content_type": content_type or "application/octet-stream",
+            "sha256": sha256.lower() if sha256 else None,
+            "md5": md5.lower() if md5 else None,
+            "chunk_size": self.chunk_size,
+            "status": "uploading",
+            "created_at": now.isoformat(),
+            "expires_at": (now + timedelta(hours=self.ttl_hours)).isoformat(),
+        }
+
+        with open(self._data_path(session_id), "wb") as f:
+            f.truncate(file_size)
+        self._ranges_dir(session_id).mkdir(parents=True, exist_ok=True)
+        self._write_meta(session)
+        print(f"Created resumable upload session {session_id} for {session['filename']} ({file_size} bytes)")
+        return session
+
+    def get_session(self, session_id: str) -> dict:
+        if not _SESSION_ID_RE.match(session_id or ""):
+            raise ResumableUploadError(404, "セッションが見つかりません")
+        meta_path = self._meta_path(session_id)
+        try:
+            session = json.loads(meta_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise ResumableUploadError(404, "セッションが見つかりません")
+        # 取り込み先へ移動済み（placed）のセッションは期限後も完了処理を再開できる
+        if (
+            datetime.fromisoformat(session["expires_at"]) < datetime.utcnow()
+            and session.get("status") not in ("placed", "completed")
+        ):
+            raise ResumableUploadError(410, "セッションの有効期限が切れています")
+        return session
+
+    def get_received_ranges(self, session_id: str) -> List[Tuple[int, int]]:
+        ranges = []
+        ranges_dir = self._ranges_dir(session_id)
+        if not ranges_dir.exists():
+            return ranges
+        for marker in ranges_dir.iterdir():
+            start, _, end = marker.name.partition("-")
+            try:
+                ranges.append((int(start), int(end)))
+            except ValueError:
+                continue
+        return merge_ranges(ranges)
+
+    def describe(self, session: dict) -> dict:
+        """受信済みオフセット・欠落レンジを含むセッション状態を返す"""
+        file_size = session["file_size"]
+        received = self.get_received_ranges(session["session_id"])
+        offset = received[0][1] + 1 if received and received[0][0] == 0 else 0
+        missing = []
+        cursor = 0
+        for start, end in received:
+            if start > cursor:
+                missing.append([cursor, start - 1])
+            cursor = end + 1
+        if cursor < file_size:
+            missing.append([cursor, file_size - 1])
+        return {
+            "session_id": session["session_id"],
+            "filename": session["filename"],
+            "file_size": file_size,
+            "offset": offset,
+            "received_bytes": sum(end - start + 1 for start, end in received),
+            "missing_ranges": missing,
+            "chunk_size": session["chunk_size"],
+            "status": session["status"],
+            "expires_at": session["expires_at"],
+        }
+
+    async def write_chunk(
+        self,
+        session_id: str,
+        content_range: Optional[str],
+        body: AsyncIterator[bytes],
+        content_length: Optional[int] = None
+    ) -> dict:
+        """
+        Content-Range の位置にリクエストボディを書き込む。
+        別チャンクは並列に（別ワーカーからでも）書き込める。
+        """
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(None, self.get_session, session_id)
+        claimed = await loop.run_in_executor(None, self._claim_path(session_id).exists)
+        if session["status"] != "uploading" or claimed:
+            raise ResumableUploadError(409, "セッションは既に完了しています")
+        start, end = parse_content_range(content_range, session["file_size"])
+        expected = end - start + 1
+        if expected > self.max_chunk_size:
+            raise ResumableUploadError(413, f"チャンクサイズが上限({self.max_chunk_size}バイト)を超えています")
+        # 受信済みデータを壊さないよう、長さが合わないチャンクは書き込み前に拒否する
+        if content_length is not None and content_length != expected:
+            raise ResumableUploadError(400, "Content-Length が Content-Range と一致しません")
+
+        fd = await loop.run_in_executor(None, os.open, self._data_path(session_id), os.O_WRONLY)
+        try:
+            position = start
+            async for chunk in body:
+                if not chunk:
+                    continue
+                if position + len(chunk) > end + 1:
+                    raise ResumableUploadError(400, "ボディが Content-Range より長いです")
+                await loop.run_in_executor(None, os.pwrite, fd, chunk, position)
+                position += len(chunk)
+            if position != end + 1:
+                raise ResumableUploadError(400, "ボディが Content-Range より短いです")
+            await loop.run_in_executor(None, os.fsync, fd)
+        finally:
+            os.close(fd)
+
+        # 書き込み完了後にマーカーを作成（途中で切断されたチャンクは未受信扱い）
+        await loop.run_in_executor(None, (self._ranges_dir(session_id) / f"{start}-{end}").touch)
+        return await loop.run_in_executor(None, self.describe, session)
+
+    def _hash_file(self, session: dict) -> IngestResult:
+        data_path = self._data_path(session["session_id"])
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        head = b""
+        with open(data_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                if len(head) < SNIFF_BYTES:
+                    head += chunk[:SNIFF_BYTES - len(head)]
+                md5.update(chunk)
+                sha256.update(chunk)
+        return IngestResult(
+            size=session["file_size"],
+            md5=md5.hexdigest(),
+            sha256=sha256.hexdigest(),
+            sniffed_type=sniff_content_type(head),
+            location=str(data_path)
+        )
+
+    def claim(self, session_id: str) -> dict:
+        """
+        完了処理を開始する（マーカーを O_EXCL で作成できたリクエストだけが進む）。
+        完了処理の終了時（失敗時も）に release を呼ぶ。
+        """
+        claim_path = self._claim_path(session_id)
+        for _attempt in range(2):
+            session = self.get_session(session_id)
+            if session["status"] == "completed":
+                raise ResumableUploadError(409, "セッションは既に完了しています")
+            try:
+                fd = os.open(claim_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                try:
+                    age = time.time() - claim_path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                if age < _CLAIM_STALE_SECONDS:
+                    raise ResumableUploadError(409, "完了処理中です")
+                print(f"Taking over stale completion of upload session {session_id}")
+                claim_path.unlink(missing_ok=True)
+                continue
+            os.close(fd)
+            # マーカー作成までの間に別のリクエストが完了させていないか確認する
+            session = self.get_session(session_id)
+            if session["status"] == "completed":
+                claim_path.unlink(missing_ok=True)
+                raise ResumableUploadError(409, "セッションは既に完了しています")
+            return session
+        raise ResumableUploadError(409, "完了処理中です")
+
+    def release(self, session_id: str):
+        self._claim_path(session_id).unlink(missing_ok=True)
+
+    async def finalize(self, session_id: str) -> Tuple[dict, IngestResult]:
+        """
+        全レンジの受信を確認し、ハッシュを検証する。
+        戻り値の IngestResult.location は組み立て済みデータファイルのパス。
+        """
+        loop = asyncio.get_running_loop()
+        session = await loop.run_in_executor(None, self.get_session, session_id)
+        if session["status"] != "uploading":
+            raise ResumableUploadError(409, "セッションは既に完了しています")
+        state = await loop.run_in_executor(None, self.describe, session)
+        if state["missing_ranges"]:
+            raise ResumableUploadError(409, f"未受信のレンジがあります: {state['missing_ranges'][:5]}")
+
+        result = await loop.run_in_executor(None, self._hash_file, session)
+        if session.get("sha256") and session["sha256"] != result.sha256:
+            raise ResumableUploadError(422, "SHA-256 が一致しません")
+        if session.get("md5") and session["md5"] != result.md5:
+            raise ResumableUploadError(422, "MD5 が一致しません")
+        return session, result
+
+    def mark_placed(self, session: dict, saved_as: str, placed: IngestResult, content_type: str):
+        """取り込み先への移動を記録する（以降の再試行は移動後の処理から再開する）"""
+        session["status"] = "placed"
+        session["saved_as"] = saved_as
+        session["resolved_content_type"] = content_type
+        session["placed"] = {
+            "size": placed.size,
+            "md5": placed.md5,
+            "sha256": placed.sha256,
+            "sniffed_type": placed.sniffed_type,
+            "location": placed.location,
+        }
+        self._write_meta(session)
+
+    def placed_result(self, session: dict) -> IngestResult:
+        """mark_placed で記録した移動先"""
+        return IngestResult(**session["placed"])
+
+    def mark_completed(self, session: dict, saved_as: str):
+        """完了状態を記録し、受信マーカーを削除する"""
+        session["status"] = "completed"
+        session["saved_as"] = saved_as
+        session["completed_at"] = datetime.utcnow().isoformat()
+        self._write_meta(session)
+        shutil.rmtree(self._ranges_dir(session["session_id"]), ignore_errors=True)
+        self._data_path(session["session_id"]).unlink(missing_ok=True)
+
+    def delete_session(self, session_id: str):
+        self.get_session(session_id)
+        self._remove_session_files(session_id)
+
+    def _remove_session_files(self, session_id: str):
+        self._data_path(session_id).unlink(missing_ok=True)
+        self._claim_path(session_id).unlink(missing_ok=True)
+        shutil.rmtree(self._ranges_dir(session_id), ignore_errors=True)
+        self._meta_path(session_id).unlink(missing_ok=True)
+
+    def cleanup_expired(self) -> int:
+        """
+        期限切れセッションを削除する（定期処理の担当ワーカーがスレッドで呼ぶ）。
+        取り込み先へ移動済み（placed）のセッションは完了処理の再開に必要なため残す。
+        """
+        removed = 0
+        now = datetime.utcnow()
+        for meta_path in self.sessions_dir.glob("*.json"):
+            try:
+                session = json.loads(meta_path.read_text(encoding="utf-8"))
+                if session.get("status") == "placed":
+                    continue
+                if datetime.fromisoformat(session["expires_at"]) < now:
+                    self._remove_session_files(session["session_id"])
+                    removed += 1
+            except Exception:
+                continue
+        return removed
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"active_sessions": len(list(self.sessions_dir.glob("*.part")))}
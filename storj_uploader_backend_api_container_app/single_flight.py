@@ -0,0 +1,84 @@
+"""
+Single-flight request coalescing.
+
+同じキー（操作, パス, バリアント）の取得・生成を同時に1回だけ実行し、後から来た呼び出しは
+実行中の結果を共有する。
+- 登録は実行中のものだけで、完了したら削除する（画像ごとのロックのように増え続けない）
+- 登録数の上限を超えた場合は共有せずにそのまま実行する（無制限に溜めない）
+- 待っている呼び出しがすべてキャンセルされた場合（クライアントの切断など）は実行中の処理もキャンセルする
+- キャッシュのヒットは呼び出し側で先に返すため、ここで待たされるのは実際に取得する場合だけ
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """キーごとに実行中の処理を共有する（キーの先頭要素は操作名としてメトリクスに使う）"""
+
+    def __init__(self, max_keys: Optional[int] = None):
+        self.max_keys = max_keys or int(os.getenv("SINGLE_FLIGHT_MAX_KEYS", "4096"))
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {
+            # 実際に実行した数
+            "executed": 0,
+            # 実行中の処理の結果を共有した数
+            "coalesced": 0,
+            # 登録数の上限を超えたため共有せずに実行した数
+            "bypassed": 0,
+            # 待っている呼び出しがなくなったためキャンセルした数
+            "cancelled": 0,
+            "peak_inflight": 0,
+        }
+        self._coalesced_by_operation: Dict[str, int] = {}
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def run(self, key: Tuple[Any, ...], fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """key の処理が実行中なら結果を待ち、なければ fn(*args, **kwargs) を実行して登録する"""
+        call = self._calls.get(key)
+        if call is None:
+            if len(self._calls) >= self.max_keys:
+                self._stats["bypassed"] += 1
+                return await fn(*args, **kwargs)
+            call = _Call(asyncio.create_task(fn(*args, **kwargs)))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            self._stats["executed"] += 1
+            self._stats["peak_inflight"] = max(self._stats["peak_inflight"], len(self._calls))
+        else:
+            self._stats["coalesced"] += 1
+            operation = str(key[0])
+            self._coalesced_by_operation[operation] = self._coalesced_by_operation.get(operation, 0) + 1
+
+        call.waiters += 1
+        try:
+            # 1つの呼び出しのキャンセルが他の待ち手に伝わらないように shield する
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # 最後の待ち手だった場合は処理ごと止める（以降の呼び出しは新しく実行する）
+                self._forget(key, call)
+                call.task.cancel()
+                self._stats["cancelled"] += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "inflight": len(self._calls),
+            "max_keys": self.max_keys,
+            "coalesced_by_operation": dict(self._coalesced_by_operation),
+        }
@@ -0,0 +1,106 @@
+"""
+Object metadata (stat) cache.
+
+Storj / Blob のオブジェクトのサイズ・更新日時・Content-Type をキャッシュし、
+動画のシーク（Range リクエスト）ごとの rclone lsjson や Blob のプロパティ取得を省く。
+- TTL 付き、件数上限付き（LRU）
+- ギャラリー一覧の取得結果（サイズ・更新日時）で事前に埋める
+- API からのアップロード・削除時は明示的に無効化する
+- サイズ・更新日時からの内容のバージョン（ETag・バージョン付き URL に使う）
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+
+def parse_mtime(value: str) -> Optional[float]:
+    """更新日時（rclone lsf / lsjson、Blob の isoformat）を UNIX 時刻に変換"""
+    if not value:
+        return None
+    # rclone lsjson はナノ秒まで出力するため、小数部をマイクロ秒に切り詰める
+    text = re.sub(r"(\.\d{6})\d+", r"\1", value.strip())
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+
+def version_token(size: int, mtime: str) -> str:
+    """
+    内容のバージョンを表す短いトークン。
+    一覧（秒単位）と lsjson（ナノ秒）で同じ値になるよう、更新日時は秒に丸める。
+    """
+    seconds = parse_mtime(mtime)
+    source = f"{size}|{int(seconds) if seconds is not None else mtime}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+class ObjectStatCache:
+    """(取得元, バケット/コンテナ, パス) -> {"size", "mtime", "content_type"}"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl or float(os.getenv("STAT_CACHE_TTL_SECONDS", "300"))
+        self.max_entries = max_entries or int(os.getenv("STAT_CACHE_MAX_ENTRIES", "100000"))
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, dict]]" = OrderedDict()
+        # ギャラリー一覧（rclone / I/O バルクヘッドのスレッド）からも更新されるため
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "prefilled": 0, "invalidations": 0}
+
+    def get(self, source: str, container: str, path: str) -> Optional[dict]:
+        key = (source, container, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(
+        self,
+        source: str,
+        container: str,
+        path: str,
+        size: int,
+        mtime: str = "",
+        content_type: str = ""
+    ) -> dict:
+        stat = {"size": size, "mtime": mtime, "content_type": content_type}
+        with self._lock:
+            self._store_locked((source, container, path), stat)
+        return stat
+
+    def _store_locked(self, key: Tuple[str, str, str], stat: dict):
+        self._entries[key] = (time.time() + self.ttl, stat)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def prefill(self, source: str, container: str, entries: Iterable[Tuple[str, int, str]]):
+        """一覧の (パス, サイズ, 更新日時) でまとめて埋める（既存の Content-Type は引き継ぐ）"""
+        count = 0
+        with self._lock:
+            for path, size, mtime in entries:
+                key = (source, container, path)
+                current = self._entries.get(key)
+                content_type = current[1]["content_type"] if current else ""
+                self._store_locked(key, {"size": size, "mtime": mtime, "content_type": content_type})
+                count += 1
+            self._stats["prefilled"] += count
+
+    def invalidate(self, source: str, container: str, path: str):
+        with self._lock:
+            if self._entries.pop((source, container, path), None) is not None:
+                self._stats["invalidations"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "ttl_seconds": self.ttl}
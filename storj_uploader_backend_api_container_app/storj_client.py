@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
+import asyncio
 import subprocess
 import os
 import json
+import signal
 from pathlib import Path
-from typing import Optional, Tuple, Iterator, List, Dict
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple, List, Dict
 import threading
 import time
 from datetime import datetime
 from collections import defaultdict
 
+from coordination import ProcessSemaphore
+from executors import ExecutorSaturatedError
+from origin_cache import LocalOriginCache
+from single_flight import SingleFlight
+from stat_cache import ObjectStatCache, version_token
+from streaming import StreamTransfer, subprocess_stream
+from thumbnail_resolver import ThumbnailResolver
+
 try:
     from blob_storage import BlobStorageHelper
     BLOB_STORAGE_AVAILABLE = True
@@ -41,12 +51,25 @@ class StorjClient:
         self._rclone_config_path = None
         self._rclone_config_lock = threading.Lock()
 
-        # 同時実行制限: rcloneコマンドの並行実行を最大5つに制限
-        self.rclone_semaphore = threading.Semaphore(30)
+        # 読み取り系 rclone（画像・サムネイル取得）の同時実行数（asyncio で待機するためスレッドを占有しない）
+        # 同期メソッドの同時実行数は呼び出し側の rclone バルクヘッド（executors）で制限する
+        self.rclone_read_semaphore = asyncio.Semaphore(int(os.getenv("RCLONE_READ_CONCURRENCY", "16")))
+        # 全ワーカー（uvicorn --workers）合計の rclone の同時実行数（API の rclone バルクヘッドと共有）
+        self.rclone_slots = ProcessSemaphore("rclone", int(os.getenv("RCLONE_GLOBAL_CONCURRENCY", "20")))
+
+        # 同じ画像・サムネイルの同時取得を1回にまとめる（実行中のものだけを登録する）
+        self.single_flight = SingleFlight()
+
+        # 動画サムネイルのパス索引（月ディレクトリ単位の一覧 + ネガティブキャッシュ）
+        self.thumbnail_resolver = ThumbnailResolver(self._list_thumbnail_dir, self._prefer_thumbnail_path)
+
+        # オブジェクトのサイズ・更新日時・Content-Type のキャッシュ（ギャラリー一覧で事前に埋める）
+        self.stat_cache = ObjectStatCache()
 
-        # 画像ごとのロック: 同じ画像を複数スレッドが同時生成しないようにする
-        self.image_locks = defaultdict(threading.Lock)
-        self.image_locks_lock = threading.Lock()
+        # ローカルモードでアップロード済み（uploaded/ に残っている）ファイルを Storj の代わりに読む
+        self.origin_cache = None
+        if os.getenv("ORIGIN_CACHE", "true").lower() == "true":
+            self.origin_cache = LocalOriginCache(self.get_uploaded_dir())
 
         # Blob Storage helper (常に初期化を試行)
         self.blob_helper = None
@@ -333,26 +356,29 @@ class StorjClient:
                 if path.lower().endswith(image_extensions) or path.lower().endswith(video_extensions):
                     all_files.append((path, size, mod_time))
 
+            self.stat_cache.prefill("blob", container_name, all_files)
+
             cdn_base_url = os.getenv("MEDIA_CDN_BASE_URL") or os.getenv("CDN_BASE_URL")
             api_base_url = (cdn_base_url or base_url or os.getenv("API_BASE_URL") or "http://localhost:8010").rstrip("/")
 
+            file_versions = {path: (size, mod_time) for path, size, mod_time in all_files}
             for path, size, mod_time in all_files:
                 filename = path.split('/')[-1]
                 if '_thumb_' in filename.lower() or filename.lower().endswith('_thumb.jpg'):
                     continue
 
                 is_video = path.lower().endswith(video_extensions)
-                full_url = f"{api_base_url}/storj/images/{path}?thumbnail=false"
+                full_url = self._media_url(api_base_url, path, False, size, mod_time)
 
                 if is_video:
                     file_stem = filename.rsplit('.', 1)[0]
                     thumbnail_path = thumbnails.get(file_stem.lower())
-                    if thumbnail_path:
-                        thumbnail_url = f"{api_base_url}/storj/images/{thumbnail_path}?thumbnail=false"
+                    if thumbnail_path and thumbnail_path in file_versions:
+                        thumbnail_url = self._media_url(api_base_url, thumbnail_path, False, *file_versions[thumbnail_path])
                     else:
-                        thumbnail_url = f"{api_base_url}/storj/images/{path}?thumbnail=true"
+                        thumbnail_url = self._media_url(api_base_url, path, True, size, mod_time)
                 else:
-                    thumbnail_url = f"{api_base_url}/storj/images/{path}?thumbnail=true"
+                    thumbnail_url = self._media_url(api_base_url, path, True, size, mod_time)
 
                 images.append({
                     "filename": filename,
@@ -465,6 +491,28 @@ class StorjClient:
                 if path.lower().endswith(image_extensions) or path.lower().endswith(video_extensions):
                     all_files.append((path, size_str, mod_time))
 
+            self.stat_cache.prefill(
+                "storj",
+                bucket_name,
+                ((path, int(size_str) if size_str.isdigit() else 0, mod_time) for path, size_str, mod_time in all_files)
+            )
+
+            # 一覧はバケット全体なので、動画サムネイルの索引もこの結果で更新する
+            self.thumbnail_resolver.seed(
+                bucket_name,
+                thumbnails.values(),
+                dir_names={
+                    Path(path).parent.name
+                    for path, _size, _time in all_files
+                    if path.lower().endswith(video_extensions)
+                }
+            )
+
+            file_versions = {
+                path: (int(size_str) if size_str.isdigit() else 0, mod_time)
+                for path, size_str, mod_time in all_files
+            }
+
             # Second pass: process media files and link thumbnails
             for path, size_str, mod_time in all_files:
                 filename = path.split('/')[-1]
@@ -480,7 +528,7 @@ class StorjClient:
 
                 # Generate URLs for media access
                 api_base_url = (base_url or os.getenv("API_BASE_URL") or "http://localhost:8010").rstrip("/")
-                full_url = f"{api_base_url}/storj/images/{path}?thumbnail=false"
+                full_url = self._media_url(api_base_url, path, False, size, mod_time)
 
                 # Determine thumbnail URL
                 # For videos, check if a thumbnail exists
@@ -490,15 +538,17 @@ class StorjClient:
                     file_stem = filename.rsplit('.', 1)[0]  # Remove extension
                     thumbnail_path = thumbnails.get(file_stem.lower())
 
-                    if thumbnail_path:
+                    if thumbnail_path and thumbnail_path in file_versions:
                         # Use the thumbnail file
-                        thumbnail_url = f"{api_base_url}/storj/images/{thumbnail_path}?thumbnail=false"
+                        thumbnail_url = self._media_url(
+                            api_base_url, thumbnail_path, False, *file_versions[thumbnail_path]
+                        )
                     else:
                         # No thumbnail found, let the API generate on-demand
-                        thumbnail_url = f"{api_base_url}/storj/images/{path}?thumbnail=true"
+                        thumbnail_url = self._media_url(api_base_url, path, True, size, mod_time)
                 else:
                     # For images, use the standard thumbnail parameter
-                    thumbnail_url = f"{api_base_url}/storj/images/{path}?thumbnail=true"
+                    thumbnail_url = self._media_url(api_base_url, path, True, size, mod_time)
 
                 images.append({
                     "filename": filename,
@@ -524,6 +574,61 @@ class StorjClient:
             print(f"Error listing Storj images: {str(e)}")
             return False, [], str(e)
 
+    def list_storj_object_sizes(self, bucket_name: str = None) -> Tuple[bool, List[Tuple[str, int]], str]:
+        """
+        バケット（Blob ギャラリーモードでは uploaded コンテナ）の全オブジェクトのパスとサイズを取得
+        Returns: (success: bool, [(path, size), ...], error_message: str)
+        """
+        try:
+            gallery_source = os.getenv("GALLERY_SOURCE", "").lower()
+            if gallery_source in ("azure", "blob", "storage") and self.blob_helper:
+                container_name = os.getenv("AZURE_STORAGE_UPLOADED_CONTAINER", "uploaded")
+                blobs = self.blob_helper.list_blobs_with_properties(container_name=container_name)
+                return True, [(blob["name"], blob.get("size", 0) or 0) for blob in blobs], ""
+
+            if bucket_name is None:
+                bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+            remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+            env, error_message = self._get_rclone_env()
+            if error_message:
+                return False, [], error_message
+
+            cmd = [
+                "rclone", "lsf",
+                f"{remote_name}:{bucket_name}/",
+                "--format", "ps",
+                "--recursive",
+                "--files-only",
+            ]
+            result = subprocess.run(
+                cmd,
+                cwd=str(self.storj_app_path),
+                env=env,
+                capture_output=True,
+                text=True,
+                timeout=300,
+            )
+
+            if result.returncode != 0:
+                error_msg = result.stderr or "Unknown error"
+                print(f"rclone lsf failed while listing object sizes: {error_msg}")
+                return False, [], error_msg
+
+            objects = []
+            for line in result.stdout.splitlines():
+                path, _, size_str = line.rpartition(";")
+                if not path:
+                    continue
+                try:
+                    objects.append((path, int(size_str)))
+                except ValueError:
+                    continue
+            return True, objects, ""
+        except subprocess.TimeoutExpired:
+            return False, [], "Timed out listing Storj objects"
+        except Exception as e:
+            return False, [], str(e)
+
     def _count_uploaded_files_excluding_thumbnails(self) -> int:
         """
         Count uploaded files excluding thumbnails (works for both Azure Blob and Storj bucket).
@@ -639,6 +744,16 @@ class StorjClient:
     def _thumbnail_key(self, path: str) -> str:
         return str(Path(path).with_suffix('')).lower()
 
+    def _media_url(self, api_base_url: str, path: str, thumbnail: bool, size: int, mod_time: str) -> str:
+        """
+        メディアの URL。MEDIA_URL_VERSIONING が有効な場合は内容のバージョン（サイズ・更新日時）をパスに含め、
+        内容が変わると URL も変わるようにする（CDN・ブラウザで immutable としてキャッシュできる）
+        """
+        query = f"?thumbnail={'true' if thumbnail else 'false'}"
+        if os.getenv("MEDIA_URL_VERSIONING", "true").lower() != "true":
+            return f"{api_base_url}/storj/images/{path}{query}"
+        return f"{api_base_url}/storj/images/v/{version_token(size, mod_time)}/{path}{query}"
+
     def _build_thumb_map(self, blob_names: List[str]) -> Dict[str, List[str]]:
         thumb_map: Dict[str, List[str]] = defaultdict(list)
         for name in blob_names:
@@ -652,6 +767,26 @@ class StorjClient:
             thumb_map[key].append(name)
         return thumb_map
 
+    def fetch_blob_stat(self, blob_name: str, container_name: str) -> Optional[dict]:
+        """
+        Blob のプロパティを取得して stat_cache に格納する（スレッドで実行）。
+        存在しない場合は None。呼び出し側は先に stat_cache.get を確認する。
+        """
+        try:
+            props = self.blob_helper.get_blob_properties(blob_name, container_name=container_name)
+        except Exception as e:
+            if self._is_not_found_error(e):
+                return None
+            raise
+        return self.stat_cache.put(
+            "blob",
+            container_name,
+            blob_name,
+            props.get("size") or 0,
+            props.get("last_modified", ""),
+            props.get("content_type", "")
+        )
+
     def _is_not_found_error(self, exc: Exception) -> bool:
         message = str(exc).lower()
         return "not found" in message or "resourcenotfound" in message
@@ -688,6 +823,7 @@ class StorjClient:
                             name,
                             container_name=container_name
                         )
+                        self.stat_cache.invalidate("blob", container_name, name)
                         deleted.append(name)
                     except Exception as e:
                         if name != path and self._is_not_found_error(e):
@@ -730,6 +866,9 @@ class StorjClient:
                 failed.append({"path": path, "message": error_msg})
                 continue
 
+            self.stat_cache.invalidate("storj", bucket_name, path)
+            if self.origin_cache is not None:
+                self.origin_cache.remove(path)
             deleted.append(path)
 
             if self._is_video_path(path):
@@ -738,6 +877,8 @@ class StorjClient:
                 dir_name = path_obj.parent.name  # YYYYMM
                 file_stem = path_obj.stem  # filename without extension
                 thumb_path = f"thumbnails/{dir_name}/{file_stem}_thumb.jpg"
+                self.stat_cache.invalidate("storj", bucket_name, thumb_path)
+                self.thumbnail_resolver.invalidate(bucket_name, dir_name)
                 thumb_remote_path = f"{remote_name}:{bucket_name}/{thumb_path}"
                 thumb_cmd = ["rclone", "deletefile", thumb_remote_path]
                 thumb_result = subprocess.run(
@@ -759,53 +900,151 @@ class StorjClient:
         message = f"Deleted {len(deleted)} item(s)"
         return success, deleted, failed, message
 
-    def get_storj_image(self, image_path: str, bucket_name: str = None) -> Tuple[bool, bytes, str]:
+    async def _run_rclone_async(self, cmd: List[str], env: dict, timeout: float) -> Tuple[int, bytes, bytes]:
         """
-        Storjから指定されたパスの画像を取得
-        Returns: (success: bool, image_data: bytes, error_message: str)
+        rclone をイベントループをブロックせずに実行する（asyncio サブプロセス）。
+        タイムアウト時はプロセスを kill して asyncio.TimeoutError を送出する。
+        Returns: (returncode, stdout, stderr)
         """
-        # rcloneセマフォで同時実行数を制限
-        with self.rclone_semaphore:
+        async with self.rclone_read_semaphore, self.rclone_slots.slot():
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                cwd=str(self.storj_app_path),
+                env=env,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True
+            )
             try:
-                # .envから設定を取得
-                if bucket_name is None:
-                    bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
-                remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+            except BaseException:
+                # タイムアウト・リクエストのキャンセル時に rclone（ラッパー経由の子プロセスを含む）を残さない
+                if proc.returncode is None:
+                    try:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    await proc.wait()
+                raise
+            return proc.returncode, stdout, stderr
+
+    async def get_local_origin(self, object_path: str, bucket_name: str = None) -> Optional[Path]:
+        """
+        uploaded/ に残っているアップロード済みファイルのパス（なければ None）
+        アップローダーが書き込むのは STORJ_BUCKET_NAME のバケットのみ
+        """
+        if self.origin_cache is None:
+            return None
+        default_bucket = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        if bucket_name is not None and bucket_name != default_bucket:
+            return None
+        return await asyncio.to_thread(self.origin_cache.lookup, object_path)
 
-                env, error_message = self._get_rclone_env()
-                if error_message:
-                    return False, b"", error_message
+    async def get_storj_image(self, image_path: str, bucket_name: str = None) -> Tuple[bool, bytes, str]:
+        """
+        Storjから指定されたパスの画像を取得（uploaded/ に残っていればローカルから読む）
+        同じ画像の同時リクエストは1回の取得を共有する
+        Returns: (success: bool, image_data: bytes, error_message: str)
+        """
+        if bucket_name is None:
+            bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        return await self.single_flight.run(
+            ("image", bucket_name, image_path),
+            self._fetch_storj_image,
+            image_path,
+            bucket_name
+        )
 
-                # rclone cat コマンドでファイルを取得
-                remote_path = f"{remote_name}:{bucket_name}/{image_path}"
-                cmd = [
-                    "rclone", "cat",
-                    remote_path
-                ]
+    async def _fetch_storj_image(self, image_path: str, bucket_name: str) -> Tuple[bool, bytes, str]:
+        try:
+            local_path = await self.get_local_origin(image_path, bucket_name)
+            if local_path is not None:
+                try:
+                    return True, await asyncio.to_thread(local_path.read_bytes), "Success (local origin)"
+                except FileNotFoundError:
+                    pass
 
-                print(f"[{datetime.now()}] Fetching image from {remote_path}")
+            # .envから設定を取得
+            remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
 
-                result = subprocess.run(
-                    cmd,
-                    cwd=str(self.storj_app_path),
-                    env=env,
-                    capture_output=True,
-                    timeout=60
-                )
+            env, error_message = self._get_rclone_env()
+            if error_message:
+                return False, b"", error_message
 
-                if result.returncode != 0:
-                    error_msg = result.stderr.decode('utf-8') if result.stderr else "Unknown error"
-                    print(f"rclone cat failed: {error_msg}")
-                    return False, b"", error_msg
+            # rclone cat コマンドでファイルを取得
+            remote_path = f"{remote_name}:{bucket_name}/{image_path}"
+            cmd = [
+                "rclone", "cat",
+                remote_path
+            ]
 
-                print(f"Successfully fetched image: {len(result.stdout)} bytes")
-                return True, result.stdout, "Success"
+            print(f"[{datetime.now()}] Fetching image from {remote_path}")
 
-            except subprocess.TimeoutExpired:
-                return False, b"", "rclone command timed out"
-            except Exception as e:
-                print(f"Error fetching Storj image: {str(e)}")
-                return False, b"", str(e)
+            returncode, stdout, stderr = await self._run_rclone_async(cmd, env, timeout=60)
+
+            if returncode != 0:
+                error_msg = stderr.decode('utf-8') if stderr else "Unknown error"
+                print(f"rclone cat failed: {error_msg}")
+                return False, b"", error_msg
+
+            print(f"Successfully fetched image: {len(stdout)} bytes")
+            return True, stdout, "Success"
+
+        except asyncio.TimeoutError:
+            return False, b"", "rclone command timed out"
+        except Exception as e:
+            print(f"Error fetching Storj image: {str(e)}")
+            return False, b"", str(e)
+
+    async def copy_storj_files(
+        self,
+        object_paths: List[str],
+        dest_dir: Path,
+        bucket_name: str = None,
+        timeout: float = 120
+    ) -> Tuple[bool, str]:
+        """
+        複数のオブジェクトを1回の rclone copy（--files-from）で dest_dir 以下にダウンロードする
+        （dest_dir/{object_path} に保存される）。
+        存在しないオブジェクトがあっても他のオブジェクトはコピーするため、結果は呼び出し側で dest_dir を確認する。
+        キャンセルされた場合は rclone を kill する。
+        Returns: (success: bool, error_message: str)
+        """
+        if bucket_name is None:
+            bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+
+        env, error_message = self._get_rclone_env()
+        if error_message:
+            return False, error_message
+
+        dest_dir = dest_dir.resolve()
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        files_from = dest_dir.with_name(f"{dest_dir.name}.files")
+        files_from.write_text("".join(f"{path}\n" for path in object_paths), encoding="utf-8")
+        cmd = [
+            "rclone", "copy",
+            f"{remote_name}:{bucket_name}/",
+            str(dest_dir),
+            "--files-from", str(files_from),
+            # 一覧を取らずに指定したオブジェクトだけを取得する
+            "--no-traverse",
+            "--transfers", os.getenv("RCLONE_BULK_TRANSFERS", "8")
+        ]
+
+        print(f"[{datetime.now()}] Copying {len(object_paths)} object(s) from {remote_name}:{bucket_name}/")
+        try:
+            returncode, _stdout, stderr = await self._run_rclone_async(cmd, env, timeout=timeout)
+        except asyncio.TimeoutError:
+            return False, "rclone command timed out"
+        finally:
+            files_from.unlink(missing_ok=True)
+
+        if returncode != 0:
+            error_msg = stderr.decode("utf-8", errors="ignore") if stderr else "Unknown error"
+            print(f"rclone copy finished with errors: {error_msg}")
+            return False, error_msg
+        return True, "Success"
 
     def download_storj_file_to_path(
         self,
@@ -898,15 +1137,17 @@ class StorjClient:
                 dest
             ]
 
-            with self.rclone_semaphore:
-                result = subprocess.run(
-                    cmd,
-                    cwd=str(self.storj_app_path),
-                    env=env,
-                    capture_output=True,
-                    text=True,
-                    timeout=timeout
-                )
+            result = subprocess.run(
+                cmd,
+                cwd=str(self.storj_app_path),
+                env=env,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+
+            # 上書きの可能性があるため成否にかかわらずキャッシュを無効化する
+            self.stat_cache.invalidate("storj", bucket_name, remote_path)
 
             if result.returncode != 0:
                 error_msg = result.stderr or "Unknown error"
@@ -921,9 +1162,10 @@ class StorjClient:
             print(f"Error uploading Storj file: {str(e)}")
             return False, str(e)
 
-    def get_storj_object_info(self, object_path: str, bucket_name: str = None) -> Tuple[bool, dict, str]:
+    async def get_storj_object_info(self, object_path: str, bucket_name: str = None) -> Tuple[bool, dict, str]:
         """
         Storjオブジェクトのメタ情報を取得 (サイズなど)
+        stat_cache にあれば rclone を実行せずに返す（Size / ModTime / MimeType のみ）
         Returns: (success: bool, info: dict, error_message: str)
         """
         try:
@@ -931,6 +1173,15 @@ class StorjClient:
                 bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
             remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
 
+            stat = self.stat_cache.get("storj", bucket_name, object_path)
+            if stat is not None:
+                return True, {
+                    "Path": object_path,
+                    "Size": stat["size"],
+                    "ModTime": stat["mtime"],
+                    "MimeType": stat["content_type"],
+                }, "Success (cached)"
+
             env, error_message = self._get_rclone_env()
             if error_message:
                 return False, {}, error_message
@@ -942,42 +1193,77 @@ class StorjClient:
                 remote_path
             ]
 
-            result = subprocess.run(
-                cmd,
-                cwd=str(self.storj_app_path),
-                env=env,
-                capture_output=True,
-                text=True,
-                timeout=30
-            )
+            returncode, stdout, stderr = await self._run_rclone_async(cmd, env, timeout=30)
 
-            if result.returncode != 0:
-                error_msg = result.stderr or "Unknown error"
+            if returncode != 0:
+                error_msg = stderr.decode("utf-8", errors="ignore") if stderr else "Unknown error"
                 print(f"rclone lsjson failed: {error_msg}")
                 return False, {}, error_msg
 
-            info = json.loads(result.stdout)
+            info = json.loads(stdout)
             if not isinstance(info, dict):
                 return False, {}, "Invalid lsjson response"
 
+            size = info.get("Size")
+            if isinstance(size, int) and size >= 0:
+                self.stat_cache.put(
+                    "storj",
+                    bucket_name,
+                    object_path,
+                    size,
+                    info.get("ModTime", ""),
+                    info.get("MimeType", "")
+                )
             return True, info, "Success"
 
-        except subprocess.TimeoutExpired:
+        except asyncio.TimeoutError:
             return False, {}, "rclone command timed out"
         except Exception as e:
             print(f"Error fetching Storj object info: {str(e)}")
             return False, {}, str(e)
 
+    async def read_storj_range(
+        self,
+        object_path: str,
+        offset: int,
+        count: int,
+        bucket_name: str = None
+    ) -> bytes:
+        """
+        Storjオブジェクトの指定範囲を取得する（動画のブロックキャッシュ用）
+        失敗時は IOError を送出する
+        """
+        if bucket_name is None:
+            bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+
+        env, error_message = self._get_rclone_env()
+        if error_message:
+            raise IOError(error_message)
+
+        remote_path = f"{remote_name}:{bucket_name}/{object_path}"
+        cmd = ["rclone", "cat", remote_path, "--offset", str(offset), "--count", str(count)]
+        try:
+            returncode, stdout, stderr = await self._run_rclone_async(cmd, env, timeout=120)
+        except asyncio.TimeoutError:
+            raise IOError("rclone command timed out")
+        if returncode != 0:
+            raise IOError(stderr.decode("utf-8", errors="ignore") or "Unknown error")
+        return stdout
+
     def stream_storj_file(
         self,
         object_path: str,
         bucket_name: str = None,
         offset: int = None,
-        count: int = None
-    ) -> Tuple[bool, Iterator[bytes], str]:
+        count: int = None,
+        transfer: Optional[StreamTransfer] = None
+    ) -> Tuple[bool, AsyncIterator[bytes], str]:
         """
-        Storjのファイルをストリームで取得
-        Returns: (success: bool, iterator: Iterator[bytes], error_message: str)
+        Storjのファイルをストリームで取得（rclone cat の出力を asyncio で読み出す）
+        ストリームが途中で閉じられた場合（クライアントの切断）は rclone を kill する
+        transfer: 読み出し量の記録先（streaming.StreamMonitor で破棄量を集計する）
+        Returns: (success: bool, iterator: AsyncIterator[bytes], error_message: str)
         """
         try:
             if bucket_name is None:
@@ -986,7 +1272,7 @@ class StorjClient:
 
             env, error_message = self._get_rclone_env()
             if error_message:
-                return False, iter(()), error_message
+                return False, None, error_message
 
             remote_path = f"{remote_name}:{bucket_name}/{object_path}"
             cmd = [
@@ -998,154 +1284,157 @@ class StorjClient:
             if count is not None:
                 cmd.extend(["--count", str(count)])
 
-            proc = subprocess.Popen(
+            return True, subprocess_stream(
                 cmd,
-                cwd=str(self.storj_app_path),
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-
-            def iterator() -> Iterator[bytes]:
-                try:
-                    if not proc.stdout:
-                        return
-                    for chunk in iter(lambda: proc.stdout.read(1024 * 1024), b""):
-                        yield chunk
-                finally:
-                    if proc.stdout:
-                        proc.stdout.close()
-                    stderr = None
-                    if proc.stderr:
-                        stderr = proc.stderr.read()
-                        proc.stderr.close()
-                    return_code = proc.wait()
-                    if return_code != 0:
-                        error_detail = stderr.decode("utf-8", errors="ignore") if stderr else ""
-                        print(f"rclone cat failed: {error_detail or return_code}")
-
-            return True, iterator(), "Success"
+                env,
+                str(self.storj_app_path),
+                transfer or StreamTransfer(count)
+            ), "Success"
 
         except Exception as e:
             print(f"Error streaming Storj file: {str(e)}")
-            return False, iter(()), str(e)
+            return False, None, str(e)
+
+    @staticmethod
+    def _resize_to_jpeg(image_data: bytes, size: tuple) -> Tuple[bool, bytes, str]:
+        """Pillowでアスペクト比を維持してリサイズし、JPEGで返す"""
+        from PIL import Image
+        import io
+
+        try:
+            img = Image.open(io.BytesIO(image_data))
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            # RGBAの場合はRGBに変換
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGB')
+            img.save(output, format='JPEG', quality=85, optimize=True)
+            return True, output.getvalue(), "Success"
+        except Exception as e:
+            return False, b"", str(e)
 
-    def get_storj_thumbnail(self, image_path: str, bucket_name: str = None, size: tuple = (300, 300)) -> Tuple[bool, bytes, str]:
+    async def get_storj_thumbnail(
+        self,
+        image_path: str,
+        bucket_name: str = None,
+        size: tuple = (300, 300),
+        thumbnail_fn: Optional[Callable[[bytes, tuple], Awaitable[Tuple[bool, bytes, str]]]] = None
+    ) -> Tuple[bool, bytes, str]:
         """
         Storjから事前生成されたサムネイルを取得
         サムネイルが存在しない場合は生成する（旧データ用のフォールバック）
+        キャッシュは呼び出し側（API の TieredThumbnailCache）で行う
+        同じ画像の同時リクエストは1回の取得・生成を共有する
+        thumbnail_fn: リサイズ処理（省略時はスレッドで Pillow を実行。API ではプロセスプールを渡す）
         Returns: (success: bool, thumbnail_data: bytes, error_message: str)
         """
-        # 画像ごとのロックを取得（同じ画像への並行アクセスを防ぐ）
-        with self.image_locks_lock:
-            image_lock = self.image_locks[image_path]
+        if bucket_name is None:
+            bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        return await self.single_flight.run(
+            ("thumbnail", bucket_name, image_path, tuple(size)),
+            self._fetch_storj_thumbnail,
+            image_path,
+            bucket_name,
+            size,
+            thumbnail_fn
+        )
 
-        # この画像専用のロックを取得
-        with image_lock:
-            try:
-                # .envから設定を取得
-                if bucket_name is None:
-                    bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
-                remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+    async def _fetch_storj_thumbnail(
+        self,
+        image_path: str,
+        bucket_name: str,
+        size: tuple,
+        thumbnail_fn: Optional[Callable[[bytes, tuple], Awaitable[Tuple[bool, bytes, str]]]]
+    ) -> Tuple[bool, bytes, str]:
+        try:
+            # .envから設定を取得
+            remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
 
-                env, error_message = self._get_rclone_env()
-                if error_message:
-                    return False, b"", error_message
-
-                # サムネイルファイル名を生成（拡張子を.jpgに変更）
-                thumbnail_path = "thumbnails/" + image_path.rsplit('.', 1)[0] + '.jpg'
-
-                # キャッシュディレクトリのパス
-                cache_dir = Path(__file__).parent / "thumbnail_cache"
-                cache_dir.mkdir(exist_ok=True)
-
-                # キャッシュファイル名を生成（パスをエンコード）
-                cache_filename = image_path.replace("/", "_").replace("\\", "_")
-                cache_path = cache_dir / cache_filename
-
-                # キャッシュが存在する場合は返す
-                if cache_path.exists() and cache_path.stat().st_size > 0:
-                    print(f"[{datetime.now()}] Serving cached thumbnail for {image_path}")
-                    with open(cache_path, 'rb') as f:
-                        return True, f.read(), "Success (cached)"
-
-                # rcloneセマフォで同時実行数を制限
-                with self.rclone_semaphore:
-                    # Storjからサムネイルを取得
-                    remote_path = f"{remote_name}:{bucket_name}/{thumbnail_path}"
-                    cmd = [
-                        "rclone", "cat",
-                        remote_path
-                    ]
-
-                    print(f"[{datetime.now()}] Fetching thumbnail from {remote_path}")
-
-                    result = subprocess.run(
-                        cmd,
-                        cwd=str(self.storj_app_path),
-                        env=env,
-                        capture_output=True,
-                        timeout=30
-                    )
-
-                    if result.returncode == 0 and len(result.stdout) > 0:
-                        # サムネイルが存在する場合
-                        print(f"[{datetime.now()}] Successfully fetched thumbnail: {len(result.stdout)} bytes")
-                        return True, result.stdout, "Success (pre-generated)"
-                    else:
-                        # サムネイルが存在しない場合（旧データ）、オンデマンドで生成
-                        if result.returncode == 0:
-                            print(f"[{datetime.now()}] Thumbnail is empty (0 bytes), generating on-demand for {image_path}")
-                        else:
-                            print(f"[{datetime.now()}] Thumbnail not found, generating on-demand for {image_path}")
-
-                        # 元画像を取得してリサイズ
-                        success, image_data, error_msg = self.get_storj_image(image_path, bucket_name)
-
-                        if not success:
-                            return False, b"", error_msg
-
-                        # Pillowで画像をリサイズ
-                        from PIL import Image
-                        import io
-
-                        try:
-                            # 画像を開く
-                            img = Image.open(io.BytesIO(image_data))
-
-                            # サムネイルを生成（アスペクト比を維持）
-                            img.thumbnail(size, Image.Resampling.LANCZOS)
-
-                            # JPEGとして保存（元の形式に関わらず）
-                            output = io.BytesIO()
-                            # RGBAの場合はRGBに変換
-                            if img.mode in ('RGBA', 'LA', 'P'):
-                                img = img.convert('RGB')
-                            img.save(output, format='JPEG', quality=85, optimize=True)
-                            thumbnail_data = output.getvalue()
-
-                            # キャッシュに保存（アトミックな書き込み）
-                            temp_cache_path = cache_path.with_suffix('.tmp')
-                            with open(temp_cache_path, 'wb') as f:
-                                f.write(thumbnail_data)
-                            # アトミックに移動
-                            temp_cache_path.replace(cache_path)
-
-                            print(f"[{datetime.now()}] Thumbnail generated and cached: {len(thumbnail_data)} bytes")
-                            return True, thumbnail_data, "Success (generated on-demand)"
-
-                        except Exception as e:
-                            print(f"Error generating thumbnail: {str(e)}")
-                            # サムネイル生成に失敗した場合は元画像を返す
-                            return True, image_data, f"Success (original - thumbnail failed: {str(e)})"
-
-            except subprocess.TimeoutExpired:
-                return False, b"", "rclone command timed out"
-            except Exception as e:
-                print(f"Error in get_storj_thumbnail: {str(e)}")
-                return False, b"", str(e)
+            env, error_message = self._get_rclone_env()
+            if error_message:
+                return False, b"", error_message
+
+            # サムネイルファイル名を生成（拡張子を.jpgに変更）
+            thumbnail_path = "thumbnails/" + image_path.rsplit('.', 1)[0] + '.jpg'
+
+            # Storjからサムネイルを取得
+            remote_path = f"{remote_name}:{bucket_name}/{thumbnail_path}"
+            cmd = [
+                "rclone", "cat",
+                remote_path
+            ]
+
+            print(f"[{datetime.now()}] Fetching thumbnail from {remote_path}")
+
+            returncode, stdout, _stderr = await self._run_rclone_async(cmd, env, timeout=30)
+
+            if returncode == 0 and len(stdout) > 0:
+                # サムネイルが存在する場合
+                print(f"[{datetime.now()}] Successfully fetched thumbnail: {len(stdout)} bytes")
+                return True, stdout, "Success (pre-generated)"
+
+            # サムネイルが存在しない場合（旧データ）、オンデマンドで生成
+            if returncode == 0:
+                print(f"[{datetime.now()}] Thumbnail is empty (0 bytes), generating on-demand for {image_path}")
+            else:
+                print(f"[{datetime.now()}] Thumbnail not found, generating on-demand for {image_path}")
+
+            # 元画像を取得してリサイズ
+            success, image_data, error_msg = await self.get_storj_image(image_path, bucket_name)
+
+            if not success:
+                return False, b"", error_msg
+
+            if thumbnail_fn is not None:
+                resized, thumbnail_data, resize_error = await thumbnail_fn(image_data, size)
+            else:
+                resized, thumbnail_data, resize_error = await asyncio.to_thread(
+                    self._resize_to_jpeg, image_data, size
+                )
+            if not resized:
+                print(f"Error generating thumbnail: {resize_error}")
+                # サムネイル生成に失敗した場合は元画像を返す
+                return True, image_data, f"Success (original - thumbnail failed: {resize_error})"
+
+            print(f"[{datetime.now()}] Thumbnail generated: {len(thumbnail_data)} bytes")
+            return True, thumbnail_data, "Success (generated on-demand)"
+
+        except asyncio.TimeoutError:
+            return False, b"", "rclone command timed out"
+        except ExecutorSaturatedError:
+            # 生成の待ち行列・バルクヘッドの飽和と、画面外に出た画像の生成の取り消し（GenerationDroppedError）は
+            # API が 503 + Retry-After を返す（再び表示されたときに生成する）
+            raise
+        except Exception as e:
+            print(f"Error in get_storj_thumbnail: {str(e)}")
+            return False, b"", str(e)
+
+    async def _list_thumbnail_dir(self, bucket_name: str, dir_name: str) -> Optional[List[str]]:
+        """thumbnails/{dir_name}/ 直下のファイル名一覧（thumbnail_resolver 用。失敗時は None）"""
+        remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+        env, error_message = self._get_rclone_env()
+        if error_message:
+            return None
+
+        remote_path = f"{remote_name}:{bucket_name}/thumbnails/{dir_name}/"
+        cmd = ["rclone", "lsf", remote_path, "--max-depth", "1", "--files-only"]
+
+        print(f"[{datetime.now()}] Listing thumbnails: {remote_path}")
+        try:
+            returncode, stdout, stderr = await self._run_rclone_async(cmd, env, timeout=30)
+        except asyncio.TimeoutError:
+            print(f"[{datetime.now()}] Thumbnail listing timed out: {remote_path}")
+            return None
+        if returncode != 0:
+            error_msg = stderr.decode("utf-8", errors="ignore")
+            # ディレクトリが存在しない（その月のサムネイルがまだない）場合は空の一覧として扱う
+            if "directory not found" in error_msg.lower():
+                return []
+            print(f"[{datetime.now()}] Thumbnail listing failed: {error_msg}")
+            return None
+        return [line for line in stdout.decode("utf-8", errors="ignore").splitlines() if line]
 
-    def get_storj_thumbnail_by_prefix(
+    async def get_storj_thumbnail_by_prefix(
         self,
         video_stem: str,
         dir_name: str,
@@ -1154,107 +1443,62 @@ class StorjClient:
         """
         Storjからプレフィックスマッチでサムネイルを検索して取得
         サムネイル形式: thumbnails/YYYYMM/{video_stem}_thumb_{hash}.jpg
+        パスは thumbnail_resolver（月ディレクトリ単位の索引）で解決し、存在しないことが
+        分かっている動画は Storj に問い合わせずに失敗を返す
+        同じ動画の同時リクエストは1回の取得を共有する
         Returns: (success: bool, thumbnail_data: bytes, error_message: str)
         """
-        with self.rclone_semaphore:
-            try:
-                if bucket_name is None:
-                    bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
-                remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
+        if bucket_name is None:
+            bucket_name = os.getenv("STORJ_BUCKET_NAME", "storj-upload-bucket")
+        return await self.single_flight.run(
+            ("video_thumbnail", bucket_name, dir_name, video_stem),
+            self._fetch_storj_thumbnail_by_prefix,
+            video_stem,
+            dir_name,
+            bucket_name
+        )
 
-                env, error_message = self._get_rclone_env()
-                if error_message:
-                    return False, b"", error_message
+    async def _fetch_storj_thumbnail_by_prefix(
+        self,
+        video_stem: str,
+        dir_name: str,
+        bucket_name: str
+    ) -> Tuple[bool, bytes, str]:
+        try:
+            remote_name = os.getenv("STORJ_REMOTE_NAME", "storj")
 
-                # Search for thumbnail with prefix: thumbnails/YYYYMM/{video_stem}_thumb
-                thumbnail_prefix = f"thumbnails/{dir_name}/{video_stem}_thumb"
-                remote_path = f"{remote_name}:{bucket_name}/{thumbnail_prefix}"
+            env, error_message = self._get_rclone_env()
+            if error_message:
+                return False, b"", error_message
 
-                # Use rclone lsf to find matching files
-                cmd = [
-                    "rclone", "lsf",
-                    remote_path,
-                    "--max-depth", "1"
-                ]
+            if self.thumbnail_resolver.is_known_missing(bucket_name, dir_name, video_stem):
+                return False, b"", "Thumbnail not found (cached)"
 
-                print(f"[{datetime.now()}] Searching for thumbnail with prefix: {thumbnail_prefix}")
+            # 月ディレクトリの一覧（索引）からサムネイルのパスを解決する
+            thumbnail_path = await self.thumbnail_resolver.resolve(bucket_name, dir_name, video_stem)
+            if not thumbnail_path:
+                print(f"[{datetime.now()}] No thumbnail found for: thumbnails/{dir_name}/{video_stem}_thumb")
+                return False, b"", "Thumbnail not found"
+            print(f"[{datetime.now()}] Found thumbnail: {thumbnail_path}")
 
-                result = subprocess.run(
-                    cmd,
-                    cwd=str(self.storj_app_path),
-                    env=env,
-                    capture_output=True,
-                    text=True,
-                    timeout=30
-                )
-
-                # Parse the result to find matching thumbnail files
-                matching_files = []
-                if result.returncode == 0 and result.stdout.strip():
-                    for line in result.stdout.strip().split('\n'):
-                        if line and line.endswith('.jpg'):
-                            # Full path: thumbnails/YYYYMM/{video_stem}_thumb_{hash}.jpg
-                            full_path = f"thumbnails/{dir_name}/{video_stem}_thumb{line}"
-                            matching_files.append(full_path)
-
-                if not matching_files:
-                    # Try alternative: list the thumbnails directory and filter
-                    alt_remote_path = f"{remote_name}:{bucket_name}/thumbnails/{dir_name}/"
-                    alt_cmd = [
-                        "rclone", "lsf",
-                        alt_remote_path,
-                        "--max-depth", "1"
-                    ]
-
-                    alt_result = subprocess.run(
-                        alt_cmd,
-                        cwd=str(self.storj_app_path),
-                        env=env,
-                        capture_output=True,
-                        text=True,
-                        timeout=30
-                    )
-
-                    if alt_result.returncode == 0 and alt_result.stdout.strip():
-                        for line in alt_result.stdout.strip().split('\n'):
-                            # Check if file matches {video_stem}_thumb pattern
-                            if line and line.startswith(f"{video_stem}_thumb") and line.endswith('.jpg'):
-                                full_path = f"thumbnails/{dir_name}/{line}"
-                                matching_files.append(full_path)
-
-                if not matching_files:
-                    print(f"[{datetime.now()}] No thumbnail found for prefix: {thumbnail_prefix}")
-                    return False, b"", "Thumbnail not found"
-
-                thumbnail_path = None
-                for candidate in matching_files:
-                    thumbnail_path = self._prefer_thumbnail_path(thumbnail_path, candidate)
-                if not thumbnail_path:
-                    return False, b"", "Thumbnail not found"
-                print(f"[{datetime.now()}] Found thumbnail: {thumbnail_path}")
-
-                # Fetch the thumbnail
-                fetch_remote_path = f"{remote_name}:{bucket_name}/{thumbnail_path}"
-                fetch_cmd = ["rclone", "cat", fetch_remote_path]
-
-                fetch_result = subprocess.run(
-                    fetch_cmd,
-                    cwd=str(self.storj_app_path),
-                    env=env,
-                    capture_output=True,
-                    timeout=60
-                )
+            # Fetch the thumbnail
+            fetch_remote_path = f"{remote_name}:{bucket_name}/{thumbnail_path}"
+            fetch_cmd = ["rclone", "cat", fetch_remote_path]
 
-                if fetch_result.returncode == 0 and len(fetch_result.stdout) > 0:
-                    print(f"[{datetime.now()}] Successfully fetched thumbnail from Storj: {len(fetch_result.stdout)} bytes")
-                    return True, fetch_result.stdout, f"Success (path: {thumbnail_path})"
-                else:
-                    error_msg = fetch_result.stderr.decode('utf-8') if fetch_result.stderr else "Unknown error"
-                    print(f"[{datetime.now()}] Failed to fetch thumbnail: {error_msg}")
-                    return False, b"", error_msg
+            fetch_returncode, fetch_stdout, fetch_stderr = await self._run_rclone_async(fetch_cmd, env, timeout=60)
 
-            except subprocess.TimeoutExpired:
-                return False, b"", "rclone command timed out"
-            except Exception as e:
-                print(f"Error in get_storj_thumbnail_by_prefix: {str(e)}")
-                return False, b"", str(e)
+            if fetch_returncode == 0 and len(fetch_stdout) > 0:
+                print(f"[{datetime.now()}] Successfully fetched thumbnail from Storj: {len(fetch_stdout)} bytes")
+                return True, fetch_stdout, f"Success (path: {thumbnail_path})"
+            else:
+                error_msg = fetch_stderr.decode('utf-8') if fetch_stderr else "Unknown error"
+                print(f"[{datetime.now()}] Failed to fetch thumbnail: {error_msg}")
+                # 索引が古い可能性があるため次回は一覧を取り直す
+                self.thumbnail_resolver.invalidate(bucket_name, dir_name)
+                return False, b"", error_msg
+
+        except asyncio.TimeoutError:
+            return False, b"", "rclone command timed out"
+        except Exception as e:
+            print(f"Error in get_storj_thumbnail_by_prefix: {str(e)}")
+            return False, b"", str(e)
@@ -0,0 +1,138 @@
+"""
+Storj Container (KEDA HTTP) trigger coordinator.
+
+Storj Container の /process エンドポイントへの起動リクエストを非同期で送る。
+短い時間窓内のトリガー要求はデバウンスして1回の起動にまとめ、
+処理中（起動済み）のコンテナには重ねて要求を送らず、完了後に1回だけ再実行する。
+"""
+import asyncio
+import os
+import time
+from typing import Optional, Tuple
+
+import httpx
+
+
+class StorjTriggerCoordinator:
+    """Storj Container への起動トリガーをまとめて非同期送信する"""
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        debounce_seconds: Optional[float] = None,
+        timeout: Optional[float] = None
+    ):
+        self.url = url if url is not None else os.getenv("STORJ_CONTAINER_URL", "")
+        self.debounce_seconds = debounce_seconds if debounce_seconds is not None else float(
+            os.getenv("STORJ_TRIGGER_DEBOUNCE_SECONDS", "2.0")
+        )
+        # KEDA HTTP scaler can take 30-60 seconds to spin up a replica from 0; allow 90s timeout
+        self.timeout = timeout if timeout is not None else float(os.getenv("STORJ_TRIGGER_TIMEOUT", "90"))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._debounce_task: Optional[asyncio.Task] = None
+        self._wake_task: Optional[asyncio.Task] = None
+        self._rerun_requested = False
+        self._last_result: Tuple[bool, str] = (False, "not triggered yet")
+        self._stats = {
+            "requested": 0,
+            "coalesced": 0,
+            "sent": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "last_triggered_at": None,
+            "last_duration_seconds": None,
+        }
+
+    @property
+    def is_processor_awake(self) -> bool:
+        """起動リクエストが処理中（= Storj Container が稼働中）かどうか"""
+        return self._wake_task is not None and not self._wake_task.done()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Keep-alive 接続をプールして再利用する
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=10.0),
+                limits=httpx.Limits(max_connections=2, max_keepalive_connections=2)
+            )
+        return self._client
+
+    def request_trigger(self) -> None:
+        """
+        トリガーを要求する（ノンブロッキング）。
+        デバウンス時間内の要求は1回の起動にまとめられる。
+        """
+        self._stats["requested"] += 1
+        if not self.url:
+            return
+        if self._debounce_task is not None and not self._debounce_task.done():
+            self._stats["coalesced"] += 1
+            return
+        self._debounce_task = asyncio.create_task(self._debounced_wake())
+
+    async def trigger_now(self) -> Tuple[bool, str]:
+        """
+        即座にトリガーし、結果を待って返す。
+        既に起動中の場合はその完了（必要なら再実行）を待つ。
+        """
+        self._stats["requested"] += 1
+        if not self.url:
+            print("STORJ_CONTAINER_URL not set; skipping trigger")
+            return False, "STORJ_CONTAINER_URL not set"
+        if self._debounce_task is not None and not self._debounce_task.done():
+            self._debounce_task.cancel()
+        return await asyncio.shield(self._ensure_wake())
+
+    async def _debounced_wake(self):
+        await asyncio.sleep(self.debounce_seconds)
+        # 起動タスクの完了は待たない（デバウンスのキャンセルが起動処理に伝播しないように）
+        self._ensure_wake()
+
+    def _ensure_wake(self) -> asyncio.Task:
+        if self.is_processor_awake:
+            # 処理中のコンテナには重ねて送らず、完了後に1回だけ再実行する
+            self._rerun_requested = True
+            self._stats["coalesced"] += 1
+            return self._wake_task
+        self._wake_task = asyncio.create_task(self._run_wakes())
+        return self._wake_task
+
+    async def _run_wakes(self) -> Tuple[bool, str]:
+        while True:
+            self._rerun_requested = False
+            self._last_result = await self._send()
+            if not self._rerun_requested:
+                return self._last_result
+
+    async def _send(self) -> Tuple[bool, str]:
+        self._stats["sent"] += 1
+        self._stats["last_triggered_at"] = time.time()
+        started = time.perf_counter()
+        try:
+            response = await self._get_client().post(self.url)
+            response.raise_for_status()
+            self._stats["succeeded"] += 1
+            print(f"Triggered Storj processor via HTTP: {self.url}")
+            return True, "triggered"
+        except Exception as e:
+            self._stats["failed"] += 1
+            print(f"Failed to trigger Storj processor: {e}")
+            return False, str(e)
+        finally:
+            self._stats["last_duration_seconds"] = round(time.perf_counter() - started, 3)
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "configured": bool(self.url),
+            "processor_awake": self.is_processor_awake,
+            "rerun_pending": self._rerun_requested,
+        }
+
+    async def aclose(self):
+        for task in (self._debounce_task, self._wake_task):
+            if task is not None and not task.done():
+                task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,141 @@
+"""
+Async streaming adapters for video responses.
+
+動画レスポンスを asyncio で読み出すアダプター。
+- rclone のサブプロセス出力・同期イテレーター（Blob のダウンロード）をイベントループ上で読む
+- 読み出しは送信が終わってから次のチャンクを読むため、クライアントの受信速度に合わせて
+  rclone / Blob 側も待たされる（バックプレッシャー）
+- クライアントが切断した場合（シーク時のプレイヤーなど）は rclone を kill し、Blob の読み出しを止める
+- 途中で破棄されたストリームについて、取得したが送れなかったバイト数を記録する
+"""
+import asyncio
+import os
+import signal
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StreamTransfer:
+    """1本のストリームの転送量（read_bytes: 取得元から読んだ量 / sent_bytes: クライアントへ渡した量）"""
+
+    def __init__(self, expected_bytes: Optional[int] = None):
+        self.expected_bytes = expected_bytes
+        self.read_bytes = 0
+        self.sent_bytes = 0
+
+
+async def subprocess_stream(
+    cmd: List[str],
+    env: dict,
+    cwd: str,
+    transfer: StreamTransfer,
+    chunk_size: int = STREAM_CHUNK_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    サブプロセスの標準出力を非同期に読み出す。
+    途中で閉じられた・キャンセルされた場合はプロセスグループごと kill する。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    finished = False
+    try:
+        while True:
+            chunk = await proc.stdout.read(chunk_size)
+            if not chunk:
+                break
+            transfer.read_bytes += len(chunk)
+            yield chunk
+        finished = True
+        stderr = await proc.stderr.read()
+        return_code = await proc.wait()
+        if return_code != 0:
+            error_detail = stderr.decode("utf-8", errors="ignore") if stderr else ""
+            print(f"rclone cat failed: {error_detail or return_code}")
+    finally:
+        if not finished and proc.returncode is None:
+            # キャンセル中は await できないことがあるため、kill は同期的に行う（回収は asyncio の子プロセス監視に任せる）
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+async def blocking_iterator_stream(
+    iterator: Iterator[bytes],
+    run: Callable[..., Awaitable],
+    transfer: StreamTransfer
+) -> AsyncIterator[bytes]:
+    """
+    同期イテレーター（Blob の downloader.chunks() など）を Executor 上で1チャンクずつ読み出す。
+    閉じられた時点で次のチャンクの取得をやめる。
+    """
+    sentinel = object()
+    try:
+        while True:
+            chunk = await run(next, iterator, sentinel)
+            if chunk is sentinel:
+                break
+            transfer.read_bytes += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            try:
+                close()
+            except ValueError:
+                # キャンセル時に Executor 上でまだ next() を実行中の場合（その1チャンクで止まる）
+                pass
+
+
+class StreamMonitor:
+    """ストリームの送信量・破棄量の集計"""
+
+    def __init__(self):
+        self.active = 0
+        self._stats = {
+            "started": 0,
+            "completed": 0,
+            "abandoned": 0,
+            "sent_bytes": 0,
+            # 取得元から読んだがクライアントへ送れなかったバイト数
+            "wasted_bytes": 0,
+            # 切断時点で未取得だったため取得せずに済んだバイト数
+            "avoided_bytes": 0,
+        }
+
+    async def track(self, source: AsyncIterator[bytes], transfer: StreamTransfer) -> AsyncIterator[bytes]:
+        """source を中継しながら転送量を記録する（閉じられたら source も閉じる）"""
+        self.active += 1
+        self._stats["started"] += 1
+        completed = False
+        try:
+            async for chunk in source:
+                yield chunk
+                transfer.sent_bytes += len(chunk)
+            completed = True
+        finally:
+            self.active -= 1
+            self._stats["sent_bytes"] += transfer.sent_bytes
+            # 全量を送った後（rclone の終了待ちなど）に切断された場合は完了として扱う
+            if transfer.expected_bytes is not None and transfer.sent_bytes >= transfer.expected_bytes:
+                completed = True
+            if completed:
+                self._stats["completed"] += 1
+            else:
+                self._stats["abandoned"] += 1
+                # 読み出し量を数えない取得元（ブロックキャッシュ）は送信量を読み出し量とみなす
+                read_bytes = max(transfer.read_bytes, transfer.sent_bytes)
+                self._stats["wasted_bytes"] += read_bytes - transfer.sent_bytes
+                if transfer.expected_bytes is not None:
+                    self._stats["avoided_bytes"] += max(transfer.expected_bytes - read_bytes, 0)
+                await source.aclose()
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "active": self.active}
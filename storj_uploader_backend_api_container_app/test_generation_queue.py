@@ -0,0 +1,37 @@
+"""PriorityGenerationQueue の待機中キャンセルの回帰テスト"""
+import asyncio
+
+from generation_queue import PriorityGenerationQueue, ViewportTracker
+
+
+def test_waiter_cancelled_while_slot_frees():
+    """
+    実行枠が空くのと同じループの周回で待機中のジョブがキャンセルされても
+    （single flight の最後のクライアントの切断）、キャンセル済みの ready を確定させず、
+    実行数・待ち数を崩さない。
+    """
+    async def scenario():
+        queue = PriorityGenerationQueue("test", ViewportTracker(), max_concurrency=1, max_queue=10)
+        gate = asyncio.Event()
+
+        async def work(value):
+            await gate.wait()
+            return value
+
+        running = asyncio.create_task(queue.run("a.jpg", None, work, "a"))
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(queue.run("b.jpg", None, work, "b"))
+        await asyncio.sleep(0)
+
+        gate.set()
+        waiting.cancel()
+        results = await asyncio.gather(running, waiting, return_exceptions=True)
+        assert results[0] == "a"
+        assert isinstance(results[1], asyncio.CancelledError)
+        stats = queue.get_stats()
+        assert (stats["running"], stats["waiting"]) == (0, 0)
+
+        # 後続のジョブも実行される
+        assert await asyncio.wait_for(queue.run("c.jpg", None, work, "c"), timeout=1) == "c"
+
+    asyncio.run(scenario())
@@ -0,0 +1,178 @@
+"""
+Video thumbnail path resolver.
+
+動画 → サムネイルオブジェクトの対応表を月ディレクトリ（thumbnails/YYYYMM/）単位で保持する。
+- 1つの月ディレクトリにつき1回の一覧取得で、その月の全動画のサムネイルパスを解決する
+  （同じ月への同時リクエストは1回の一覧取得を共有する）
+- 同じ動画に複数のサムネイルがある場合は StorjClient._prefer_thumbnail_path の規則で選ぶ
+- サムネイルが存在しない動画は TTL 付きのネガティブキャッシュに記録し、期限内は Storj に問い合わせない
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+_DirKey = Tuple[str, str]
+
+
+def split_thumbnail_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    thumbnails/YYYYMM/{video_stem}_thumb[_{hash}].jpg を (YYYYMM, video_stem の小文字) に分解する。
+    サムネイルでない場合は None。
+    """
+    parts = path.split("/")
+    if len(parts) != 3 or parts[0] != "thumbnails":
+        return None
+    filename = parts[2]
+    lower = filename.lower()
+    if not lower.endswith(".jpg"):
+        return None
+    # 動画名自体に "_thumb" を含む場合があるため、最後の "_thumb"（ハッシュは16進のため含まない）で分ける
+    thumb_index = lower.rfind("_thumb")
+    if thumb_index <= 0:
+        return None
+    return parts[1], lower[:thumb_index]
+
+
+class ThumbnailResolver:
+    """月ディレクトリ単位のサムネイルパス索引 + ネガティブキャッシュ"""
+
+    def __init__(
+        self,
+        list_dir: Callable[[str, str], Awaitable[Optional[List[str]]]],
+        prefer: Callable[[Optional[str], str], str],
+        index_ttl: Optional[float] = None,
+        negative_ttl: Optional[float] = None
+    ):
+        """
+        list_dir(bucket, dir_name): thumbnails/{dir_name}/ 直下のファイル名一覧（失敗時は None）
+        prefer(current, candidate): 同じ動画のサムネイル候補から優先するパスを返す
+        """
+        self.list_dir = list_dir
+        self.prefer = prefer
+        self.index_ttl = index_ttl or float(os.getenv("THUMBNAIL_INDEX_TTL_SECONDS", "300"))
+        self.negative_ttl = negative_ttl or float(os.getenv("THUMBNAIL_NEGATIVE_TTL_SECONDS", "600"))
+        # (bucket, YYYYMM) -> (構築時刻, {video_stem の小文字: サムネイルパス})
+        self._index: Dict[_DirKey, Tuple[float, Dict[str, str]]] = {}
+        # (bucket, YYYYMM, video_stem の小文字) -> 期限
+        self._negative: Dict[Tuple[str, str, str], float] = {}
+        self._dir_locks: Dict[_DirKey, asyncio.Lock] = {}
+        # ギャラリー一覧（rclone バルクヘッドのスレッド）からも更新されるため
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0,
+            "index_hits": 0,
+            "listings": 0,
+            "listing_failures": 0,
+            "negative_hits": 0,
+            "seeded_dirs": 0,
+        }
+
+    def is_known_missing(self, bucket: str, dir_name: str, video_stem: str) -> bool:
+        """サムネイルが存在しないことが分かっている（ネガティブキャッシュが有効）か"""
+        key = (bucket, dir_name, video_stem.lower())
+        with self._lock:
+            expires = self._negative.get(key)
+            if expires is None:
+                return False
+            if expires <= time.time():
+                del self._negative[key]
+                return False
+            self._stats["negative_hits"] += 1
+            return True
+
+    def mark_missing(self, bucket: str, dir_name: str, video_stem: str):
+        with self._lock:
+            self._negative[(bucket, dir_name, video_stem.lower())] = time.time() + self.negative_ttl
+
+    def forget_missing(self, bucket: str, dir_name: str, video_stem: str):
+        """ネガティブキャッシュを解除する（生成を取り消した動画を次の表示時に再度生成するため）"""
+        with self._lock:
+            self._negative.pop((bucket, dir_name, video_stem.lower()), None)
+
+    def _fresh_entries(self, key: _DirKey) -> Optional[Dict[str, str]]:
+        entry = self._index.get(key)
+        if entry and time.time() - entry[0] < self.index_ttl:
+            return entry[1]
+        return None
+
+    async def resolve(self, bucket: str, dir_name: str, video_stem: str) -> Optional[str]:
+        """
+        動画のサムネイルパスを返す（存在しない場合は None を返し、ネガティブキャッシュに記録する）。
+        一覧取得に失敗した場合は例外ではなく None を返し、ネガティブキャッシュには記録しない。
+        """
+        self._stats["lookups"] += 1
+        stem = video_stem.lower()
+        key = (bucket, dir_name)
+        with self._lock:
+            entries = self._fresh_entries(key)
+        if entries is not None:
+            self._stats["index_hits"] += 1
+        else:
+            lock = self._dir_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                with self._lock:
+                    entries = self._fresh_entries(key)
+                if entries is None:
+                    names = await self.list_dir(bucket, dir_name)
+                    self._stats["listings"] += 1
+                    if names is None:
+                        self._stats["listing_failures"] += 1
+                        return None
+                    entries = self._store_dir(key, (f"thumbnails/{dir_name}/{name}" for name in names))
+
+        path = entries.get(stem)
+        if path is None:
+            self.mark_missing(bucket, dir_name, stem)
+        return path
+
+    def _store_dir(self, key: _DirKey, paths: Iterable[str]) -> Dict[str, str]:
+        entries: Dict[str, str] = {}
+        for path in paths:
+            parsed = split_thumbnail_path(path)
+            if parsed and parsed[0] == key[1]:
+                entries[parsed[1]] = self.prefer(entries.get(parsed[1]), path)
+        with self._lock:
+            self._index[key] = (time.time(), entries)
+        return entries
+
+    def seed(self, bucket: str, paths: Iterable[str], dir_names: Iterable[str] = ()):
+        """
+        バケット全体の一覧（ギャラリー一覧の取得結果）から索引を構築する。
+        dir_names にはサムネイルが1件もない月も含めて、一覧に含まれる全ての月を渡す。
+        """
+        grouped: Dict[str, List[str]] = {name: [] for name in dir_names}
+        for path in paths:
+            parsed = split_thumbnail_path(path)
+            if parsed:
+                grouped.setdefault(parsed[0], []).append(path)
+        for dir_name, dir_paths in grouped.items():
+            self._store_dir((bucket, dir_name), dir_paths)
+        self._stats["seeded_dirs"] += len(grouped)
+
+    def add(self, bucket: str, thumbnail_path: str):
+        """生成・アップロードしたサムネイルを索引に反映し、ネガティブキャッシュを解除する"""
+        parsed = split_thumbnail_path(thumbnail_path)
+        if not parsed:
+            return
+        dir_name, stem = parsed
+        with self._lock:
+            self._negative.pop((bucket, dir_name, stem), None)
+            entry = self._index.get((bucket, dir_name))
+            if entry:
+                entry[1][stem] = self.prefer(entry[1].get(stem), thumbnail_path)
+
+    def invalidate(self, bucket: str, dir_name: str):
+        """索引の月ディレクトリを破棄する（索引のパスが取得できなかった場合など）"""
+        with self._lock:
+            self._index.pop((bucket, dir_name), None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            negative = sum(1 for expires in self._negative.values() if expires > time.time())
+            return {
+                **self._stats,
+                "indexed_dirs": len(self._index),
+                "negative_entries": negative,
+            }
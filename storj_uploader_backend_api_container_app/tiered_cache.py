@@ -0,0 +1,591 @@
+"""
+Tiered thumbnail cache.
+
+サムネイル（および派生画像）のキャッシュ。
+- L1: プロセス内のバイト数上限付き LRU
+- L2: ローカルディスク上のサイズ上限付きストア
+    キーの SHA-256 でシャーディング（{root}/ab/cd/{hash}）し、衝突しないキーで保存する。
+    各エントリはペイロードの SHA-256 を先頭に持ち、読み込み時に検証する（破損時は削除してミス扱い）。
+    容量は同じディレクトリを使う全ワーカーの合計で管理する。定期処理の担当ワーカーが prune() でディスク上の
+    実際の使用量を測り、更新時刻の古いエントリ（ヒット時に更新時刻を進める）から削除する（LRU）。
+    TinyLFU（Count-Min Sketch による頻度推定）で満杯時の新規エントリの受け入れを判定する。
+    ヒット時は開いたエントリを返し、API はファイルのまま（RangeFileResponse で）返す。
+    チェックサムの検証はプロセス内でエントリごとに初回のみ行う。
+- 共有層: File Share 上のレプリカ間共有ストア（ローカル層の後ろ）
+    読み込みはリードスルー（ヒット時にローカル層へ格納）、書き込みはライトビハインド（応答後に非同期で公開）。
+    一時ファイルに書いてからリネームするため、他のレプリカが書きかけのエントリを読むことはない。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, Dict, NamedTuple, Optional, Set, Union
+
+_ENTRY_MAGIC = b"TC1\n"
+_CHECKSUM_SIZE = 32
+# DiskCache.prune が測った使用量（他のワーカーが満杯かどうかの判定に使う）
+_USAGE_FILE = ".usage"
+
+
+class CachedFile(NamedTuple):
+    """開いたディスク上のエントリと、その中のペイロードの開始位置（ファイルのまま返すため。使い終わったら閉じる）"""
+    file: BinaryIO
+    offset: int
+
+
+def cache_key_hash(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _shard_path(root: Path, key_hash: str) -> Path:
+    return root / key_hash[:2] / key_hash[2:4] / key_hash
+
+
+def _encode_entry(data: bytes) -> bytes:
+    return _ENTRY_MAGIC + hashlib.sha256(data).digest() + data
+
+
+def _decode_entry(raw: bytes) -> Optional[bytes]:
+    """チェックサムを検証してペイロードを返す（不一致の場合は None）"""
+    payload = raw[len(_ENTRY_MAGIC) + _CHECKSUM_SIZE:]
+    checksum = raw[len(_ENTRY_MAGIC):len(_ENTRY_MAGIC) + _CHECKSUM_SIZE]
+    if not raw.startswith(_ENTRY_MAGIC) or hashlib.sha256(payload).digest() != checksum:
+        return None
+    return payload
+
+
+class FrequencySketch:
+    """TinyLFU 用の Count-Min Sketch（一定回数ごとに全カウンタを半減させて古い頻度を減衰）"""
+
+    def __init__(self, width: int = 16384, depth: int = 4, reset_after: Optional[int] = None):
+        self.width = width
+        self.depth = depth
+        self.reset_after = reset_after or width * 10
+        self._rows = [bytearray(width) for _ in range(depth)]
+        self._additions = 0
+
+    def _indexes(self, key_hash: str):
+        for row in range(self.depth):
+            yield row, int(key_hash[row * 8:(row + 1) * 8], 16) % self.width
+
+    def increment(self, key_hash: str):
+        for row, index in self._indexes(key_hash):
+            if self._rows[row][index] < 255:
+                self._rows[row][index] += 1
+        self._additions += 1
+        if self._additions >= self.reset_after:
+            for row in self._rows:
+                for index in range(self.width):
+                    row[index] >>= 1
+            self._additions //= 2
+
+    def estimate(self, key_hash: str) -> int:
+        return min(self._rows[row][index] for row, index in self._indexes(key_hash))
+
+
+class MemoryLRU:
+    """バイト数上限付きのプロセス内 LRU"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= len(previous)
+        self._entries[key] = data
+        self.current_bytes += len(data)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, key: str):
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.current_bytes -= len(data)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """サイズ上限付き・ハッシュシャーディング・チェックサム付きのディスクキャッシュ"""
+
+    def __init__(self, root: Path, max_bytes: int, admission: bool = True):
+        """admission=False の場合は TinyLFU による受け入れ判定をせず純粋な LRU として動作する"""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.admission = admission
+        # 直近に測ったディスク上の使用量（全ワーカー合計）+ その後このワーカーが書き込んだ量
+        self.current_bytes = 0
+        self.measured_at: Optional[float] = None
+        # このワーカーが把握しているエントリ: key_hash -> サイズ（アクセス順。先頭が最も古い）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._sketch = FrequencySketch()
+        # このプロセスで書き込んだ・チェックサムを検証済みのエントリ
+        self._verified: Set[str] = set()
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._stats = {"evictions": 0, "rejected": 0, "corrupted": 0}
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key_hash: str) -> Path:
+        return _shard_path(self.root, key_hash)
+
+    @staticmethod
+    def _touch(path: Path):
+        """prune() は更新時刻の古い順に削除するため、参照されたエントリは更新時刻を進める"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _forget(self, key_hash: str):
+        """他のワーカーの prune で削除されていたエントリをインデックスから外す"""
+        with self._lock:
+            self._index.pop(key_hash, None)
+            self._verified.discard(key_hash)
+
+    def load(self) -> int:
+        """
+        既存エントリを走査してインデックスを構築する（起動時にスレッドで実行）。
+        旧形式（シャーディングされていないフラットなファイル）は削除する。
+        """
+        entries = []
+        for path in self.root.iterdir():
+            if path.is_file() and path.name != _USAGE_FILE:
+                path.unlink(missing_ok=True)
+        for path in self.root.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.endswith(".tmp"):
+                # 他のワーカーが書き込み中の一時ファイルは残す（異常終了で残ったものだけ削除する）
+                if time.time() - stat.st_mtime > 600:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_atime, path.name, stat.st_size))
+        entries.sort()
+        with self._lock:
+            for _, key_hash, size in entries:
+                if key_hash not in self._index:
+                    self._index[key_hash] = size
+            self.current_bytes = sum(size for _, _, size in entries)
+            self.measured_at = time.time()
+            self.loaded = True
+        return len(entries)
+
+    def prune(self, temp_max_age: float = 600) -> int:
+        """
+        ディスク上の実際の使用量（他のワーカーが書き込んだエントリを含む）を測り、上限を超えていれば
+        更新時刻の古いエントリから削除する（スレッドで実行。定期処理の担当ワーカーだけが呼ぶ）。
+        測った使用量は他のワーカーが refresh_usage() で読み込む。
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for path in self.root.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.endswith(".tmp"):
+                if now - stat.st_mtime > temp_max_age:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+            total += stat.st_size
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                self._forget(path.name)
+                total -= size
+                removed += 1
+        with self._lock:
+            self.current_bytes = total
+            self.measured_at = now
+            self._stats["evictions"] += removed
+        usage_path = self.root / _USAGE_FILE
+        temp = usage_path.with_name(f"{_USAGE_FILE}.{os.getpid()}.tmp")
+        try:
+            temp.write_text(json.dumps({"bytes": total, "measured_at": now}), encoding="utf-8")
+            temp.replace(usage_path)
+        except OSError as e:
+            print(f"Failed to write disk cache usage {usage_path}: {e}")
+        return removed
+
+    def refresh_usage(self):
+        """担当ワーカーの prune() が測った使用量を読み込む（担当以外のワーカーが定期的に呼ぶ）"""
+        try:
+            usage = json.loads((self.root / _USAGE_FILE).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            if self.measured_at is None or usage["measured_at"] > self.measured_at:
+                self.current_bytes = usage["bytes"]
+                self.measured_at = usage["measured_at"]
+
+    def contains(self, key_hash: str) -> bool:
+        """エントリの有無（インデックスのみを参照。読み込み・検証はしない）"""
+        with self._lock:
+            if key_hash in self._index:
+                return True
+            if self.loaded:
+                return False
+        return self._path(key_hash).exists()
+
+    def get(self, key_hash: str) -> Optional[bytes]:
+        with self._lock:
+            self._sketch.increment(key_hash)
+        path = self._path(key_hash)
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            self._forget(key_hash)
+            return None
+        payload = _decode_entry(raw)
+        if payload is None:
+            print(f"Corrupted thumbnail cache entry removed: {path}")
+            self.remove(key_hash)
+            self._stats["corrupted"] += 1
+            return None
+        with self._lock:
+            self._verified.add(key_hash)
+            if key_hash in self._index:
+                self._index.move_to_end(key_hash)
+            else:
+                self._index[key_hash] = len(raw)
+        self._touch(path)
+        return payload
+
+    def open(self, key_hash: str) -> Optional[CachedFile]:
+        """
+        エントリを開いてペイロードの開始位置とともに返す（読み込まずにファイルとして返すため）。
+        未検証のエントリは一度だけ読み込んでチェックサムを検証する。
+        開いた後に追い出されても（unlink）、開いたファイルからは最後まで読める。
+        """
+        with self._lock:
+            verified = key_hash in self._verified
+            if verified:
+                self._sketch.increment(key_hash)
+                if key_hash in self._index:
+                    self._index.move_to_end(key_hash)
+        if not verified and self.get(key_hash) is None:
+            return None
+        path = self._path(key_hash)
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            self._forget(key_hash)
+            return None
+        if verified:
+            self._touch(path)
+        return CachedFile(file, len(_ENTRY_MAGIC) + _CHECKSUM_SIZE)
+
+    def put(self, key_hash: str, data: bytes) -> bool:
+        size = len(_ENTRY_MAGIC) + _CHECKSUM_SIZE + len(data)
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            self._sketch.increment(key_hash)
+            if key_hash in self._index:
+                self._index.move_to_end(key_hash)
+                return True
+            # TinyLFU: 満杯時は追い出し候補より頻度の低い新規エントリを受け入れない
+            if self.admission and self.current_bytes + size > self.max_bytes and self._index:
+                victim = next(iter(self._index))
+                if self._sketch.estimate(key_hash) < self._sketch.estimate(victim):
+                    self._stats["rejected"] += 1
+                    return False
+
+        path = self._path(key_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{key_hash}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp.write_bytes(_encode_entry(data))
+        temp.replace(path)
+
+        with self._lock:
+            self._verified.add(key_hash)
+            if key_hash not in self._index:
+                self._index[key_hash] = size
+                self.current_bytes += size
+        return True
+
+    def remove(self, key_hash: str):
+        with self._lock:
+            size = self._index.pop(key_hash, None)
+            if size is not None:
+                self.current_bytes = max(self.current_bytes - size, 0)
+            self._verified.discard(key_hash)
+        self._path(key_hash).unlink(missing_ok=True)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            **self._stats,
+            "entries": len(self._index),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "measured_at": self.measured_at,
+            "loaded": self.loaded,
+        }
+
+
+class SharedCache:
+    """
+    File Share 上のレプリカ間共有キャッシュ。
+    複数のレプリカが同時に読み書きするため、プロセス内のインデックスは持たず、
+    容量の管理は prune()（更新時刻の古い順に削除）で定期的に行う。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stats = {"publishes": 0, "corrupted": 0, "pruned": 0, "last_prune_bytes": None}
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key_hash: str) -> Optional[bytes]:
+        path = _shard_path(self.root, key_hash)
+        try:
+            raw = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        payload = _decode_entry(raw)
+        if payload is None:
+            print(f"Corrupted shared thumbnail cache entry removed: {path}")
+            path.unlink(missing_ok=True)
+            self._stats["corrupted"] += 1
+            return None
+        # prune() は更新時刻の古い順に削除するため、参照されたエントリは更新時刻を進める
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return payload
+
+    def put(self, key_hash: str, data: bytes) -> bool:
+        """
+        一時ファイルに書き込んでからリネームして公開する（アトミック）。
+        同じキーは同じ内容になるため、既に他のレプリカが公開済みなら書き込まない。
+        """
+        path = _shard_path(self.root, key_hash)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(f"{key_hash}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            temp.write_bytes(_encode_entry(data))
+            os.replace(temp, path)
+        finally:
+            temp.unlink(missing_ok=True)
+        self._stats["publishes"] += 1
+        return True
+
+    def remove(self, key_hash: str):
+        _shard_path(self.root, key_hash).unlink(missing_ok=True)
+
+    def prune(self, temp_max_age: float = 3600) -> int:
+        """
+        容量上限を超えている場合に更新時刻の古いエントリから削除する（スレッドで実行）。
+        書き込みが中断された一時ファイルも削除する。
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for path in self.root.glob("*/*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if path.name.endswith(".tmp"):
+                if now - stat.st_mtime > temp_max_age:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+            total += stat.st_size
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _, path, size in entries:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+        self._stats["pruned"] += removed
+        self._stats["last_prune_bytes"] = total
+        return removed
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "max_bytes": self.max_bytes}
+
+
+class TieredThumbnailCache:
+    """L1（メモリ LRU）+ L2（ディスク）+ 共有層（File Share、任意）のサムネイルキャッシュ"""
+
+    def __init__(
+        self,
+        disk_dir: Path,
+        memory_bytes: Optional[int] = None,
+        disk_bytes: Optional[int] = None,
+        shared_dir: Optional[Path] = None,
+        shared_bytes: Optional[int] = None,
+        max_pending_writes: Optional[int] = None
+    ):
+        memory_bytes = memory_bytes or int(os.getenv("THUMBNAIL_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+        disk_bytes = disk_bytes or int(os.getenv("THUMBNAIL_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+        shared_bytes = shared_bytes or int(os.getenv("THUMBNAIL_SHARED_CACHE_BYTES", str(10 * 1024 * 1024 * 1024)))
+        self.max_pending_writes = max_pending_writes or int(os.getenv("THUMBNAIL_SHARED_CACHE_PENDING_WRITES", "64"))
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskCache(disk_dir, disk_bytes)
+        self.shared = SharedCache(shared_dir, shared_bytes) if shared_dir else None
+        self._pending_writes: Set[asyncio.Task] = set()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "puts": 0,
+            "shared_writes_dropped": 0,
+        }
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self.memory.get(key)
+        if data is not None:
+            self._stats["memory_hits"] += 1
+            return data
+        key_hash = cache_key_hash(key)
+        data = await asyncio.to_thread(self.disk.get, key_hash)
+        if data is not None:
+            self._stats["disk_hits"] += 1
+            self.memory.put(key, data)
+            return data
+        data = await self._get_shared(key, key_hash)
+        if data is not None:
+            return data
+        self._stats["misses"] += 1
+        return None
+
+    async def _get_shared(self, key: str, key_hash: str) -> Optional[bytes]:
+        if self.shared is None:
+            return None
+        try:
+            data = await asyncio.to_thread(self.shared.get, key_hash)
+        except OSError as e:
+            print(f"Failed to read shared thumbnail cache entry for {key}: {e}")
+            return None
+        if data is not None:
+            # リードスルー: 他のレプリカが生成したエントリをローカル層に格納する
+            self._stats["shared_hits"] += 1
+            self.memory.put(key, data)
+            await self._put_disk(key, key_hash, data)
+        return data
+
+    def contains(self, key: str) -> bool:
+        """メモリ層・ディスク層にエントリがあるか（読み込み・検証はしない。先読みの要否の判定用）"""
+        return key in self.memory or self.disk.contains(cache_key_hash(key))
+
+    async def get_for_response(self, key: str) -> Union[bytes, CachedFile, None]:
+        """
+        レスポンス用の取得。メモリ層・共有層のヒットは bytes、
+        ディスク層のヒットはファイルのまま返すために開いたエントリ（CachedFile）を返す
+        （ディスク層のヒットはメモリ層に格納しない。繰り返しの読み込みは OS のページキャッシュに任せる）
+        """
+        data = self.memory.get(key)
+        if data is not None:
+            self._stats["memory_hits"] += 1
+            return data
+        key_hash = cache_key_hash(key)
+        opened = await asyncio.to_thread(self.disk.open, key_hash)
+        if opened is not None:
+            self._stats["disk_hits"] += 1
+            return opened
+        data = await self._get_shared(key, key_hash)
+        if data is not None:
+            return data
+        self._stats["misses"] += 1
+        return None
+
+    async def _put_disk(self, key: str, key_hash: str, data: bytes):
+        try:
+            await asyncio.to_thread(self.disk.put, key_hash, data)
+        except OSError as e:
+            print(f"Failed to write thumbnail cache entry for {key}: {e}")
+
+    async def _publish_shared(self, key: str, key_hash: str, data: bytes):
+        try:
+            await asyncio.to_thread(self.shared.put, key_hash, data)
+        except OSError as e:
+            print(f"Failed to publish shared thumbnail cache entry for {key}: {e}")
+
+    async def put(self, key: str, data: bytes):
+        if not data:
+            return
+        self._stats["puts"] += 1
+        key_hash = cache_key_hash(key)
+        self.memory.put(key, data)
+        await self._put_disk(key, key_hash, data)
+        if self.shared is None:
+            return
+        # ライトビハインド: 共有層への公開は待たない（File Share が遅い場合は上限を超えた分を破棄）
+        if len(self._pending_writes) >= self.max_pending_writes:
+            self._stats["shared_writes_dropped"] += 1
+            return
+        task = asyncio.create_task(self._publish_shared(key, key_hash, data))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+
+    async def invalidate(self, key: str):
+        key_hash = cache_key_hash(key)
+        self.memory.discard(key)
+        await asyncio.to_thread(self.disk.remove, key_hash)
+        if self.shared is not None:
+            await asyncio.to_thread(self.shared.remove, key_hash)
+
+    async def flush(self):
+        """書き込み待ちの共有層への公開を完了させる（シャットダウン時）"""
+        if self._pending_writes:
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        hits = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["shared_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory": {
+                "entries": len(self.memory),
+                "bytes": self.memory.current_bytes,
+                "max_bytes": self.memory.max_bytes,
+                "evictions": self.memory.evictions,
+            },
+            "disk": self.disk.get_stats(),
+            "shared": {
+                **self.shared.get_stats(),
+                "pending_writes": len(self._pending_writes),
+            } if self.shared is not None else None,
+        }
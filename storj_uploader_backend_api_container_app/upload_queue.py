@@ -23,21 +23,27 @@ class UploadQueue:
 
     def add_upload_request(
         self,
-        file_path: Path,
+        file_path: Optional[Path],
         file_name: str,
         file_size: int,
         content_type: str,
         saved_as: Optional[str] = None,
-        original_name: Optional[str] = None
+        original_name: Optional[str] = None,
+        blob_name: Optional[str] = None,
+        md5: Optional[str] = None,
+        sha256: Optional[str] = None
     ) -> str:
         """
         Add upload request to queue.
 
         Args:
-            file_path: Path to the file in files directory
+            file_path: Path to the file in files directory (None for blob requests)
             file_name: Original filename
             file_size: File size in bytes
             content_type: MIME content type
+            blob_name: Blob name in the upload-target container (direct-to-Blob uploads)
+            md5: MD5 hex digest computed at ingest time (consumers skip re-hashing)
+            sha256: SHA-256 hex digest computed at ingest time
 
         Returns:
             Request ID (UUID)
@@ -47,7 +53,7 @@ class UploadQueue:
 
         request_data = {
             "request_id": request_id,
-            "file_path": str(file_path),
+            "file_path": str(file_path) if file_path else "",
             "file_name": file_name,
             "file_size": file_size,
             "content_type": content_type,
@@ -56,6 +62,12 @@ class UploadQueue:
             "status": "pending",
             "created_at": datetime.utcnow().isoformat(),
         }
+        if blob_name:
+            request_data["blob_name"] = blob_name
+        if md5:
+            request_data["md5"] = md5
+        if sha256:
+            request_data["sha256"] = sha256
 
         with open(request_file, 'w') as f:
             json.dump(request_data, f, indent=2)
@@ -63,6 +75,29 @@ class UploadQueue:
         print(f"Added upload request to queue: {request_id} for file: {file_name}")
         return request_id
 
+    def iter_pending_requests(self):
+        """Yield queued (pending/processing) request records."""
+        for request_file in self.queue_dir.glob("upload-*.json"):
+            try:
+                with open(request_file, 'r') as f:
+                    yield json.load(f)
+            except Exception:
+                continue
+
+    def completed_requests_since(self, since: float) -> list:
+        """Return records moved to processed/ as completed at or after `since` (epoch seconds)."""
+        records = []
+        for request_file in self.processed_dir.glob("upload-*.json"):
+            try:
+                if request_file.stat().st_mtime < since:
+                    continue
+                data = json.loads(request_file.read_text())
+            except Exception:
+                continue
+            if data.get("status") == "completed":
+                records.append(data)
+        return records
+
     def get_pending_count(self) -> int:
         """Get number of pending requests."""
         return len(list(self.queue_dir.glob("upload-*.json")))